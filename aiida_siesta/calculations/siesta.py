@@ -3,11 +3,12 @@ from aiida import orm
 from aiida.common import CalcInfo, CodeInfo
 from aiida.common.constants import elements
 from aiida.engine import CalcJob
-from aiida.orm import Dict, StructureData, BandsData, ArrayData
+from aiida.orm import Dict, StructureData, BandsData, ArrayData, TrajectoryData
 from aiida_siesta.utils.tkdict import FDFDict
 from aiida_siesta.data.psf import PsfData
 from aiida_siesta.data.psml import PsmlData
 from aiida_siesta.data.ion import IonData
+from aiida_siesta.utils.monitor import MONITOR_FILE
 
 # See the LICENSE.txt and AUTHORS.txt files.
 
@@ -155,7 +156,8 @@ def validate_inputs(value, _):
     """
     Validate the entire input namespace. It takes care to ckeck the consistency
     and compatibility of the inputed basis, pseudos, and ions.
-    Also calls the `bandskpoints_warnings` that issues warning about bandskpoints selection.
+    Also calls the `bandskpoints_warnings` that issues warning about bandskpoints selection and
+    the `footprint_warnings` that issues a warning if the estimated memory exceeds the available one.
     """
     import warnings
 
@@ -188,6 +190,72 @@ def validate_inputs(value, _):
         )
         return string_out
 
+    footprint_warnings(value, structure)
+
+
+def footprint_warnings(value, structure):
+    """
+    Warn if the estimated memory of the calculation (see `aiida_siesta.utils.footprint`) exceeds
+    the `max_memory_kb` of the machines, when set in the options.
+    """
+    import warnings
+    from aiida_siesta.utils.footprint import estimate_footprint
+
+    options = value.get('metadata', {}).get('options', {})
+    max_memory_kb = options.get('max_memory_kb')
+    if max_memory_kb is None:
+        return
+
+    resources = options.get('resources', {})
+    procs = resources.get('num_mpiprocs_per_machine', 1)
+    ranks = resources.get('num_machines', 1) * procs
+    basis = value['basis'].get_dict() if 'basis' in value else None
+    footprint = estimate_footprint(
+        structure, value['parameters'].get_dict(), basis, value.get('kpoints'), ranks, value.get('ions')
+    )
+    memory_per_machine = footprint['memory_per_rank'] * procs
+    if memory_per_machine > max_memory_kb / 1024.:
+        warnings.warn(
+            f'The estimated memory per machine ({memory_per_machine:.0f} MB) exceeds the `max_memory_kb` '
+            f'({max_memory_kb / 1024.:.0f} MB), consider increasing `num_machines`'
+        )
+
+
+class SiestaCalcJobNode(orm.CalcJobNode):
+    """
+    Node of the SiestaCalculation. It differs from the standard CalcJobNode only in the hashing:
+    the `parameters` and `basis` inputs are hashed in their canonical form (see
+    `aiida_siesta.utils.fdf_canonical`), so that equivalent fdf inputs written with different
+    spellings, units or booleans produce cache hits. The `prefix` option is ignored as it only
+    determines the names of the files.
+    Note that the `node_type` of the new SiestaCalculations is therefore
+    `process.calculation.calcjob.siesta.SiestaCalcJobNode.`: the CalcJobNodes of the calculations run
+    with previous versions of the plugin are not cache sources for them, and queries on `node_type`
+    (or with `subclassing=False`) must be adapted. The `process_type` is unchanged.
+    """
+
+    # The names of the input dictionaries of fdf keywords
+    _hash_canonical_inputs = ('parameters', 'basis')
+
+    _hash_ignored_attributes = orm.CalcJobNode._hash_ignored_attributes + ('prefix',)
+
+    def _get_objects_to_hash(self):
+        """
+        Substitute the hashes of the fdf dictionaries with the hash of their canonical form.
+        The last object is the dictionary of the hashes of the inputs (see `ProcessNode`).
+        """
+        from aiida.common.hashing import make_hash
+        from aiida_siesta.utils.fdf_canonical import get_canonical_fdf_dict
+
+        objects = super()._get_objects_to_hash()
+        inputs_hashes = objects[-1]
+        for link_label in self._hash_canonical_inputs:
+            if link_label in inputs_hashes:
+                fdf_node = self.get_incoming(link_label_filter=link_label).one().node
+                inputs_hashes[link_label] = make_hash(get_canonical_fdf_dict(fdf_node.get_dict()))
+
+        return objects
+
 
 class SiestaCalculation(CalcJob):
     """
@@ -204,12 +272,22 @@ class SiestaCalculation(CalcJob):
     _DEFAULT_INPUT_FILE = 'aiida.fdf'
     _DEFAULT_OUTPUT_FILE = 'aiida.out'
 
+    # Class attribute: the node class, implementing the hashing of the fdf inputs in canonical form
+    _node_class = SiestaCalcJobNode
+
     # Class attribute: elements to copy from the parent in restarts (fow now, just the density matrix file)
     _restart_copy_from = os.path.join('./', '*.DM')
 
     # Class attribute: in restarts, it will copy the previous elements in the following folder
     _restart_copy_to = './'
 
+    # Class attribute: files copied from the parent to continue an MD run (`MD_RESTART` setting):
+    # the geometry and velocities (.XV) and the state of the integrator (.VERLET_RESTART, .NOSE_RESTART, ...)
+    _md_restart_copy_from = (os.path.join('./', '*.XV'), os.path.join('./', '*_RESTART'))
+
+    # Class attribute: types of run of molecular dynamics, their .ANI and .MDE files are parsed
+    _md_types_of_run = ('verlet', 'nose', 'parrinellorahman', 'noseparrinellorahman', 'anneal')
+
     # Class attribute: blocked keywords
     _readable_blocked = [
         'system-name',
@@ -281,6 +359,9 @@ class SiestaCalculation(CalcJob):
         spec.output('bands', valid_type=BandsData, required=False, help='Optional band structure')
         spec.output('forces_and_stress', valid_type=ArrayData, required=False, help='Optional forces and stress')
         spec.output_namespace('ion_files', valid_type=IonData, dynamic=True, required=False)
+        spec.output(
+            'output_trajectory', valid_type=TrajectoryData, required=False, help='Optional trajectory of an MD run'
+        )
 
         # Option that allows access through node.res should be existing output node and a Dict
         spec.default_output_node = 'output_parameters'
@@ -293,6 +374,8 @@ class SiestaCalculation(CalcJob):
         spec.exit_code(350, 'UNEXPECTED_TERMINATION', message='Statement "Job completed" not detected, unknown error')
         spec.exit_code(449, 'SPLIT_NORM', message='Split_norm parameter too small')
         spec.exit_code(448, 'BASIS_POLARIZ', message='Problems in the polarization of a basis element')
+        spec.exit_code(447, 'WALLTIME_EXCEEDED', message='The calculation was stopped because of the walltime')
+        spec.exit_code(446, 'SCF_DIVERGED', message='Killed by the monitor, the scf was diverging or stagnating')
 
     def initialize(self):
         """
@@ -393,6 +476,7 @@ class SiestaCalculation(CalcJob):
 
         # List of files for restart
         remote_copy_list = []
+        remote_symlink_list = []
 
         # ================ Preprocess of input parameters =================
 
@@ -546,12 +630,29 @@ class SiestaCalculation(CalcJob):
         # to the current calculation's working folder.
         # ISSUE: Is this mechanism flexible enough? An alternative would be to
         # pass the information about which file(s) to copy in the metadata.options dictionary
+        # If the `PARENT_FOLDER_SYMLINK` setting is True, the files are symlinked instead of copied.
+        # This is useful when several calculations restart from the same parent, but they must
+        # not overwrite the parent files (for instance setting `write-dm F`).
+        # If the `MD_RESTART` setting is True, also the files needed to continue an MD run are taken
+        # from the parent. They are always copied, since Siesta overwrites them at each step.
+        md_restart = settings_dict.pop('MD_RESTART', False)
         if parent_calc_folder is not None:
-            remote_copy_list.append((
+            restart_file = (
                 parent_calc_folder.computer.uuid,
                 os.path.join(parent_calc_folder.get_remote_path(), self._restart_copy_from), self._restart_copy_to
-            ))
+            )
+            if settings_dict.pop('PARENT_FOLDER_SYMLINK', False):
+                remote_symlink_list.append(restart_file)
+            else:
+                remote_copy_list.append(restart_file)
             input_params.update({'dm-use-save-dm': "T"})
+            if md_restart:
+                for md_restart_file in self._md_restart_copy_from:
+                    remote_copy_list.append((
+                        parent_calc_folder.computer.uuid,
+                        os.path.join(parent_calc_folder.get_remote_path(), md_restart_file), self._restart_copy_to
+                    ))
+                input_params.update({'md-use-save-xv': "T"})
 
         # ===================================== FDF file creation ====================================
 
@@ -619,9 +720,10 @@ class SiestaCalculation(CalcJob):
         calcinfo.uuid = str(self.uuid)
         calcinfo.local_copy_list = local_copy_list
         calcinfo.remote_copy_list = remote_copy_list
+        calcinfo.remote_symlink_list = remote_symlink_list
         calcinfo.codes_info = [codeinfo]
-        # Retrieve by default: the output file, the xml file, the messages file, and the json timing file.
-        # If bandskpoints, also the bands file is added to the retrieve list.
+        # Retrieve by default: the output file, the xml file, the messages file and the json timing file.
+        # If bandskpoints, also the bands file is added.
         calcinfo.retrieve_list = []
         xml_file = str(metadataoption.prefix) + ".xml"
         bands_file = str(metadataoption.prefix) + ".bands"
@@ -631,10 +733,28 @@ class SiestaCalculation(CalcJob):
         calcinfo.retrieve_list.append(self._MESSAGES_FILE)
         calcinfo.retrieve_list.append(self._BASIS_ENTHALPY_FILE)
         calcinfo.retrieve_list.append("*.ion.xml")
+        # Written only if the calculation is killed by the monitor (see `aiida_siesta.utils.monitor`).
+        # The `MONITOR` key of the settings is only read by the monitor.
+        calcinfo.retrieve_list.append(MONITOR_FILE)
+        settings_dict.pop('MONITOR', None)
+        # The `NON_SCF_BANDS` key of the settings is only read by the parser
+        settings_dict.pop('NON_SCF_BANDS', None)
 
         if bandskpoints is not None:
             calcinfo.retrieve_list.append(bands_file)
 
+        # The saved Hamiltonian (`save-hs` or `ts-hs-save`), used by `aiida_siesta.utils.hamiltonian_tools`
+        if settings_dict.pop('RETRIEVE_HAMILTONIAN', False):
+            calcinfo.retrieve_list.append(str(metadataoption.prefix) + ".HSX")
+            calcinfo.retrieve_list.append(str(metadataoption.prefix) + ".TSHS")
+
+        # The .XV file (the geometry for a restart after the walltime) is parsed in the `output_structure`
+        # and the trajectory of MD runs in the `output_trajectory`, the files are then discarded
+        calcinfo.retrieve_temporary_list = [str(metadataoption.prefix) + ".XV"]
+        if FDFDict.translate_key(str(input_params.get('md-type-of-run', ''))) in self._md_types_of_run:
+            calcinfo.retrieve_temporary_list.append(str(metadataoption.prefix) + ".ANI")
+            calcinfo.retrieve_temporary_list.append(str(metadataoption.prefix) + ".MDE")
+
         if lua_retrieve_list is not None:
             calcinfo.retrieve_list += lua_retrieve_list.get_list()
 
@@ -0,0 +1,99 @@
+"""Implements the `aiida-siesta campaign` command."""
+
+import json
+import click
+
+from aiida.cmdline.utils import decorators, echo
+
+
+def _get_campaign(workchain, structures_group, campaign_group, code, options, protocol, max_active, **kwargs):
+    from aiida.plugins import WorkflowFactory
+    from aiida_siesta.utils.campaign import SubmissionCampaign
+
+    calc_engines = {'siesta': {'code': code, 'options': json.loads(options)}}
+
+    return SubmissionCampaign(
+        WorkflowFactory(workchain), structures_group, campaign_group, calc_engines, protocol, max_active, **kwargs
+    )
+
+
+@click.group('campaign')
+def campaign():
+    """Run a WorkChain on all the structures of a group, with throttled submission."""
+
+
+@campaign.command('submit')
+@click.argument('structures_group', type=click.STRING)
+@click.argument('campaign_group', type=click.STRING)
+@click.option('-X', '--code', 'code', type=click.STRING, required=True, help='Label of the siesta code')
+@click.option('-p', '--protocol', 'protocol', type=click.STRING, default='standard_psml', help='Protocol name')
+@click.option(
+    '-w', '--workchain', 'workchain', type=click.STRING, default='siesta.base', help='Entry point of the WorkChain'
+)
+@click.option(
+    '-o',
+    '--options',
+    'options',
+    type=click.STRING,
+    default='{"max_wallclock_seconds": 3600, "resources": {"num_machines": 1}}',
+    help='The computational options, as a json string'
+)
+@click.option('-r', '--relaxation-type', 'relaxation_type', type=click.STRING, default=None, help='Relaxation type')
+@click.option('-s', '--spin', 'spin', type=click.STRING, default=None, help='Spin option')
+@click.option(
+    '-N', '--max-active', 'max_active', type=click.INT, default=100, help='Maximum active processes on the computer'
+)
+@click.option('-n', '--num-workers', 'num_workers', type=click.INT, default=4, help='Processes running seekpath')
+@click.option('-t', '--sleep', 'sleep_interval', type=click.INT, default=60, help='Seconds between submissions')
+@click.option('--resubmit-failed', is_flag=True, default=False, help='Submit again the structures that failed')
+@click.option('--once', is_flag=True, default=False, help='Fill the free slots once and exit')
+@decorators.with_dbenv()
+def campaign_submit(  # pylint: disable=too-many-arguments
+    structures_group, campaign_group, code, protocol, workchain, options, relaxation_type, spin, max_active,
+    num_workers, sleep_interval, resubmit_failed, once
+):
+    """
+    Submit the WorkChain for the structures in STRUCTURES_GROUP, collecting the processes in CAMPAIGN_GROUP.
+
+    The command can be interrupted and called again: the structures already submitted are skipped.
+    """
+    generator_kwargs = {'relaxation_type': relaxation_type, 'spin': spin}
+    the_campaign = _get_campaign(
+        workchain,
+        structures_group,
+        campaign_group,
+        code,
+        options,
+        protocol,
+        max_active,
+        generator_kwargs=generator_kwargs,
+        num_workers=num_workers,
+        resubmit_failed=resubmit_failed
+    )
+
+    def report(submitted):
+        for uuid, process in submitted.items():
+            echo.echo_info(f'Submitted {process.process_label}<{process.pk}> for structure {uuid}')
+
+    if once:
+        report(the_campaign.submit_new_batch())
+    else:
+        the_campaign.run(sleep_interval, callback=report)
+
+    echo.echo_success('Submission completed. Status: {}'.format(the_campaign.get_status()))
+
+
+@campaign.command('status')
+@click.argument('structures_group', type=click.STRING)
+@click.argument('campaign_group', type=click.STRING)
+@decorators.with_dbenv()
+def campaign_status(structures_group, campaign_group):
+    """
+    Show the state of the campaign collected in CAMPAIGN_GROUP for the structures in STRUCTURES_GROUP.
+    """
+    from aiida import orm
+    from aiida_siesta.utils.campaign import get_campaign_status
+
+    status = get_campaign_status(orm.load_group(structures_group), orm.load_group(campaign_group))
+    for key, value in status.items():
+        echo.echo(f'{key:>12}: {value}')
@@ -24,8 +24,11 @@ def psml():
     default=False,
     help='Interrupt pseudos import if a pseudo was already present in the AiiDA database'
 )
+@click.option(
+    '-n', '--num-workers', 'num_workers', type=click.INT, default=4, help='Threads used to hash and parse the files'
+)
 @decorators.with_dbenv()
-def psml_uploadfamily(folder, group_label, group_description, stop_if_existing):
+def psml_uploadfamily(folder, group_label, group_description, stop_if_existing, num_workers):
     """
     Create a new PSML family from a folder of PSML files.
 
@@ -34,7 +37,17 @@ def psml_uploadfamily(folder, group_label, group_description, stop_if_existing):
     Call without parameters to get some help.
     """
     from aiida_siesta.data.psml import upload_psml_family
-    files_found, files_uploaded = upload_psml_family(folder, group_label, group_description, stop_if_existing)
+
+    with click.progressbar(length=0, label='Uploading PSML files') as progress_bar:
+
+        def update_progress(num_done, num_files):
+            progress_bar.length = num_files
+            progress_bar.update(num_done - progress_bar.pos)
+
+        files_found, files_uploaded = upload_psml_family(
+            folder, group_label, group_description, stop_if_existing, num_workers, update_progress
+        )
+
     echo.echo_success('PSML files found: {}. New files uploaded: {}'.format(files_found, files_uploaded))
 
 
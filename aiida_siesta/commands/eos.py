@@ -0,0 +1,48 @@
+"""Implements the `aiida-siesta eos` command."""
+
+import click
+
+from aiida.cmdline.utils import decorators, echo
+
+
+@click.group('eos')
+def eos():
+    """Analyze the results of EqOfStateFixedCellShape workchains."""
+
+
+@eos.command('fit')
+@click.option(
+    '-G',
+    '--group',
+    'group_label',
+    type=click.STRING,
+    default=None,
+    help='Consider only the EqOfStateFixedCellShape workchains in this group'
+)
+@decorators.with_dbenv()
+def eos_fit(group_label):
+    """
+    Collect the E(V) data of all the finished EqOfStateFixedCellShape workchains and
+    perform the Birch-Murnaghan fit of all of them at once.
+    """
+    from aiida_siesta.workflows.eos import collect_eos_data, delta_project_BM_fit_many
+
+    pks, volumes, energies = collect_eos_data(group_label)
+    if not pks:
+        echo.echo_warning('No finished EqOfStateFixedCellShape workchain found.')
+        return
+
+    energy0, volume0, bulk_modulus0, bulk_deriv0, residuals = delta_project_BM_fit_many(volumes, energies)
+
+    echo.echo(
+        '{:>8} {:>14} {:>16} {:>10} {:>8} {:>10}'.format(
+            'PK', 'Eo(eV/atom)', 'Vo(ang^3/atom)', 'Bo(GPa)', 'B1', 'residuals'
+        )
+    )
+    for index, pk in enumerate(pks):
+        echo.echo(
+            '{:>8} {:>14.6f} {:>16.4f} {:>10.3f} {:>8.3f} {:>10.2e}'.format(
+                pk, energy0[index], volume0[index], bulk_modulus0[index] * 160.21766208, bulk_deriv0[index],
+                residuals[index]
+            )
+        )
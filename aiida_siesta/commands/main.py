@@ -0,0 +1,20 @@
+"""Implements the `aiida-siesta` command line interface."""
+
+import click
+
+from aiida.cmdline.params import options, types
+
+from aiida_siesta.commands.campaign import campaign
+from aiida_siesta.commands.eos import eos
+from aiida_siesta.commands.monitor import monitor
+
+
+@click.group('aiida-siesta', context_settings={'help_option_names': ['-h', '--help']})
+@options.PROFILE(type=types.ProfileParamType(load_profile=True))
+def cmd_root(profile):  # pylint: disable=unused-argument
+    """CLI for the `aiida-siesta` plugin."""
+
+
+cmd_root.add_command(campaign)
+cmd_root.add_command(eos)
+cmd_root.add_command(monitor)
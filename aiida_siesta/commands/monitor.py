@@ -0,0 +1,24 @@
+"""Implements the `aiida-siesta monitor` command."""
+
+import click
+
+from aiida.cmdline.utils import decorators, echo
+
+
+@click.command('monitor')
+@click.option('-t', '--interval', 'interval', type=click.INT, default=60, help='Seconds between polls')
+@click.option('--once', is_flag=True, default=False, help='Poll the calculations once and exit')
+@decorators.with_dbenv()
+def monitor(interval, once):
+    """
+    Monitor the running SiestaCalculations that have the `MONITOR` key in the settings.
+
+    The tail of the remote output is read at each poll and the jobs whose scf is diverging or
+    stagnating are killed. See `aiida_siesta.utils.monitor` for the rules and their settings.
+    """
+    from aiida_siesta.utils.monitor import run_monitor
+
+    def report(node, reason):
+        echo.echo_warning(f'Killed SiestaCalculation<{node.pk}>, the scf was {reason}')
+
+    run_monitor(interval, once=once, callback=report)
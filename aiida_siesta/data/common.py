@@ -2,6 +2,73 @@ from aiida.orm import Group
 from aiida_siesta.data.psf import PsfData
 from aiida_siesta.data.psml import PsmlData
 
+#Process-level memo of the pseudos of the families, see `get_family_pseudos`
+_FAMILY_PSEUDOS_MEMO = {}
+
+
+def clear_family_pseudos_memo():
+    """
+    Empty the process-level memo of the pseudos of the families.
+    """
+    _FAMILY_PSEUDOS_MEMO.clear()
+
+
+def _get_family_stamp(family):
+    """
+    Return the sorted tuple of the pks of the nodes in the group. Groups do not record a
+    modification time, the list of pks changes each time nodes are added to or removed from the
+    group (also when the number of nodes and the largest pk do not change). Only the pks are projected,
+    therefore the query is cheap compared to loading the pseudos.
+    """
+    from aiida.orm import Node, QueryBuilder
+
+    query = QueryBuilder()
+    query.append(Group, filters={'id': family.pk}, tag='group')
+    query.append(Node, with_group='group', project=['id'])
+
+    return tuple(sorted(pk for pk, in query.iterall()))
+
+
+def get_family_pseudos(family, elements=None, pseudo_classes=(PsfData, PsmlData)):
+    """
+    Return a dictionary associating each element with its pseudo (PsfData or PsmlData)
+    in a family (a Siesta pseudo group in the DB, possibly with mixed psf and psml pseudopotentials).
+    The pseudos are obtained with a single query, filtered by element, and memoized at process level
+    until the content of the group changes.
+
+    :param family: the Group.
+    :param elements: optional iterable of element symbols, only the pseudos of these elements are returned.
+    :param pseudo_classes: tuple of the pseudo classes to consider.
+    :raise MultipleObjectsError: if more than one pseudo for the same
+       element is found in the group.
+    """
+    from aiida.common.exceptions import MultipleObjectsError
+    from aiida.orm import QueryBuilder
+
+    elements = None if elements is None else frozenset(elements)
+    memo_key = (family.pk, elements, tuple(cls.__name__ for cls in pseudo_classes))
+    stamp = _get_family_stamp(family)
+    if memo_key in _FAMILY_PSEUDOS_MEMO and _FAMILY_PSEUDOS_MEMO[memo_key][0] == stamp:
+        return dict(_FAMILY_PSEUDOS_MEMO[memo_key][1])
+
+    filters = {} if elements is None else {'attributes.element': {'in': list(elements)}}
+    query = QueryBuilder()
+    query.append(Group, filters={'id': family.pk}, tag='group')
+    query.append(pseudo_classes, with_group='group', filters=filters, project=['attributes.element', '*'])
+
+    family_pseudos = {}
+    for element, node in query.iterall():
+        if element in family_pseudos:
+            raise MultipleObjectsError(
+                "More than one pseudo for element {} found in "
+                "family {}".format(element, family.label)
+            )
+        family_pseudos[element] = node
+
+    _FAMILY_PSEUDOS_MEMO[memo_key] = (stamp, family_pseudos)
+
+    return dict(family_pseudos)
+
 
 def get_pseudos_from_structure(structure, family_name):
     """Given a family name (a Siesta pseudo group in the DB, possibly with
@@ -16,18 +83,20 @@ def get_pseudos_from_structure(structure, family_name):
        found in the group.
 
     """
-    from aiida.common.exceptions import NotExistent, MultipleObjectsError
+    elements = [kind.symbol for kind in structure.kinds]
+    family_pseudos = get_family_pseudos(Group.get(label=family_name), elements)
+
+    return get_pseudos_from_family_pseudos(structure, family_pseudos, family_name)
 
-    family_pseudos = {}
-    family = Group.get(label=family_name)
-    for node in family.nodes:
-        if isinstance(node, (PsfData, PsmlData)):
-            if node.element in family_pseudos:
-                raise MultipleObjectsError(
-                    "More than one pseudo for element {} found in "
-                    "family {}".format(node.element, family_name)
-                )
-            family_pseudos[node.element] = node
+
+def get_pseudos_from_family_pseudos(structure, family_pseudos, family_name):
+    """
+    Associate each 'kind' name in the structure with its pseudo, taken from
+    the `family_pseudos` dictionary (element: pseudo) of family `family_name`.
+
+    :raise NotExistent: if no pseudo for an element is found in `family_pseudos`.
+    """
+    from aiida.common.exceptions import NotExistent
 
     pseudo_list = {}
     for kind in structure.kinds:
@@ -38,3 +107,122 @@ def get_pseudos_from_structure(structure, family_name):
             raise NotExistent("No pseudo for element {} found in family {}".format(symbol, family_name))
 
     return pseudo_list
+
+
+def _parse_pseudo_file(args):
+    """
+    Parse a pseudopotential file with `parse_function`, returning a tuple (parsed data, error).
+    Errors are returned rather than raised, so that they can be reported after the parallel parsing.
+    """
+    filename, parse_function = args
+    try:
+        return parse_function(filename), None
+    except Exception as exc:  # pylint: disable=broad-except
+        return None, exc
+
+
+def upload_pseudo_files(  # pylint: disable=too-many-arguments,too-many-locals
+    files, group, group_created, pseudo_class, parse_function, stop_if_existing=True, num_workers=4,
+    progress_callback=None
+):
+    """
+    Add a list of pseudopotential files to a family, storing the pseudos not already in the database.
+    The files are hashed in a pool of threads, the pseudos with the same md5 already present in the
+    database are obtained with a single query and only the new files are parsed, again in a pool of threads.
+
+    :param files: list of absolute paths of the files.
+    :param group: the family group. It is stored, if `group_created` is True, only after all the checks.
+    :param group_created: whether the group was just created (not stored yet).
+    :param pseudo_class: PsfData or PsmlData.
+    :param parse_function: the function parsing a file of `pseudo_class`, it must return a dictionary
+        containing the 'element'.
+    :param stop_if_existing: if True, raise a ValueError if one of the files is already in the database.
+    :param num_workers: number of threads used for hashing and parsing. With 1, no thread is created.
+    :param progress_callback: optional function called with the number of files processed
+        and the total number of files, each time a file is processed.
+    :return: the number of files and the number of new nodes stored.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from aiida.common import AIIDA_LOGGER as aiidalogger
+    from aiida.common.exceptions import UniquenessError
+    from aiida.common.files import md5_file
+    from aiida.orm import QueryBuilder
+
+    pseudo_type = pseudo_class.__name__.replace('Data', '').upper()
+    nfiles = len(files)
+    num_done = 0
+
+    def _map(function, items):
+        if num_workers > 1 and len(items) > 1:
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                return list(executor.map(function, items))
+        return [function(item) for item in items]
+
+    def _advance(number):
+        nonlocal num_done
+        num_done += number
+        if progress_callback is not None:
+            progress_callback(num_done, nfiles)
+
+    # Hash all the files, files with the same md5 in the folder are considered only once
+    md5_of_files = dict(zip(files, _map(md5_file, files)))
+    files_of_md5 = {}
+    for afile in files:
+        files_of_md5.setdefault(md5_of_files[afile], afile)
+
+    # Resolve all the md5s already in the database with one query
+    query = QueryBuilder()
+    query.append(pseudo_class, filters={'attributes.md5': {'in': list(files_of_md5)}}, project=['attributes.md5', '*'])
+    existing = {}
+    for md5sum, node in query.iterall():
+        existing.setdefault(md5sum, node)
+
+    if existing and stop_if_existing:
+        raise ValueError(
+            "A {} with identical MD5 to {} cannot be added with stop_if_existing"
+            "".format(pseudo_type, ", ".join(files_of_md5[md5sum] for md5sum in existing))
+        )
+    _advance(nfiles - len(files_of_md5) + len(existing))
+
+    # Parse only the new files
+    new_files = [afile for md5sum, afile in files_of_md5.items() if md5sum not in existing]
+    parsed = _map(_parse_pseudo_file, [(afile, parse_function) for afile in new_files])
+    for afile, (_, error) in zip(new_files, parsed):
+        if error is not None:
+            raise error
+
+    # Check that the pseudos are unique per element, also considering the ones already in the group
+    elements = {(node.element, md5sum) for md5sum, node in existing.items()}
+    elements.update((data['element'], md5_of_files[afile]) for afile, (data, _) in zip(new_files, parsed))
+    if not group_created:
+        query = QueryBuilder()
+        query.append(Group, filters={'id': group.pk}, tag='group')
+        query.append(pseudo_class, with_group='group', project=['attributes.element', 'attributes.md5'])
+        elements.update(tuple(row) for row in query.iterall())
+
+    elements_names = [element for element, _ in elements]
+    if not len(elements_names) == len(set(elements_names)):
+        duplicates = {x for x in elements_names if elements_names.count(x) > 1}
+        duplicates_string = ", ".join(i for i in duplicates)
+        raise UniquenessError("More than one {} found for the elements: {}.".format(pseudo_type, duplicates_string))
+
+    # At this point, save the group, if still unstored
+    if group_created:
+        group.store()
+
+    # Store the new pseudos, one at the time. The nodes are created from the md5 and the parsed data
+    # computed above, so that the files are not read again
+    pseudos = list(existing.values())
+    for node in pseudos:
+        aiidalogger.debug("Reusing node {} for file {}".format(node.uuid, node.filename))
+    for afile, (parsed_data, _) in zip(new_files, parsed):
+        pseudo = pseudo_class.from_parsed_file(afile, md5_of_files[afile], parsed_data)
+        pseudo.store()
+        aiidalogger.debug("New node {} created for file {}".format(pseudo.uuid, pseudo.filename))
+        pseudos.append(pseudo)
+        _advance(1)
+
+    # Add the pseudos to the group all together
+    group.add_nodes(pseudos)
+
+    return nfiles, len(new_files)
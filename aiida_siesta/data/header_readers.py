@@ -0,0 +1,227 @@
+"""
+Readers of the header of pseudopotential (PSF, PSML) and ion (.ion.xml) files.
+They are fed with chunks of bytes and stop parsing as soon as the header fields are found,
+so that the md5 checksum and the header of a file can be obtained in a single streaming read
+(see `read_md5_and_header`) without loading the full document.
+"""
+import os
+
+#Size of the chunks read from the files
+CHUNK_SIZE = 65536
+
+
+def read_md5_and_header(handle, reader, chunk_size=CHUNK_SIZE):
+    """
+    Read a file once, computing its md5 checksum and feeding the chunks to the header reader
+    until the reader has found all the fields it needs.
+    :param handle: a file-like object opened in binary mode.
+    :param reader: an instance of one of the header readers of this module.
+    :return: a tuple with the md5 hexdigest and the reader.
+    """
+    import hashlib
+
+    md5 = hashlib.md5()
+    for chunk in iter(lambda: handle.read(chunk_size), b''):
+        md5.update(chunk)
+        if not reader.done:
+            reader.feed(chunk)
+    reader.close()
+
+    return md5.hexdigest(), reader
+
+
+def read_header(fname, reader, chunk_size=CHUNK_SIZE):
+    """
+    Feed the chunks of a file to the header reader, stopping as soon as the header is found.
+    The rest of the file is never read.
+    :param fname: the path of the file or a file-like object (binary or text mode).
+    :param reader: an instance of one of the header readers of this module.
+    :return: the reader.
+    """
+    if not hasattr(fname, 'read'):
+        with open(fname, 'rb') as handle:
+            return read_header(handle, reader, chunk_size)
+
+    while not reader.done:
+        chunk = fname.read(chunk_size)
+        if not chunk:
+            break
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf8')
+        reader.feed(chunk)
+    reader.close()
+
+    return reader
+
+
+def _check_element(element, fname, check_filename, file_type):
+    """
+    Normalize the element symbol (only first letter capitalized) and check it.
+    :raise ParsingError: if the symbol is unknown or the filename does not start with it.
+    """
+    from aiida.common.exceptions import ParsingError
+    from aiida.orm.nodes.data.structure import _valid_symbols
+
+    if element is None:
+        raise ParsingError("Unable to find the element of {} {}".format(file_type, fname))
+    element = element.capitalize()
+    if element not in _valid_symbols:
+        raise ParsingError("Unknown element symbol {} for file {}".format(element, fname))
+
+    if check_filename:
+        if not os.path.basename(fname).lower().startswith(element.lower()):
+            raise ParsingError(
+                "Filename {0} was recognized for element "
+                "{1}, but the filename does not start "
+                "with {1}".format(fname, element)
+            )
+
+    return element
+
+
+class PsfHeaderReader:
+    """
+    Reader of the first token of a PSF file, that is the element symbol.
+    """
+
+    def __init__(self):
+        self.done = False
+        self._content = b''
+
+    def feed(self, chunk):
+        self._content += chunk
+        stripped = self._content.lstrip()
+        if stripped and len(stripped.split(None, 1)) > 1:
+            self.done = True
+
+    def close(self):
+        self.done = True
+
+    def get_parsed_data(self, fname, check_filename=True):
+        """
+        Return the dictionary of parsed data (only the element), like `parse_psf`.
+        """
+        tokens = self._content.split(None, 1)
+        element = tokens[0].decode('utf8') if tokens else None
+
+        return {'element': _check_element(element, fname, check_filename, 'PSF')}
+
+
+class _XmlHeaderReader:
+    """
+    Base class for the incremental readers of xml headers, based on expat.
+    Subclasses implement the handlers and set `done` when the header is complete.
+    """
+
+    def __init__(self):
+        from xml.parsers import expat
+
+        self.done = False
+        self._parser = expat.ParserCreate()
+        self._parser.buffer_text = True
+        self._parser.StartElementHandler = self._start_element
+        self._parser.EndElementHandler = self._end_element
+        self._parser.CharacterDataHandler = self._character_data
+
+    def feed(self, chunk):
+        from xml.parsers.expat import ExpatError
+
+        try:
+            self._parser.Parse(chunk, False)
+        except ExpatError as exc:
+            from aiida.common.exceptions import ParsingError
+            raise ParsingError("Error in the xml file: {}".format(exc))
+
+    def close(self):
+        self.done = True
+
+    def _start_element(self, name, attributes):
+        pass
+
+    def _end_element(self, name):
+        pass
+
+    def _character_data(self, data):
+        pass
+
+
+class PsmlHeaderReader(_XmlHeaderReader):
+    """
+    Reader of the attributes of the `pseudo-atom-spec` element of a PSML file.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.attributes = None
+
+    def _start_element(self, name, attributes):
+        if name == 'pseudo-atom-spec' and self.attributes is None:
+            self.attributes = attributes
+            self.done = True
+
+    def get_parsed_data(self, fname, check_filename=True):
+        """
+        Return the dictionary of parsed data (element, atomic-number and z-pseudo), like `parse_psml`.
+        """
+        from aiida.common.exceptions import ParsingError
+
+        if self.attributes is None:
+            raise ParsingError("No `pseudo-atom-spec` found in PSML {}".format(fname))
+
+        return {
+            'element': _check_element(self.attributes.get('atomic-label'), fname, check_filename, 'PSML'),
+            'atomic-number': self.attributes.get('atomic-number'),
+            'z-pseudo': self.attributes.get('z-pseudo'),
+        }
+
+
+class IonHeaderReader(_XmlHeaderReader):
+    """
+    Reader of the `symbol`, `label`, `z` and `mass` elements (children of the root) of an .ion.xml file.
+    """
+
+    _FIELDS = ('symbol', 'label', 'z', 'mass')
+
+    def __init__(self):
+        super().__init__()
+        self.fields = {}
+        self._depth = 0
+        self._current = None
+
+    def _start_element(self, name, attributes):
+        self._depth += 1
+        if self._depth == 2 and name in self._FIELDS:
+            self._current = name
+            self.fields[name] = ''
+
+    def _end_element(self, name):
+        self._depth -= 1
+        if self._current is not None:
+            self._current = None
+            if all(field in self.fields for field in self._FIELDS):
+                self.done = True
+
+    def _character_data(self, data):
+        if self._current is not None:
+            self.fields[self._current] += data
+
+    def get_parsed_data(self, fname):
+        """
+        Return the dictionary of parsed data (element, name, atomic_number and mass), like `parse_ion`.
+        """
+        from aiida.common.exceptions import ParsingError
+        from aiida.orm.nodes.data.structure import _valid_symbols
+
+        if 'symbol' not in self.fields or 'z' not in self.fields or 'label' not in self.fields:
+            raise ParsingError(f"Currupted ion file {fname}: element symbol or atomic number missing")
+
+        parsed_data = {}
+        parsed_data["element"] = str(self.fields['symbol'].strip())
+        if parsed_data["element"] not in _valid_symbols:
+            raise ParsingError(f"Unknown element symbol {parsed_data['element']} in file {fname}")
+
+        parsed_data["name"] = str(self.fields['label'].strip())
+        parsed_data["atomic_number"] = int(self.fields['z'])
+        parsed_data["mass"] = float(self.fields['mass']) if 'mass' in self.fields else None
+
+        return parsed_data
@@ -2,10 +2,39 @@
 This module manages the .ion.xml files in the local repository.
 """
 
-from aiida.common.files import md5_file, md5_from_filelike
+from collections import OrderedDict
+from aiida.common.files import md5_file
 from aiida.orm.nodes import SinglefileData
 from aiida.common.exceptions import StoringNotAllowed
-from aiida_siesta.utils.pao_manager import PaoManager
+from aiida_siesta.utils.pao_manager import PaoManager, ANG_TO_BOHR
+
+#Process-level caches of the orbitals and of the radial functions of the ion files, keyed by md5.
+#See `IonData.get_orbitals_info` and `IonData.get_radial_arrays`. They are bounded (least recently
+#used entries are discarded), so that they do not grow indefinitely in a long running daemon worker.
+_ORBITALS_INFO_CACHE = OrderedDict()
+_ORBITALS_INFO_CACHE_MAXSIZE = 1000
+_RADIAL_ARRAYS_CACHE = OrderedDict()
+_RADIAL_ARRAYS_CACHE_MAXSIZE = 32
+
+#Sections of the ion file containing radial functions. The first two contain a list of them.
+_RADIAL_SECTIONS = ("paos", "kbs", "vna", "chlocal", "core")
+
+
+def _get_cached(cache, maxsize, key, compute):
+    """
+    Return the value of `key` in the `cache`, calling `compute()` if it is not present.
+    The cache keeps at most `maxsize` items, the least recently used are discarded.
+    """
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+
+    value = compute()
+    cache[key] = value
+    if len(cache) > maxsize:
+        cache.popitem(last=False)
+
+    return value
 
 
 def xml_element_to_string(element, tail=True):
@@ -22,28 +51,93 @@ def parse_ion(fname):
     Raise a ParsingError exception if the file does not contain the element symbol
     or the atomic number. The presence in the file of mass and name is, instead, considered
     optional. If not present, None is returned.
+    The file is parsed incrementally and only until these elements are found.
     """
-    from xml.etree.ElementTree import ElementTree
-    from aiida.common.exceptions import ParsingError
-    from aiida.orm.nodes.data.structure import _valid_symbols
+    from aiida_siesta.data.header_readers import read_header, IonHeaderReader
 
-    parsed_data = {}
+    reader = read_header(fname, IonHeaderReader())
 
-    el_tr = ElementTree(None, fname)
-    root = el_tr.getroot()
+    return reader.get_parsed_data(getattr(fname, 'name', fname))
 
-    if root.find('symbol') is None or root.find('z') is None or root.find('label') is None:
-        raise ParsingError(f"Currupted ion file {fname}: element symbol or atomic number missing")
 
-    parsed_data["element"] = str(root.find('symbol').text.strip())
-    if parsed_data["element"] not in _valid_symbols:
-        raise ParsingError(f"Unknown element symbol {parsed_data['element']} in file {fname}")
+def parse_ion_orbitals(fname):
+    """
+    Extract the description of the PAO orbitals from an .ion.xml file, without their radial functions.
+    The file is parsed incrementally and only until the end of the `paos` element.
+    :param fname: the path of the file or a file-like object.
+    :return: a list with a dictionary for each orbital (n, l, z shell) with keys "n", "l", "Z",
+             "P" (True for polarization orbitals), "R" (the cutoff radius in Ang) and "q0"
+             (the population of the shell).
+    """
+    from xml.etree.ElementTree import iterparse
+
+    orbitals = []
+    in_paos = False
+    for event, element in iterparse(fname, events=("start", "end")):
+        if element.tag == "paos":
+            if event == "end":
+                break
+            in_paos = True
+        elif in_paos and event == "end" and element.tag == "orbital":
+            orbitals.append({
+                "n": int(element.attrib["n"]),
+                "l": int(element.attrib["l"]),
+                "Z": int(element.attrib["z"]),
+                "P": int(element.attrib["ispol"]) != 0,
+                "R": float(element.find("radfunc").find("cutoff").text) / ANG_TO_BOHR,
+                "q0": float(element.attrib["population"]),
+            })
+            # The radial function is not needed, free the memory
+            element.clear()
+
+    return orbitals
+
+
+def _to_number(string):
+    """
+    Convert the value of an xml attribute to int or float, if possible.
+    """
+    for converter in (int, float):
+        try:
+            return converter(string)
+        except ValueError:
+            pass
+    return string.strip()
+
 
-    parsed_data["name"] = str(root.find('label').text.strip())
-    parsed_data["atomic_number"] = int(root.find('z').text)
-    parsed_data["mass"] = float(root.find('mass').text)
+def parse_ion_radial_functions(fname):
+    """
+    Extract all the radial functions (PAOs, KB projectors, Vna, Chlocal and core) from an .ion.xml file.
+    :param fname: the path of the file or a file-like object.
+    :return: a list of tuples (section, attributes, data), where section is one of "paos", "kbs",
+             "vna", "chlocal" or "core", attributes is a dictionary with the attributes of the orbital or
+             projector (empty for the other sections) together with "npts", "delta" and "cutoff" (in Bohr),
+             and data is a numpy array of shape (npts, 2) containing the grid (Bohr) and the values.
+    """
+    from xml.etree.ElementTree import iterparse
+    import numpy as np
+
+    radial_functions = []
+    sections = []
+    function_attributes = {}
+    for event, element in iterparse(fname, events=("start", "end")):
+        if element.tag in _RADIAL_SECTIONS:
+            if event == "start":
+                sections.append(element.tag)
+            else:
+                sections.pop()
+        elif event == "start" and element.tag in ("orbital", "projector"):
+            function_attributes = {key: _to_number(value) for key, value in element.attrib.items()}
+        elif event == "end" and element.tag == "radfunc" and sections:
+            attributes = dict(function_attributes) if sections[-1] in ("paos", "kbs") else {}
+            attributes["npts"] = int(element.find("npts").text)
+            attributes["delta"] = float(element.find("delta").text)
+            attributes["cutoff"] = float(element.find("cutoff").text)
+            data = np.array(element.find("data").text.split(), dtype=float).reshape(-1, 2)
+            radial_functions.append((sections[-1], attributes, data))
+            element.clear()
 
-    return parsed_data
+    return radial_functions
 
 
 class IonData(SinglefileData):
@@ -55,9 +149,11 @@ class IonData(SinglefileData):
         """
         This is called in the __init__ of SingleFileData
         """
-        # print("Called set_file","type of filename:",type(filename))
-        parsed_data = parse_ion(file_abs_path)
-        md5 = md5_file(file_abs_path)
+        from aiida_siesta.data.header_readers import read_md5_and_header, IonHeaderReader
+
+        with open(file_abs_path, 'rb') as handle:
+            md5, reader = read_md5_and_header(handle, IonHeaderReader())
+        parsed_data = reader.get_parsed_data(file_abs_path)
 
         super().set_file(file_abs_path, filename)
 
@@ -76,39 +172,94 @@ class IonData(SinglefileData):
         make attributes immutable before storing and, therefore, a crazy user
         might think to change them before storing.
         Here we check that the attributes actually corresponds to the file info.
+        The file is read only once, computing the md5 and parsing only the header.
         """
 
         if self.is_stored:
             return self
 
+        md5, parsed_data = self._get_md5_and_parsed_data()
+
         try:
-            self.validate_md5(self.md5)
+            self._check_md5(self.md5, md5)
         except ValueError as exception:
             raise StoringNotAllowed(exception) from exception
 
         try:
-            self.validate_others_atts(self.element, self.name, self.atomic_number)
+            self._check_others_atts(self.element, self.name, self.atomic_number, parsed_data)
         except ValueError as exception:
             raise StoringNotAllowed(exception) from exception
 
         return super().store(*args, **kwargs)
 
+    def get_radial_arrays(self):
+        """
+        Return all the radial functions of the ion file as numpy arrays.
+        The file is parsed only at the first call, the arrays are then cached at process level
+        using the md5 of the file (at most `_RADIAL_ARRAYS_CACHE_MAXSIZE` files). The cached arrays are read-only.
+        :return: a dictionary with keys "paos" and "kbs" (lists, one item per orbital or projector) and
+                 "vna", "chlocal", "core" (if present in the file). Each item is a dictionary with the
+                 attributes of the function (for instance n, l, z, population of the orbitals), "npts",
+                 "delta", "cutoff" and the arrays "r" (the grid, in Bohr) and "f" (the values).
+        """
+
+        def _parse():
+            with self.open(mode='rb') as handle:
+                radial_functions = parse_ion_radial_functions(handle)
+            for _, _, data in radial_functions:
+                data.setflags(write=False)
+            return radial_functions
+
+        radial_functions = _get_cached(_RADIAL_ARRAYS_CACHE, _RADIAL_ARRAYS_CACHE_MAXSIZE, self.md5, _parse)
+
+        result = {"paos": [], "kbs": []}
+        for section, attributes, data in radial_functions:
+            function = dict(attributes, r=data[:, 0], f=data[:, 1])
+            if section in ("paos", "kbs"):
+                result[section].append(function)
+            else:
+                result[section] = function
+
+        return result
+
+    def _get_md5_and_parsed_data(self):
+        """
+        Read the file in the repository once, computing the md5 and parsing only the header.
+        :return: a tuple with the md5 and the dictionary of parsed data.
+        """
+        from aiida_siesta.data.header_readers import read_md5_and_header, IonHeaderReader
+
+        with self.open(mode='rb') as handle:
+            md5, reader = read_md5_and_header(handle, IonHeaderReader())
+
+        return md5, reader.get_parsed_data(self.filename)
+
+    @staticmethod
+    def _check_others_atts(elem, name, atm_n, parsed_data):
+        if elem != parsed_data["element"] or name != parsed_data["name"] or atm_n != parsed_data["atomic_number"]:
+            raise ValueError(
+                'element, name or atomic_number do not correspond to the the one in the ion file. '
+                'The attributes of this class can not be modified manually.'
+            )
+
+    @staticmethod
+    def _check_md5(md5, md5_fil):
+        if md5 != md5_fil:
+            raise ValueError(
+                f'Th md5 does not match that of stored file: {md5} != {md5_fil}. '
+                'The attributes of this class can not be modified manually.'
+            )
+
     def validate_others_atts(self, elem, name, atm_n):
         """
         Validate the given element, name, atomic_number are the one of the stored file.
-        Unfortunately it requires to reparse the file.
+        Only the header of the file is parsed.
         :param elem: the symbol of the element.
                name: the name assigned to the atom/site.
                atm_n: the atomic number of the atom/site.
         :raises ValueError: if the element symbol is invalid.
         """
-        with self.open(mode='r') as handle:
-            parsed_data = parse_ion(handle.name)
-        if elem != parsed_data["element"] or name != parsed_data["name"] or atm_n != parsed_data["atomic_number"]:
-            raise ValueError(
-                'element, name or atomic_number do not correspond to the the one in the ion file. '
-                'The attributes of this class can not be modified manually.'
-            )
+        self._check_others_atts(elem, name, atm_n, self._get_md5_and_parsed_data()[1])
 
     def validate_md5(self, md5: str):
         """
@@ -116,13 +267,7 @@ class IonData(SinglefileData):
         :param value: the md5 checksum.
         :raises ValueError: if the md5 does not match that of the currently stored file.
         """
-        with self.open(mode='rb') as handle:
-            md5_fil = md5_from_filelike(handle)
-            if md5 != md5_fil:
-                raise ValueError(
-                    f'Th md5 does not match that of stored file: {md5} != {md5_fil}. '
-                    'The attributes of this class can not be modified manually.'
-                )
+        self._check_md5(md5, self._get_md5_and_parsed_data()[0])
 
     @classmethod
     def get_or_create(cls, file_abs_path, filename=None, use_first=False, store_ion=False):
@@ -292,25 +437,42 @@ class IonData(SinglefileData):
 
         return string
 
-    def get_orbitals(self):
+    def get_orbitals_info(self):
         """
-        Uses sisl to read the file and return the orbitals
+        Return the description of the orbitals (n, l, Z, P, R in Ang and q0 for each n, l, z shell),
+        see `parse_ion_orbitals`. The file is parsed in memory, without sisl, and the result is
+        cached at process level using the md5 of the file (at most `_ORBITALS_INFO_CACHE_MAXSIZE` files).
         """
+        import copy
 
-        import sisl
+        def _parse():
+            with self.open(mode='rb') as handle:
+                return parse_ion_orbitals(handle)
+
+        orbitals = _get_cached(_ORBITALS_INFO_CACHE, _ORBITALS_INFO_CACHE_MAXSIZE, self.md5, _parse)
+
+        return copy.deepcopy(orbitals)
+
+    def get_orbitals(self):
+        """
+        Uses sisl to read the file and return the orbitals, including their radial functions.
+        If only the quantum numbers and radii are needed, use `get_orbitals_info`.
+        """
         import os
+        import tempfile
+        import sisl
         from aiida_siesta.data.atomic_orbitals import SislAtomicOrbital
 
-        tmp_file = open("tmp.ion.xml", "w")
-        tmp_file.write(self.get_content())
-        tmp_file.close()
-        sile = sisl.get_sile("tmp.ion.xml")
-        sisl_atom = sile.read_basis()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_path = os.path.join(tmp_dir, "tmp.ion.xml")
+            with open(tmp_path, "w") as tmp_file:
+                tmp_file.write(self.get_content())
+            sisl_atom = sisl.get_sile(tmp_path).read_basis()
+
         listorb = []
         for i in sisl_atom.orbitals:
             atorb = SislAtomicOrbital(i.name(), (i.orb.__getstate__()["r"], i.orb.__getstate__()["f"]), q0=i.q0)
             listorb.append(atorb)
-        os.remove("tmp.ion.xml")
 
         return listorb
 
@@ -2,7 +2,6 @@
 This module manages the PSF pseudopotentials in the local repository.
 """
 
-import io
 from aiida.common.files import md5_file
 from aiida.orm.nodes import SinglefileData
 
@@ -18,18 +17,12 @@ def get_pseudos_from_structure(structure, family_name):
     :raise NotExistent: if no PSF for an element in the group is
        found in the group.
     """
-    from aiida.common.exceptions import NotExistent, MultipleObjectsError
+    from aiida.common.exceptions import NotExistent
+    from aiida_siesta.data.common import get_family_pseudos
 
-    family_pseudos = {}
     family = PsfData.get_psf_group(family_name)
-    for node in family.nodes:
-        if isinstance(node, PsfData):
-            if node.element in family_pseudos:
-                raise MultipleObjectsError(
-                    "More than one PSF for element {} found in "
-                    "family {}".format(node.element, family_name)
-                )
-            family_pseudos[node.element] = node
+    elements = [kind.symbol for kind in structure.kinds]
+    family_pseudos = get_family_pseudos(family, elements, pseudo_classes=(PsfData,))
 
     pseudo_list = {}
     for kind in structure.kinds:
@@ -42,7 +35,9 @@ def get_pseudos_from_structure(structure, family_name):
     return pseudo_list
 
 
-def upload_psf_family(folder, group_label, group_description, stop_if_existing=True):
+def upload_psf_family(
+    folder, group_label, group_description, stop_if_existing=True, num_workers=4, progress_callback=None
+):
     """
     Upload a set of PSF files in a given group.
 
@@ -55,12 +50,15 @@ def upload_psf_family(folder, group_label, group_description, stop_if_existing=T
     :param stop_if_existing: if True, check for the md5 of the files and,
         if the file already exists in the DB, raises a MultipleObjectsError.
         If False, simply adds the existing PsfData node to the group.
+    :param num_workers: number of threads used to hash and parse the files.
+    :param progress_callback: optional function called with the number of files processed and
+        the total number of files, see `aiida_siesta.data.common.upload_pseudo_files`.
+    :return: the number of files found and the number of new nodes stored.
     """
     import os
     from aiida import orm
-    from aiida.common import AIIDA_LOGGER as aiidalogger
     from aiida.common.exceptions import UniquenessError
-    from aiida.orm.querybuilder import QueryBuilder
+    from aiida_siesta.data.common import upload_pseudo_files
     from aiida_siesta.groups.pseudos import PsfFamily
 
     if not os.path.isdir(folder):
@@ -74,8 +72,6 @@ def upload_psf_family(folder, group_label, group_description, stop_if_existing=T
         if os.path.isfile(os.path.join(folder, i)) and i.lower().endswith('.psf')
     ]
 
-    nfiles = len(files)
-
     automatic_user = orm.User.objects.get_default()
     group, group_created = PsfFamily.objects.get_or_create(label=group_label, user=automatic_user)
 
@@ -90,73 +86,9 @@ def upload_psf_family(folder, group_label, group_description, stop_if_existing=T
     group.description = group_description
 
     # NOTE: GROUP SAVED ONLY AFTER CHECKS OF UNICITY
-
-    pseudo_and_created = []
-
-    for afile in files:
-        md5sum = md5_file(afile)
-        qb = QueryBuilder()
-        qb.append(PsfData, filters={'attributes.md5': {'==': md5sum}})
-        existing_psf = qb.first()
-
-        #existing_psf = PsfData.query(dbattributes__key="md5",
-        #                            dbattributes__tval = md5sum)
-
-        if existing_psf is None:
-            # return the psfdata instances, not stored
-            pseudo, created = PsfData.get_or_create(afile, use_first=True, store_psf=False)
-            # to check whether only one psf per element exists
-            # NOTE: actually, created has the meaning of "to_be_created"
-            pseudo_and_created.append((pseudo, created))
-        else:
-            if stop_if_existing:
-                raise ValueError(
-                    "A PSF with identical MD5 to "
-                    " {} cannot be added with stop_if_existing"
-                    "".format(afile)
-                )
-            existing_psf = existing_psf[0]
-            pseudo_and_created.append((existing_psf, False))
-
-    # check whether pseudo are unique per element
-    elements = [(i[0].element, i[0].md5sum) for i in pseudo_and_created]
-    # If group already exists, check also that I am not inserting more than
-    # once the same element
-    if not group_created:
-        for aiida_n in group.nodes:
-            # Skip non-pseudos
-            if not isinstance(aiida_n, PsfData):
-                continue
-            elements.append((aiida_n.element, aiida_n.md5sum))
-
-    elements = set(elements)  # Discard elements with the same MD5, that would
-    # not be stored twice
-    elements_names = [e[0] for e in elements]
-
-    if not len(elements_names) == len(set(elements_names)):
-        duplicates = {x for x in elements_names if elements_names.count(x) > 1}
-        duplicates_string = ", ".join(i for i in duplicates)
-        raise UniquenessError("More than one PSF found for the elements: " + duplicates_string + ".")
-
-    # At this point, save the group, if still unstored
-    if group_created:
-        group.store()
-
-    # save the psf in the database, and add them to group
-    for pseudo, created in pseudo_and_created:
-        if created:
-            pseudo.store()
-
-            aiidalogger.debug("New node {} created for file {}".format(pseudo.uuid, pseudo.filename))
-        else:
-            aiidalogger.debug("Reusing node {} for file {}".format(pseudo.uuid, pseudo.filename))
-
-    # Add elements to the group all togetehr
-    group.add_nodes([pseudo for pseudo, created in pseudo_and_created])
-
-    nuploaded = len([_ for _, created in pseudo_and_created if created])
-
-    return nfiles, nuploaded
+    return upload_pseudo_files(
+        files, group, group_created, PsfData, parse_psf, stop_if_existing, num_workers, progress_callback
+    )
 
 
 def parse_psf(fname, check_filename=True):
@@ -165,45 +97,14 @@ def parse_psf(fname, check_filename=True):
     element name.
     If check_filename is True, raise a ParsingError exception if the filename
     does not start with the element name.
+    Only the beginning of the file, up to the first token, is read.
     """
-    import os
-
-    from aiida.common.exceptions import ParsingError
-    # from aiida.common import AIIDA_LOGGER
-    from aiida.orm.nodes.data.structure import _valid_symbols
-
-    parsed_data = {}
-
-    try:
-        psf_contents = fname.read().split()
-        fname = fname.name
-    except AttributeError:
-        with io.open(fname, encoding='utf8') as fil:
-            psf_contents = fil.read().split()
-
-    # Parse the element
-    element = None
-    for element in psf_contents:
-        break
-
-    # Only first letter capitalized!
-    if element is None:
-        raise ParsingError("Unable to find the element of PSF {}".format(fname))
-    element = element.capitalize()
-    if element not in _valid_symbols:
-        raise ParsingError("Unknown element symbol {} for file {}".format(element, fname))
-
-    if check_filename:
-        if not os.path.basename(fname).lower().startswith(element.lower()):
-            raise ParsingError(
-                "Filename {0} was recognized for element "
-                "{1}, but the filename does not start "
-                "with {1}".format(fname, element)
-            )
+    from aiida_siesta.data.header_readers import read_header, PsfHeaderReader
 
-    parsed_data['element'] = element
+    reader = read_header(fname, PsfHeaderReader())
+    fname = getattr(fname, 'name', fname)
 
-    return parsed_data
+    return reader.get_parsed_data(fname, check_filename)
 
 
 class PsfData(SinglefileData):
@@ -253,33 +154,57 @@ class PsfData(SinglefileData):
 
         return (pseudos[0], False)
 
+    @classmethod
+    def from_parsed_file(cls, filename, md5sum, parsed_data):
+        """
+        Return a new (unstored) PsfData for a file already hashed and parsed, for instance
+        in a pool of workers. Neither here nor in `store` the file is read again.
+
+        :param filename: an absolute filename on disk
+        :param md5sum: the md5 of the file.
+        :param parsed_data: the dictionary returned by `parse_psf` for the file, it must contain the 'element'.
+        """
+        instance = cls()
+        SinglefileData.set_file(instance, filename)
+        instance.set_attribute('element', str(parsed_data['element']))
+        instance.set_attribute('md5', md5sum)
+        instance._file_data_for_store = (md5sum, parsed_data)
+
+        return instance
+
     def store(self, *args, **kwargs):  # pylint: disable=arguments-differ
         """
         Store the node, reparsing the file so that the md5 and the element
-        are correctly reset.
+        are correctly reset. The file is read only once, the result is reused by `_validate`.
+        For the nodes created with `from_parsed_file`, the md5 and the parsed data given there
+        are used and the file is not read at all.
         """
-        from aiida.common.exceptions import ParsingError
-        from aiida.common.files import md5_from_filelike
-
         if self.is_stored:
             return self
 
-        with self.open(mode='r') as handle:
-            parsed_data = parse_psf(handle)
+        file_data = getattr(self, '_file_data_for_store', None)
+        md5sum, parsed_data = file_data if file_data is not None else self._get_md5_and_parsed_data()
 
-        # Open in binary mode which is required for generating the md5 checksum
-        with self.open(mode='rb') as handle:
-            md5sum = md5_from_filelike(handle)
+        self.set_attribute('element', str(parsed_data['element']))
+        self.set_attribute('md5', md5sum)
 
+        self._file_data_for_store = (md5sum, parsed_data)  # pylint: disable=attribute-defined-outside-init
         try:
-            element = parsed_data['element']
-        except KeyError:
-            raise ParsingError("No 'element' parsed in the PSF file {};" " unable to store".format(self.filename))
+            return super(PsfData, self).store(*args, **kwargs)
+        finally:
+            self._file_data_for_store = None  # pylint: disable=attribute-defined-outside-init
 
-        self.set_attribute('element', str(element))
-        self.set_attribute('md5', md5sum)
+    def _get_md5_and_parsed_data(self):
+        """
+        Read the file in the repository once, computing the md5 and parsing only the header.
+        :return: a tuple with the md5 and the dictionary of parsed data.
+        """
+        from aiida_siesta.data.header_readers import read_md5_and_header, PsfHeaderReader
+
+        with self.open(mode='rb') as handle:
+            md5sum, reader = read_md5_and_header(handle, PsfHeaderReader())
 
-        return super(PsfData, self).store(*args, **kwargs)
+        return md5sum, reader.get_parsed_data(self.filename)
 
     @classmethod
     def from_md5(cls, md5):
@@ -298,15 +223,11 @@ class PsfData(SinglefileData):
         """
         I pre-parse the file to store the attributes.
         """
-        from aiida.common.exceptions import ParsingError
+        from aiida_siesta.data.header_readers import read_md5_and_header, PsfHeaderReader
 
-        parsed_data = parse_psf(filename)
-        md5sum = md5_file(filename)
-
-        try:
-            element = parsed_data['element']
-        except KeyError:
-            raise ParsingError("No 'element' parsed in the PSF file {};" " unable to store".format(self.filename))
+        with open(filename, 'rb') as handle:
+            md5sum, reader = read_md5_and_header(handle, PsfHeaderReader())
+        element = reader.get_parsed_data(filename)['element']
 
         super(PsfData, self).set_file(filename)
 
@@ -337,24 +258,17 @@ class PsfData(SinglefileData):
         return self.get_attribute('md5', None)
 
     def _validate(self):
-        from aiida.common.exceptions import ValidationError
-        from aiida.common.files import md5_from_filelike
+        from aiida.common.exceptions import ValidationError, ParsingError
 
         super(PsfData, self)._validate()
 
-        with self.open(mode='r') as handle:
-            parsed_data = parse_psf(handle)
-
-        # Open in binary mode which is required for generating the md5 checksum
-        with self.open(mode='rb') as handle:
-            md5 = md5_from_filelike(handle)
-
-        # This is erroneous exception,
-        # as it is in the `upf` module oin `aiida_core`
+        # When called by `store`, the file was already read
+        file_data = getattr(self, '_file_data_for_store', None)
         try:
-            element = parsed_data['element']
-        except KeyError:
-            raise ValidationError("No 'element' could be parsed in the PSF " "file {}".format(self.filename))
+            md5, parsed_data = file_data if file_data is not None else self._get_md5_and_parsed_data()
+        except ParsingError as exc:
+            raise ValidationError("The PSF file {} could not be parsed: {}".format(self.filename, exc))
+        element = parsed_data['element']
 
         try:
             attr_element = self.get_attribute('element')
@@ -21,18 +21,12 @@ def get_pseudos_from_structure(structure, family_name):
     :raise NotExistent: if no PSML for an element in the group is
        found in the group.
     """
-    from aiida.common.exceptions import NotExistent, MultipleObjectsError
+    from aiida.common.exceptions import NotExistent
+    from aiida_siesta.data.common import get_family_pseudos
 
-    family_pseudos = {}
     family = PsmlData.get_psml_group(family_name)
-    for node in family.nodes:
-        if isinstance(node, PsmlData):
-            if node.element in family_pseudos:
-                raise MultipleObjectsError(
-                    "More than one PSML for element {} found in "
-                    "family {}".format(node.element, family_name)
-                )
-            family_pseudos[node.element] = node
+    elements = [kind.symbol for kind in structure.kinds]
+    family_pseudos = get_family_pseudos(family, elements, pseudo_classes=(PsmlData,))
 
     pseudo_list = {}
     for kind in structure.kinds:
@@ -45,7 +39,9 @@ def get_pseudos_from_structure(structure, family_name):
     return pseudo_list
 
 
-def upload_psml_family(folder, group_label, group_description, stop_if_existing=True):
+def upload_psml_family(
+    folder, group_label, group_description, stop_if_existing=True, num_workers=4, progress_callback=None
+):
     """
     Upload a set of PSML files in a given group.
 
@@ -58,12 +54,15 @@ def upload_psml_family(folder, group_label, group_description, stop_if_existing=
     :param stop_if_existing: if True, check for the md5 of the files and,
         if the file already exists in the DB, raises a MultipleObjectsError.
         If False, simply adds the existing PsmlData node to the group.
+    :param num_workers: number of threads used to hash and parse the files.
+    :param progress_callback: optional function called with the number of files processed and
+        the total number of files, see `aiida_siesta.data.common.upload_pseudo_files`.
+    :return: the number of files found and the number of new nodes stored.
     """
     import os
     from aiida import orm
-    from aiida.common import AIIDA_LOGGER as aiidalogger
     from aiida.common.exceptions import UniquenessError
-    from aiida.orm.querybuilder import QueryBuilder
+    from aiida_siesta.data.common import upload_pseudo_files
     from aiida_siesta.groups.pseudos import PsmlFamily
 
     if not os.path.isdir(folder):
@@ -77,8 +76,6 @@ def upload_psml_family(folder, group_label, group_description, stop_if_existing=
         if os.path.isfile(os.path.join(folder, i)) and i.endswith('.psml')
     ]
 
-    nfiles = len(files)
-
     automatic_user = orm.User.objects.get_default()
     #group, group_created = orm.Group.objects.get_or_create(
     #    label=group_label, type_string=PSMLGROUP_TYPE, user=automatic_user
@@ -96,73 +93,9 @@ def upload_psml_family(folder, group_label, group_description, stop_if_existing=
     group.description = group_description
 
     # NOTE: GROUP SAVED ONLY AFTER CHECKS OF UNICITY
-
-    pseudo_and_created = []
-
-    for afile in files:
-        md5sum = md5_file(afile)
-        qb = QueryBuilder()
-        qb.append(PsmlData, filters={'attributes.md5': {'==': md5sum}})
-        existing_psml = qb.first()
-
-        #existing_psml = PsmlData.query(dbattributes__key="md5",
-        #                            dbattributes__tval = md5sum)
-
-        if existing_psml is None:
-            # return the psmldata instances, not stored
-            pseudo, created = PsmlData.get_or_create(afile, use_first=True, store_psml=False)
-            # to check whether only one psml per element exists
-            # NOTE: actually, created has the meaning of "to_be_created"
-            pseudo_and_created.append((pseudo, created))
-        else:
-            if stop_if_existing:
-                raise ValueError(
-                    "A PSML with identical MD5 to "
-                    " {} cannot be added with stop_if_existing"
-                    "".format(afile)
-                )
-            existing_psml = existing_psml[0]
-            pseudo_and_created.append((existing_psml, False))
-
-    # check whether pseudo are unique per element
-    elements = [(i[0].element, i[0].md5sum) for i in pseudo_and_created]
-    # If group already exists, check also that I am not inserting more than
-    # once the same element
-    if not group_created:
-        for aiida_n in group.nodes:
-            # Skip non-pseudos
-            if not isinstance(aiida_n, PsmlData):
-                continue
-            elements.append((aiida_n.element, aiida_n.md5sum))
-
-    elements = set(elements)  # Discard elements with the same MD5, that would
-    # not be stored twice
-    elements_names = [e[0] for e in elements]
-
-    if not len(elements_names) == len(set(elements_names)):
-        duplicates = {x for x in elements_names if elements_names.count(x) > 1}
-        duplicates_string = ", ".join(i for i in duplicates)
-        raise UniquenessError("More than one PSML found for the elements: " + duplicates_string + ".")
-
-    # At this point, save the group, if still unstored
-    if group_created:
-        group.store()
-
-    # save the psml in the database, and add them to group
-    for pseudo, created in pseudo_and_created:
-        if created:
-            pseudo.store()
-
-            aiidalogger.debug("New node {} created for file {}".format(pseudo.uuid, pseudo.filename))
-        else:
-            aiidalogger.debug("Reusing node {} for file {}".format(pseudo.uuid, pseudo.filename))
-
-    # Add elements to the group all togetehr
-    group.add_nodes([pseudo for pseudo, created in pseudo_and_created])
-
-    nuploaded = len([_ for _, created in pseudo_and_created if created])
-
-    return nfiles, nuploaded
+    return upload_pseudo_files(
+        files, group, group_created, PsmlData, parse_psml, stop_if_existing, num_workers, progress_callback
+    )
 
 
 def parse_psml(fname, check_filename=True):
@@ -171,45 +104,14 @@ def parse_psml(fname, check_filename=True):
     element name.
     If check_filename is True, raise a ParsingError exception if the filename
     does not start with the element name.
+    The file is parsed incrementally and only up to the `pseudo-atom-spec` element.
     """
-    import os
-
-    from aiida.common.exceptions import ParsingError
-    # from aiida.common import AIIDA_LOGGER
-    from aiida.orm.nodes.data.structure import _valid_symbols
-    from xml.dom import minidom
-
-    parsed_data = {}
-
-    psml_contents = minidom.parse(fname)
-
-    # Parse the element
-    itemlist = psml_contents.getElementsByTagName('pseudo-atom-spec')
-    s = itemlist[0]  # pylint: disable=invalid-name
-    element = s.attributes['atomic-label'].value
-    atomic_number = s.attributes['atomic-number'].value
-    z_pseudo = s.attributes['z-pseudo'].value
-
-    # Only first letter capitalized!
-    if element is None:
-        raise ParsingError("Unable to find the element of PSML {}".format(fname))
-    element = element.capitalize()
-    if element not in _valid_symbols:
-        raise ParsingError("Unknown element symbol {} for file {}".format(element, fname))
-
-    if check_filename:
-        if not os.path.basename(fname).lower().startswith(element.lower()):
-            raise ParsingError(
-                "Filename {0} was recognized for element "
-                "{1}, but the filename does not start "
-                "with {1}".format(fname, element)
-            )
+    from aiida_siesta.data.header_readers import read_header, PsmlHeaderReader
 
-    parsed_data['element'] = element
-    parsed_data['atomic-number'] = atomic_number
-    parsed_data['z-pseudo'] = z_pseudo
+    reader = read_header(fname, PsmlHeaderReader())
+    fname = getattr(fname, 'name', fname)
 
-    return parsed_data
+    return reader.get_parsed_data(fname, check_filename)
 
 
 class PsmlData(SinglefileData):
@@ -263,34 +165,57 @@ class PsmlData(SinglefileData):
     #def psmlfamily_type_string(cls):  # pylint: disable=no-self-argument,no-self-use
     #    return PSMLGROUP_TYPE
 
+    @classmethod
+    def from_parsed_file(cls, filename, md5sum, parsed_data):
+        """
+        Return a new (unstored) PsmlData for a file already hashed and parsed, for instance
+        in a pool of workers. Neither here nor in `store` the file is read again.
+
+        :param filename: an absolute filename on disk
+        :param md5sum: the md5 of the file.
+        :param parsed_data: the dictionary returned by `parse_psml` for the file, it must contain the 'element'.
+        """
+        instance = cls()
+        SinglefileData.set_file(instance, filename)
+        instance.set_attribute('element', str(parsed_data['element']))
+        instance.set_attribute('md5', md5sum)
+        instance._file_data_for_store = (md5sum, parsed_data)
+
+        return instance
+
     def store(self, *args, **kwargs):  # pylint: disable=arguments-differ
         """
         Store the node, reparsing the file so that the md5 and the element
-        are correctly reset.  (**why?)
+        are correctly reset. The file is read only once, the result is reused by `_validate`.
+        For the nodes created with `from_parsed_file`, the md5 and the parsed data given there
+        are used and the file is not read at all.
         """
-        from aiida.common.exceptions import ParsingError
-        from aiida.common.files import md5_from_filelike
-
         if self.is_stored:
             return self
 
-        # Already done??
-        with self.open(mode='r') as handle:
-            parsed_data = parse_psml(handle.name)
+        file_data = getattr(self, '_file_data_for_store', None)
+        md5sum, parsed_data = file_data if file_data is not None else self._get_md5_and_parsed_data()
 
-        # Open in binary mode which is required for generating the md5 checksum
-        with self.open(mode='rb') as handle:
-            md5sum = md5_from_filelike(handle)
+        self.set_attribute('element', str(parsed_data['element']))
+        self.set_attribute('md5', md5sum)
 
+        self._file_data_for_store = (md5sum, parsed_data)  # pylint: disable=attribute-defined-outside-init
         try:
-            element = parsed_data['element']
-        except KeyError:
-            raise ParsingError("No 'element' parsed in the PSML file {};" " unable to store".format(self.filename))
+            return super(PsmlData, self).store(*args, **kwargs)
+        finally:
+            self._file_data_for_store = None  # pylint: disable=attribute-defined-outside-init
 
-        self.set_attribute('element', str(element))
-        self.set_attribute('md5', md5sum)
+    def _get_md5_and_parsed_data(self):
+        """
+        Read the file in the repository once, computing the md5 and parsing only the header.
+        :return: a tuple with the md5 and the dictionary of parsed data.
+        """
+        from aiida_siesta.data.header_readers import read_md5_and_header, PsmlHeaderReader
+
+        with self.open(mode='rb') as handle:
+            md5sum, reader = read_md5_and_header(handle, PsmlHeaderReader())
 
-        return super(PsmlData, self).store(*args, **kwargs)
+        return md5sum, reader.get_parsed_data(self.filename)
 
     @classmethod
     def from_md5(cls, md5):
@@ -309,16 +234,11 @@ class PsmlData(SinglefileData):
         """
         I pre-parse the file to store the attributes.
         """
-        from aiida.common.exceptions import ParsingError
+        from aiida_siesta.data.header_readers import read_md5_and_header, PsmlHeaderReader
 
-        # print("Called set_file","type of filename:",type(filename))
-        parsed_data = parse_psml(filename)
-        md5sum = md5_file(filename)
-
-        try:
-            element = parsed_data['element']
-        except KeyError:
-            raise ParsingError("No 'element' parsed in the PSML file {};" " unable to store".format(self.filename))
+        with open(filename, 'rb') as handle:
+            md5sum, reader = read_md5_and_header(handle, PsmlHeaderReader())
+        element = reader.get_parsed_data(filename)['element']
 
         super(PsmlData, self).set_file(filename)
 
@@ -348,25 +268,17 @@ class PsmlData(SinglefileData):
         return self.get_attribute('md5', None)
 
     def _validate(self):
-        from aiida.common.exceptions import ValidationError
-        from aiida.common.files import md5_from_filelike
+        from aiida.common.exceptions import ValidationError, ParsingError
 
         super(PsmlData, self)._validate()
 
-        # Yet another parsing ???
-        with self.open(mode='r') as handle:
-            parsed_data = parse_psml(handle.name)
-
-        # Open in binary mode which is required for generating the md5 checksum
-        with self.open(mode='rb') as handle:
-            md5 = md5_from_filelike(handle)
-
-        # This is erroneous exception,
-        # as it is in the `upf` module oin `aiida_core`
+        # When called by `store`, the file was already read
+        file_data = getattr(self, '_file_data_for_store', None)
         try:
-            element = parsed_data['element']
-        except KeyError:
-            raise ValidationError("No 'element' could be parsed in the PSML " "file {}".format(self.filename))
+            md5, parsed_data = file_data if file_data is not None else self._get_md5_and_parsed_data()
+        except ParsingError as exc:
+            raise ValidationError("The PSML file {} could not be parsed: {}".format(self.filename, exc))
+        element = parsed_data['element']
 
         try:
             attr_element = self.get_attribute('element')
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Benchmark of the header-only parsing of pseudopotential and ion files.
+
+Usage:
+    python benchmark_header_parsing.py FOLDER [REPEAT]
+
+FOLDER is a pseudo library (for instance the PseudoDojo or SG15 PSML/PSF files) and may also
+contain .ion.xml files. For each kind of file, the reading done to upload a family
+(or to create and store an IonData) is timed with the previous implementation
+(full parsing of the documents, md5 computed in separate reads) and with the current one
+(md5 and header obtained in a single streaming read, stopping the parsing at the header).
+No database is needed, only the work on the files is timed.
+"""
+import os
+import sys
+import timeit
+from xml.dom import minidom
+from xml.etree.ElementTree import ElementTree
+
+from aiida.common.files import md5_file
+from aiida_siesta.data.header_readers import (
+    read_md5_and_header, read_header, PsfHeaderReader, PsmlHeaderReader, IonHeaderReader
+)
+
+
+def legacy_parse_psf(fname):
+    with open(fname, encoding='utf8') as handle:
+        return handle.read().split()[0]
+
+
+def legacy_parse_psml(fname):
+    spec = minidom.parse(fname).getElementsByTagName('pseudo-atom-spec')[0]
+    return spec.attributes['atomic-label'].value
+
+
+def legacy_parse_ion(fname):
+    root = ElementTree(None, fname).getroot()
+    return root.find('symbol').text, root.find('label').text, root.find('z').text, root.find('mass').text
+
+
+def legacy_upload(fname, legacy_parse):
+    """
+    Md5 in the upload loop and in `get_or_create`, then parsing and md5 in `set_file`, `store` and `_validate`.
+    """
+    md5_file(fname)
+    md5_file(fname)
+    for _ in range(3):
+        legacy_parse(fname)
+        md5_file(fname)
+
+
+def current_upload(fname, reader_class):
+    """
+    Md5 in the hashing phase, header parsing of the new file, then one streaming read in `store`.
+    """
+    md5_file(fname)
+    read_header(fname, reader_class())
+    with open(fname, 'rb') as handle:
+        read_md5_and_header(handle, reader_class())
+
+
+def legacy_ion_creation(fname):
+    """
+    Parsing and md5 in `set_file`, then md5 and parsing again in the validation of `store`.
+    """
+    for _ in range(2):
+        legacy_parse_ion(fname)
+        md5_file(fname)
+
+
+def current_ion_creation(fname):
+    """
+    One streaming read in `set_file` and one in `store`.
+    """
+    for _ in range(2):
+        with open(fname, 'rb') as handle:
+            read_md5_and_header(handle, IonHeaderReader())
+
+
+def main(folder, repeat=3):
+    cases = [
+        (
+            'PSF upload', '.psf', lambda f: legacy_upload(f, legacy_parse_psf),
+            lambda f: current_upload(f, PsfHeaderReader)
+        ),
+        (
+            'PSML upload', '.psml', lambda f: legacy_upload(f, legacy_parse_psml),
+            lambda f: current_upload(f, PsmlHeaderReader)
+        ),
+        ('IonData creation', '.ion.xml', legacy_ion_creation, current_ion_creation),
+    ]
+
+    print('{:<18} {:>6} {:>12} {:>12} {:>8}'.format('Case', 'Files', 'Legacy (s)', 'Current (s)', 'Speedup'))
+    for name, extension, legacy, current in cases:
+        files = [
+            os.path.join(folder, fname) for fname in sorted(os.listdir(folder)) if fname.lower().endswith(extension)
+        ]
+        if not files:
+            continue
+        legacy_time = min(timeit.repeat(lambda: [legacy(f) for f in files], number=1, repeat=repeat))  # pylint: disable=cell-var-from-loop
+        current_time = min(timeit.repeat(lambda: [current(f) for f in files], number=1, repeat=repeat))  # pylint: disable=cell-var-from-loop
+        print(
+            '{:<18} {:>6} {:>12.4f} {:>12.4f} {:>8.1f}'.format(
+                name, len(files), legacy_time, current_time, legacy_time / current_time
+            )
+        )
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print(__doc__, file=sys.stderr)
+        sys.exit(1)
+    main(sys.argv[1], *[int(arg) for arg in sys.argv[2:]])
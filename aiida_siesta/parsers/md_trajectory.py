@@ -0,0 +1,97 @@
+"""
+Parsing of the molecular dynamics files of Siesta: the `.ANI` file (the coordinates of each MD step in xyz
+format, written if `write-md-xmol` is True) and the `.MDE` file (temperature, energies, volume and pressure
+of each MD step). The files are read line by line, so that long trajectories are never loaded at once.
+"""
+import numpy as np
+
+#Columns of the .MDE file, in order, and the name of the corresponding array of the TrajectoryData
+MDE_COLUMNS = ('steps', 'temperatures', 'ks_energies', 'total_energies', 'volumes', 'pressures')
+
+#Types of run changing the cell, whose cell is not written in the .ANI file
+VARIABLE_CELL_MD = ('parrinellorahman', 'noseparrinellorahman')
+
+
+def iter_ani_frames(handle, number_of_atoms):
+    """
+    Generator yielding the positions (in Angstrom) of the first `number_of_atoms` atoms of each frame
+    of an .ANI file. The remaining atoms of each frame (the floating sites) are skipped.
+    An incomplete last frame (the calculation was killed while writing it) is discarded.
+    """
+    while True:
+        header = handle.readline()
+        if not header.strip():
+            return
+        frame_atoms = int(header.split()[0])
+        handle.readline()
+        positions = []
+        for _ in range(frame_atoms):
+            line = handle.readline().split()
+            if len(line) < 4:
+                return
+            if len(positions) < number_of_atoms:
+                positions.append([float(x) for x in line[1:4]])
+        yield positions
+
+
+def read_mde(handle):
+    """
+    Read the .MDE file, skipping the comment lines and an incomplete last line.
+    :return: a dictionary with a numpy array for each of the `MDE_COLUMNS`.
+    """
+    rows = []
+    for line in handle:
+        if line.startswith('#'):
+            continue
+        values = line.split()
+        if len(values) < len(MDE_COLUMNS):
+            continue
+        rows.append([float(x) for x in values[:len(MDE_COLUMNS)]])
+
+    rows = np.array(rows, dtype=float).reshape(-1, len(MDE_COLUMNS))
+    mde = {name: rows[:, index] for index, name in enumerate(MDE_COLUMNS)}
+    mde['steps'] = mde['steps'].astype(int)
+
+    return mde
+
+
+def get_md_trajectory(ani_path, mde_path, input_structure, parameters=None):
+    """
+    Create the TrajectoryData of an MD run from the .ANI file and, if present, the .MDE file.
+    Only the frames present in both files are kept and the `stepids` are the MD steps of the .MDE file.
+    Without the .MDE file, the steps are counted from the `md-initial-time-step` of the `parameters`.
+    The cell of the input structure is set for each frame, unless the type of run changes the cell.
+    The arrays of the `MDE_COLUMNS` (except the steps) are also stored.
+    :return: the TrajectoryData, or None if no complete frame is present.
+    """
+    from aiida.orm import TrajectoryData
+    from aiida_siesta.utils.tkdict import FDFDict
+
+    number_of_atoms = len(input_structure.sites)
+    with open(ani_path) as handle:
+        positions = list(iter_ani_frames(handle, number_of_atoms))
+
+    fdf = FDFDict(parameters or {})
+    if mde_path is not None:
+        with open(mde_path) as handle:
+            mde = read_mde(handle)
+    else:
+        first_step = int(fdf.get('mdinitialtimestep', 1))
+        mde = {'steps': np.arange(first_step, first_step + len(positions))}
+
+    num_frames = min(len(positions), len(mde['steps']))
+    if num_frames == 0:
+        return None
+
+    symbols = [input_structure.get_kind(site.kind_name).symbol for site in input_structure.sites]
+    cells = None
+    if FDFDict.translate_key(str(fdf.get('mdtypeofrun', ''))) not in VARIABLE_CELL_MD:
+        cells = np.array([input_structure.cell] * num_frames)
+
+    trajectory = TrajectoryData()
+    trajectory.set_trajectory(symbols, np.array(positions[:num_frames]), stepids=mde['steps'][:num_frames], cells=cells)
+    for name in MDE_COLUMNS[1:]:
+        if name in mde:
+            trajectory.set_array(name, mde[name][:num_frames])
+
+    return trajectory
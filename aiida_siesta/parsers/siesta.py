@@ -4,6 +4,7 @@ from aiida.parsers import Parser
 from aiida.orm import Dict
 from aiida.common import OutputParsingError
 from aiida.common import exceptions
+from aiida_siesta.utils.monitor import MONITOR_FILE
 
 # See the LICENSE.txt and AUTHORS.txt files.
 
@@ -54,13 +55,138 @@ def get_min_split(output_path):
     return min_split_norm
 
 
+def is_walltime_problem(file_path):
+    """
+    Check the presence, in the file, of the message printed by Siesta when the calculation
+    is stopped because the requested walltime (`MaxWalltime`) was reached. Only whole lines
+    starting with the message are considered and, in the .out file, the echo of the input
+    (where the keyword and its comments appear) is skipped.
+    """
+    import re
+
+    walltime_pattern = re.compile(
+        r"^\s*(INFO:\s*)?Max(\.|imum)?\s*(wall[\s\-]*clock\s*time|walltime)\s*reached", re.IGNORECASE
+    )
+
+    thefile = open(file_path)
+    lines = thefile.read().split('\n')
+    thefile.close()
+
+    in_input_dump = False
+    for line in lines:
+        if "Dump of input data file" in line:
+            in_input_dump = True
+        elif "End of input data file" in line:
+            in_input_dump = False
+        elif not in_input_dump and walltime_pattern.match(line):
+            return True
+
+    return False
+
+
+def is_scheduler_walltime_problem(scheduler_stderr):
+    """
+    Check the scheduler standard error for the messages printed when a job is killed
+    because of the time limit (SLURM, PBS/Torque, LSF).
+    """
+    import re
+
+    if not scheduler_stderr:
+        return False
+
+    patterns = [r"DUE TO TIME LIMIT", r"walltime.*exceeded", r"TERM_RUNLIMIT"]
+    for pattern in patterns:
+        if re.search(pattern, scheduler_stderr, re.IGNORECASE):
+            return True
+
+    return False
+
+
+def get_last_md_step(output_path):
+    """
+    Extract from the .out file the number of the last geometry step (relaxation move
+    or MD step) that was started. Returns None if no step is found.
+    """
+    import re
+
+    step_pattern = re.compile(r"Begin .*(move|step)\s*=\s*(\d+)")
+
+    thefile = open(output_path)
+    lines = thefile.read().split('\n')
+    thefile.close()
+
+    last_step = None
+    for line in lines:
+        match = step_pattern.search(line)
+        if match:
+            last_step = int(match.group(2))
+
+    return last_step
+
+
+def get_max_memory(output_path):
+    """
+    Extract from the .out file the maximum dynamic memory allocated (in MB) reported by Siesta.
+    In parallel runs, the maximum among the reported nodes is returned. Returns None if not found.
+    """
+    import re
+
+    memory_pattern = re.compile(r"Maximum dynamic memory allocated.*=\s*([\d.]+)\s*MB")
+
+    thefile = open(output_path)
+    lines = thefile.read().split('\n')
+    thefile.close()
+
+    max_memory = None
+    for line in lines:
+        match = memory_pattern.search(line)
+        if match:
+            memory = float(match.group(1))
+            if max_memory is None or memory > max_memory:
+                max_memory = memory
+
+    return max_memory
+
+
+def get_structure_from_xv(xv_path, input_structure):
+    """
+    Create the structure from the .XV file, containing the geometry from which
+    Siesta would restart. Units in the file are Bohr. Like in `get_last_structure`,
+    the floating sites (at the end of the list of atoms) are removed.
+    """
+    from aiida.orm.nodes.data.structure import Site
+
+    bohr_to_ang = 0.529177210903
+
+    thefile = open(xv_path)
+    lines = thefile.read().split('\n')
+    thefile.close()
+
+    cell = [[float(x) * bohr_to_ang for x in line.split()[0:3]] for line in lines[0:3]]
+    number_of_real_atoms = len(input_structure.sites)
+    positions = []
+    for line in lines[4:4 + number_of_real_atoms]:
+        positions.append([float(x) * bohr_to_ang for x in line.split()[2:5]])
+
+    new_structure = input_structure.clone()
+    new_structure.reset_cell(cell)
+    new_structure.clear_sites()
+    for i in range(number_of_real_atoms):
+        new_site = Site(site=input_structure.sites[i])
+        new_site.position = positions[i]
+        new_structure.append_site(new_site)
+
+    return new_structure
+
+
 def get_parsed_xml_doc(xml_path):
 
     from xml.dom import minidom
+    from xml.parsers.expat import ExpatError
 
     try:
         xmldoc = minidom.parse(xml_path)
-    except EOFError:
+    except (EOFError, ExpatError):
         raise OutputParsingError("Faulty Xml File")
 
     return xmldoc
@@ -318,10 +444,27 @@ class SiestaParser(Parser):
 
         output_path, messages_path, xml_path, json_path, bands_path, basis_enthalpy_path = \
             self._fetch_output_files(output_folder)
+        xv_path = self._get_xv_path(kwargs.get('retrieved_temporary_folder'))
+
+        # The trajectory of an MD run is parsed first, so that it is returned even if the run stopped early
+        self._parse_md_trajectory(kwargs.get('retrieved_temporary_folder'))
+
+        # The calculation might have been killed by the monitor because the scf was diverging
+        if MONITOR_FILE in output_folder.list_object_names():
+            return self._parse_monitor_info(output_folder, parser_info)
+
+        # The walltime might have been reached (Siesta stops by itself because of `maxwalltime`)
+        # or exceeded (the scheduler kills the job). In the second case the xml file might be incomplete.
+        walltime_exceeded = self._is_walltime_exceeded(output_path, messages_path)
 
         if xml_path is None:
             raise OutputParsingError("Xml file not retrieved")
-        xmldoc = get_parsed_xml_doc(xml_path)
+        try:
+            xmldoc = get_parsed_xml_doc(xml_path)
+        except OutputParsingError:
+            if walltime_exceeded:
+                return self._parse_walltime_restart_info(output_path, xv_path, parser_info)
+            raise
         result_dict = get_dict_from_xml_doc(xmldoc)
 
         if output_path is None:
@@ -329,6 +472,15 @@ class SiestaParser(Parser):
 
         output_dict = dict(list(result_dict.items()) + list(parser_info.items()))
 
+        if walltime_exceeded:
+            output_dict["walltime_exceeded"] = True
+            output_dict["last_md_step"] = get_last_md_step(output_path)
+
+        max_memory = get_max_memory(output_path)
+        if max_memory is not None:
+            output_dict["max_memory"] = max_memory
+            output_dict["max_memory_units"] = "MB"
+
         warnings_list = []
 
         if json_path is not None:
@@ -386,6 +538,9 @@ class SiestaParser(Parser):
             success, out_struc = get_last_structure(xmldoc, in_struc)
             if not success:
                 self.logger.warning("Problem in parsing final structure, returning inp structure in output_structure")
+            # For a restart after the walltime, the geometry to use is the one in the .XV file
+            if walltime_exceeded and xv_path is not None:
+                out_struc = get_structure_from_xv(xv_path, in_struc)
 
             self.out('output_structure', out_struc)
 
@@ -434,7 +589,16 @@ class SiestaParser(Parser):
             if ions:
                 self.out('ion_files', ions)
 
-        # Error analysis
+        # Error analysis. The walltime problem comes first, as other errors (for instance
+        # GEOM_NOT_CONV) might be just a consequence of the calculation being stopped.
+        if walltime_exceeded:
+            self.logger.error("The calculation was stopped because the walltime was exceeded")
+            return self.exit_codes.WALLTIME_EXCEEDED
+
+        # A one-shot calculation of the bands from the density matrix of a parent calculation
+        # (`NON_SCF_BANDS` setting) is not required to converge, the bands are parsed anyway
+        non_scf_bands = self._get_setting('NON_SCF_BANDS', False)
+
         if have_errors_to_analyse:
             # No metter if "INFO: Job completed" is present (succesfull) or not, we check for known
             # errors. They might apprear as WARNING (therefore with succesful True) or FATAL
@@ -451,7 +615,7 @@ class SiestaParser(Parser):
                     #are treated in this way, we explore the .out file for more insights.
                     if is_polarization_problem(output_path):
                         return self.exit_codes.BASIS_POLARIZ
-                if u'SCF_NOT_CONV' in line:
+                if u'SCF_NOT_CONV' in line and not non_scf_bands:
                     return self.exit_codes.SCF_NOT_CONV
                 if u'GEOM_NOT_CONV' in line:
                     return self.exit_codes.GEOM_NOT_CONV
@@ -493,6 +657,16 @@ class SiestaParser(Parser):
 
         return ExitCode(0)
 
+    def _get_setting(self, key, default=None):
+        """
+        Return the value of a key of the `settings` input (the keys are case insensitive).
+        """
+        if 'settings' not in self.node.inputs:
+            return default
+        settings = {str(k).upper(): v for (k, v) in self.node.inputs.settings.get_dict().items()}
+
+        return settings.get(key, default)
+
     def _fetch_output_files(self, out_folder):
         """
         Checks the output folder for standard output and standard error files, returns their absolute paths
@@ -537,6 +711,93 @@ class SiestaParser(Parser):
 
         return output_path, messages_path, xml_path, json_path, bands_path, basis_enthalpy_path
 
+    def _get_xv_path(self, temporary_folder):
+        """
+        Return the path of the .XV file, retrieved in the temporary folder (it is discarded after
+        parsing, only the `output_structure` is stored), or None if not present.
+        """
+        if temporary_folder is None:
+            return None
+
+        xv_path = os.path.join(temporary_folder, str(self.node.get_option('prefix')) + ".XV")
+        if not os.path.isfile(xv_path):
+            return None
+
+        return xv_path
+
+    def _parse_md_trajectory(self, temporary_folder):
+        """
+        Return the `output_trajectory` if the .ANI file of an MD run was retrieved (in the temporary
+        folder, the files are discarded after parsing). The .MDE file is also read, if present.
+        """
+        from aiida_siesta.parsers.md_trajectory import get_md_trajectory
+
+        if temporary_folder is None:
+            return
+
+        prefix = str(self.node.get_option('prefix'))
+        ani_path = os.path.join(temporary_folder, prefix + ".ANI")
+        mde_path = os.path.join(temporary_folder, prefix + ".MDE")
+        if not os.path.isfile(ani_path):
+            return
+        if not os.path.isfile(mde_path):
+            mde_path = None
+
+        parameters = self.node.inputs.parameters.get_dict() if 'parameters' in self.node.inputs else None
+        trajectory = get_md_trajectory(ani_path, mde_path, self.node.inputs.structure, parameters)
+        if trajectory is not None:
+            self.out('output_trajectory', trajectory)
+
+    def _is_walltime_exceeded(self, output_path, messages_path):
+        """
+        Detect if the calculation was stopped because of the walltime. Three sources are
+        inspected: the MESSAGES file, the .out file and the standard error of the scheduler.
+        """
+        if messages_path is not None and is_walltime_problem(messages_path):
+            return True
+        if output_path is not None and is_walltime_problem(output_path):
+            return True
+        try:
+            scheduler_stderr = self.node.get_scheduler_stderr()
+        except (IOError, OSError):
+            scheduler_stderr = None
+
+        return is_scheduler_walltime_problem(scheduler_stderr)
+
+    def _parse_walltime_restart_info(self, output_path, xv_path, parser_info):
+        """
+        Called when the walltime was exceeded and the xml file is incomplete. Returns the minimal
+        information needed to restart: the last geometry step and, if the .XV file is present,
+        the structure from which to restart.
+        """
+        output_dict = dict(parser_info)
+        output_dict["walltime_exceeded"] = True
+        if output_path is not None:
+            output_dict["last_md_step"] = get_last_md_step(output_path)
+        self.out('output_parameters', Dict(dict=output_dict))
+
+        if xv_path is not None:
+            self.out('output_structure', get_structure_from_xv(xv_path, self.node.inputs.structure))
+
+        self.logger.error("The calculation was stopped because the walltime was exceeded")
+        return self.exit_codes.WALLTIME_EXCEEDED
+
+    def _parse_monitor_info(self, output_folder, parser_info):
+        """
+        Called when the calculation was killed by the monitor. Returns the rule that fired
+        and the scf history read by the monitor.
+        """
+        import json
+
+        monitor_info = json.loads(output_folder.get_object_content(MONITOR_FILE))
+        output_dict = dict(parser_info)
+        output_dict["monitor_kill_reason"] = monitor_info["reason"]
+        output_dict["monitor_scf_history"] = monitor_info["scf_history"]
+        self.out('output_parameters', Dict(dict=output_dict))
+
+        self.logger.error(f"The calculation was killed by the monitor, the scf was {monitor_info['reason']}")
+        return self.exit_codes.SCF_DIVERGED
+
     def _get_warnings_from_file(self, messages_path):
         """
         Generates a list of warnings from the 'MESSAGES' file, which  contains a line per message,
@@ -0,0 +1,154 @@
+"""
+Population-based optimizer used by the `BasisOptimizationWorkChain`.
+It is a separable (diagonal) evolution strategy: at each generation a population of candidates is
+sampled from a normal distribution, all the candidates are evaluated in parallel and the mean and the
+(per-variable) width of the distribution are updated from the weighted best half of the population.
+The variables are scaled, so that 1 is the starting point, and kept within bounds.
+"""
+import numpy as np
+
+
+class DiagonalEvolutionStrategy:
+    """
+    Minimize a function of `num_vars` variables evaluating batches of candidates.
+    Use `ask` to obtain the candidates of a generation and `tell` to pass back their values.
+    The state can be saved with `to_dict` and restored with `from_dict`, so that it can be kept in
+    the context of a WorkChain.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        num_vars,
+        bounds=(0.7, 1.5),
+        initial_step=0.1,
+        xtol=0.01,
+        ftol=0.001,
+        patience=3,
+        seed=0
+    ):
+        """
+        :param num_vars: number of variables.
+        :param bounds: lower and upper bound of the (scaled) variables, the starting point is 1.
+        :param initial_step: the initial width of the distribution, for all the variables.
+        :param xtol: the optimization is converged when the width of the distribution is below `xtol`
+            for all the variables.
+        :param ftol: the optimization is converged when the best value improved less than `ftol`
+            in the last `patience` generations.
+        :param patience: see `ftol`.
+        :param seed: seed of the random generator. The samples of each generation are reproducible.
+        """
+        self.bounds = (float(bounds[0]), float(bounds[1]))
+        self.xtol = xtol
+        self.ftol = ftol
+        self.patience = patience
+        self.seed = seed
+        self.generation = 0
+        self.mean = np.ones(num_vars)
+        self.sigma = np.full(num_vars, float(initial_step))
+        self.best_x = self.mean.copy()
+        self.best_value = None
+        self.history = []
+
+    def ask(self, size):
+        """
+        Sample the candidates of the current generation.
+        :param size: the number of candidates.
+        :return: array of shape (size, num_vars).
+        """
+        rng = np.random.default_rng([self.seed, self.generation])
+        samples = self.mean + self.sigma * rng.standard_normal((size, len(self.mean)))
+
+        return np.clip(samples, *self.bounds)
+
+    def tell(self, samples, values):
+        """
+        Update the distribution with the values of the candidates of the current generation.
+        :param samples: the candidates, as returned by `ask`.
+        :param values: the values of the candidates, None or nan for the failed ones.
+        :raise ValueError: if all the candidates failed.
+        """
+        samples = np.asarray(samples, dtype=float)
+        values = np.array([np.nan if value is None else value for value in values], dtype=float)
+
+        valid = np.isfinite(values)
+        if not valid.any():
+            raise ValueError("no valid value in the generation")
+        samples, values = samples[valid], values[valid]
+
+        order = np.argsort(values)
+        num_parents = max(1, len(values) // 2)
+        parents = samples[order[:num_parents]]
+        weights = np.log(num_parents + 0.5) - np.log(np.arange(1, num_parents + 1))
+        weights /= weights.sum()
+
+        new_mean = weights @ parents
+        spread = np.sqrt(weights @ (parents - self.mean)**2)
+        self.sigma = 0.5 * self.sigma + 0.5 * spread
+        self.mean = np.clip(new_mean, *self.bounds)
+
+        if self.best_value is None or values[order[0]] < self.best_value:
+            self.best_value = float(values[order[0]])
+            self.best_x = samples[order[0]].copy()
+        self.history.append(self.best_value)
+        self.generation += 1
+
+    def set_reference(self, value):
+        """
+        Set the value of the starting point (all variables equal to 1), evaluated before the optimization.
+        """
+        self.best_value = float(value)
+        self.best_x = np.ones(len(self.mean))
+        self.history.append(self.best_value)
+
+    @property
+    def converged(self):
+        """
+        True if the width of the distribution is below `xtol` or the best value did not improve
+        more than `ftol` in the last `patience` generations.
+        """
+        if np.all(self.sigma < self.xtol):
+            return True
+        if len(self.history) > self.patience:
+            return self.history[-self.patience - 1] - self.history[-1] < self.ftol
+
+        return False
+
+    def to_dict(self):
+        """
+        Return the state of the optimizer as a dictionary of python types.
+        """
+        return {
+            "bounds": list(self.bounds),
+            "xtol": self.xtol,
+            "ftol": self.ftol,
+            "patience": self.patience,
+            "seed": self.seed,
+            "generation": self.generation,
+            "mean": self.mean.tolist(),
+            "sigma": self.sigma.tolist(),
+            "best_x": self.best_x.tolist(),
+            "best_value": self.best_value,
+            "history": list(self.history),
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        """
+        Restore an optimizer from the dictionary returned by `to_dict`.
+        """
+        optimizer = cls(
+            len(state["mean"]),
+            bounds=state["bounds"],
+            xtol=state["xtol"],
+            ftol=state["ftol"],
+            patience=state["patience"],
+            seed=state["seed"]
+        )
+        optimizer.generation = state["generation"]
+        optimizer.mean = np.array(state["mean"])
+        optimizer.sigma = np.array(state["sigma"])
+        optimizer.best_x = np.array(state["best_x"])
+        optimizer.best_value = state["best_value"]
+        optimizer.history = list(state["history"])
+
+        return optimizer
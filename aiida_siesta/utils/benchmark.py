@@ -0,0 +1,95 @@
+"""
+Analysis of the parallel-scaling benchmarks run by the `ParallelBenchmarkWorkChain` and look up of the
+best parallel layout for a new calculation. Each benchmark runs the same input with several `resources`
+(MPI ranks, OpenMP threads, machines) and parallel fdf options. The speedup and the parallel efficiency
+of each configuration are computed with respect to the configuration using the least cores.
+The results are stored in the `results_dict` output of the WorkChain, together with the number of
+orbitals (`no_u`) of the system and the computer, so that they can be queried later (see `get_benchmark_layout`).
+"""
+from aiida import orm
+
+#Process type of the benchmark WorkChain, used to query the stored results
+BENCHMARK_PROCESS_TYPE = 'aiida.workflows:siesta.benchmark'
+
+
+def get_num_cores(resources):
+    """
+    Number of cores used by a calculation: machines x MPI ranks per machine x threads per rank.
+    """
+    return (
+        resources.get("num_machines", 1) * resources.get("num_mpiprocs_per_machine", 1) *
+        resources.get("num_cores_per_mpiproc", 1)
+    )
+
+
+def analyse_benchmark(configurations, min_efficiency=0.7):
+    """
+    Compute the speedup and the efficiency of each configuration and choose the recommended one.
+    :param configurations: list of dictionaries with keys `resources`, `parallel_options` and `global_time`
+                           (None if the calculation failed). Other keys are kept.
+    :param min_efficiency: the recommended configuration is the fastest one with at least this efficiency.
+    :return: a dictionary with the `table` (the configurations with the additional keys `cores`, `speedup`
+             and `efficiency`) and the index of the `recommended` configuration in the table.
+    :raise ValueError: if no calculation finished.
+    """
+    table = [dict(configuration, cores=get_num_cores(configuration["resources"])) for configuration in configurations]
+    finished = [row for row in table if row["global_time"]]
+    if not finished:
+        raise ValueError("no configuration of the benchmark finished")
+
+    # The reference is the fastest configuration with the least cores
+    reference = min(finished, key=lambda row: (row["cores"], row["global_time"]))
+    for row in table:
+        if row["global_time"]:
+            row["speedup"] = reference["global_time"] / row["global_time"]
+            row["efficiency"] = row["speedup"] * reference["cores"] / row["cores"]
+        else:
+            row["speedup"] = None
+            row["efficiency"] = None
+
+    efficient = [row for row in finished if row["efficiency"] >= min_efficiency] or [reference]
+    recommended = min(efficient, key=lambda row: row["global_time"])
+
+    return {"table": table, "recommended": table.index(recommended)}
+
+
+def get_benchmark_layout(no_u, computer=None, max_ratio=2.):
+    """
+    Return the recommended configuration of the stored benchmark with the closest number of orbitals.
+    :param no_u: the number of orbitals of the new calculation.
+    :param computer: optional label of the computer, to consider only the benchmarks run there.
+    :param max_ratio: benchmarks with a number of orbitals differing more than this factor are ignored.
+    :return: a dictionary with the `resources` and the `parallel_options`, None if no benchmark is available.
+    """
+    import numpy as np
+
+    query = orm.QueryBuilder()
+    query.append(
+        orm.WorkChainNode,
+        filters={
+            'process_type': BENCHMARK_PROCESS_TYPE,
+            'attributes.exit_status': 0
+        },
+        tag='benchmark'
+    )
+    query.append(
+        orm.Dict,
+        with_incoming='benchmark',
+        edge_filters={'label': 'results_dict'},
+        project=['attributes.no_u', 'attributes.computer', 'attributes.recommended_configuration']
+    )
+
+    best = None
+    for benchmark_no_u, benchmark_computer, configuration in query.iterall():
+        if computer is not None and benchmark_computer != computer:
+            continue
+        if not benchmark_no_u or configuration is None:
+            continue
+        distance = abs(np.log(benchmark_no_u / no_u))
+        if distance <= np.log(max_ratio) and (best is None or distance < best[0]):
+            best = (distance, configuration)
+
+    if best is None:
+        return None
+
+    return {"resources": best[1]["resources"], "parallel_options": best[1]["parallel_options"]}
@@ -0,0 +1,263 @@
+"""
+Driver for high-throughput campaigns. A campaign runs the same WorkChain, with inputs created by
+the WorkChain input generator according to a protocol, on all the structures of a group.
+The submission is throttled, so that the number of active processes on the computer never
+exceeds a maximum. The builders are generated in this process, since they require the database,
+only the costly operations that do not require the database (seekpath) run in a pool of processes.
+The state of the campaign is kept in the database: each submitted process is added to a
+campaign group, with the uuid of its structure stored in the extras. Therefore a campaign can be
+interrupted and resumed at any time, the structures already submitted are skipped.
+"""
+import time
+from aiida import orm
+
+#Key of the extras of the submitted processes, storing the uuid of the input structure
+CAMPAIGN_EXTRA_KEY = 'campaign_structure_uuid'
+
+#Prefix of the label of the submitted processes, followed by the label of the campaign group
+CAMPAIGN_LABEL_PREFIX = 'campaign:'
+
+#Process states of the processes that are not terminated
+ACTIVE_STATES = ('created', 'waiting', 'running')
+
+
+def get_num_active_calculations(computer):
+    """
+    Number of active calculations (submitted by anybody) on a computer.
+    :param computer: the Computer.
+    """
+    active_filter = {'attributes.process_state': {'in': ACTIVE_STATES}}
+    query = orm.QueryBuilder()
+    query.append(orm.Computer, filters={'id': computer.pk}, tag='computer')
+    query.append(orm.CalcJobNode, with_computer='computer', filters=active_filter)
+
+    return query.count()
+
+
+def get_processes_state(campaign_group):
+    """
+    Return a dictionary with, for each structure uuid already submitted, the tuple
+    (process_state, exit_status) of the last process submitted in the campaign.
+    :param campaign_group: the Group collecting the processes of the campaign.
+    """
+    query = orm.QueryBuilder()
+    query.append(orm.Group, filters={'id': campaign_group.pk}, tag='group')
+    query.append(
+        orm.ProcessNode,
+        with_group='group',
+        project=[f'extras.{CAMPAIGN_EXTRA_KEY}', 'attributes.process_state', 'attributes.exit_status'],
+        tag='process'
+    )
+    query.order_by({'process': {'ctime': 'asc'}})
+
+    return {uuid: (state, exit_status) for uuid, state, exit_status in query.iterall()}
+
+
+def adopt_orphan_processes(campaign_group):
+    """
+    Add to the campaign group the processes submitted by the campaign that are not yet in the group,
+    as it happens when the campaign is interrupted right after a submission. They are recognized from
+    the label, `CAMPAIGN_LABEL_PREFIX` followed by the label of the group, set before the submission.
+    The `CAMPAIGN_EXTRA_KEY` extra is set from the input structure of the process.
+    :param campaign_group: the Group collecting the processes of the campaign.
+    :return: the number of processes added to the group.
+    """
+    query = orm.QueryBuilder()
+    query.append(orm.Group, filters={'id': campaign_group.pk}, tag='group')
+    query.append(orm.ProcessNode, with_group='group', project='id')
+    in_group = {pk for pk, in query.iterall()}
+
+    query = orm.QueryBuilder()
+    query.append(orm.StructureData, project='uuid', tag='structure')
+    query.append(
+        orm.ProcessNode,
+        with_incoming='structure',
+        filters={'label': CAMPAIGN_LABEL_PREFIX + campaign_group.label},
+        project='*'
+    )
+
+    orphans = []
+    for uuid, process in query.iterall():
+        if process.pk in in_group:
+            continue
+        process.set_extra(CAMPAIGN_EXTRA_KEY, uuid)
+        orphans.append(process)
+    if orphans:
+        campaign_group.add_nodes(orphans)
+
+    return len(orphans)
+
+
+def get_campaign_status(structures_group, campaign_group):
+    """
+    Return a dictionary summarizing the state of a campaign: the number of structures
+    in the group and the number of processes submitted, active, finished ok and failed.
+    It does not require the code or the other inputs of a `SubmissionCampaign`.
+    :param structures_group: the Group containing the StructureData.
+    :param campaign_group: the Group collecting the processes of the campaign.
+    """
+    adopt_orphan_processes(campaign_group)
+    states = get_processes_state(campaign_group).values()
+    active = [state for state, _ in states if state in ACTIVE_STATES or state is None]
+    finished_ok = [state for state, exit_status in states if state == 'finished' and exit_status == 0]
+
+    return {
+        'structures': structures_group.count(),
+        'submitted': len(states),
+        'active': len(active),
+        'finished_ok': len(finished_ok),
+        'failed': len(states) - len(active) - len(finished_ok),
+    }
+
+
+class SubmissionCampaign:
+    """
+    Submit a WorkChain for all the structures of a group, keeping at most `max_active` processes
+    active on the computer at any time.
+    The WorkChain must implement the `inputs_generator` method, the builders are obtained
+    calling `get_filled_builder(structure, calc_engines, protocol, **generator_kwargs)`.
+    """
+
+    def __init__(
+        self,
+        workchain_class,
+        structures_group,
+        campaign_group,
+        calc_engines,
+        protocol,
+        max_active=100,
+        generator_kwargs=None,
+        num_workers=4,
+        resubmit_failed=False
+    ):
+        """
+        :param workchain_class: the WorkChain to submit.
+        :param structures_group: label of the group containing the StructureData.
+        :param campaign_group: label of the group where the submitted processes are collected.
+                               It is created if it does not exist. It stores the state of the campaign.
+        :param calc_engines: dictionary with the code and options, see `how_to_pass_computation_options`
+                             of the input generator.
+        :param protocol: name of the protocol.
+        :param max_active: maximum number of active processes on the computer of the siesta code.
+        :param generator_kwargs: additional arguments for `get_filled_builder` (for instance `relaxation_type`).
+        :param num_workers: number of processes running seekpath for the structures, the builders are
+                            generated in this process anyway. With 1, no pool is created.
+        :param resubmit_failed: if True, the structures whose process failed are submitted again.
+        """
+        self._workchain_class = workchain_class
+        self._structures_group = orm.load_group(structures_group)
+        self._campaign_group, _ = orm.Group.objects.get_or_create(campaign_group)
+        self._calc_engines = calc_engines
+        self._protocol = protocol
+        self._max_active = max_active
+        self._generator_kwargs = generator_kwargs if generator_kwargs is not None else {}
+        self._num_workers = num_workers
+        self._resubmit_failed = resubmit_failed
+        self._computer = orm.load_code(calc_engines['siesta']['code']).computer
+        self._generator = workchain_class.inputs_generator()
+
+    def get_processes_state(self):
+        """
+        Return a dictionary with, for each structure uuid already submitted, the tuple
+        (process_state, exit_status) of the last process submitted in the campaign.
+        The processes submitted but not yet added to the campaign group are adopted first.
+        """
+        adopt_orphan_processes(self._campaign_group)
+        return get_processes_state(self._campaign_group)
+
+    def get_pending_structures(self):
+        """
+        Return the structures of the group that still need to be submitted.
+        """
+        submitted = self.get_processes_state()
+
+        query = orm.QueryBuilder()
+        query.append(orm.Group, filters={'id': self._structures_group.pk}, tag='group')
+        query.append(orm.StructureData, with_group='group', project='*', tag='structure')
+        query.order_by({'structure': {'id': 'asc'}})
+
+        pending = []
+        for (structure,) in query.iterall():
+            if structure.uuid in submitted:
+                state, exit_status = submitted[structure.uuid]
+                failed = state in ('excepted', 'killed') or (state == 'finished' and exit_status != 0)
+                if not (self._resubmit_failed and failed):
+                    continue
+            pending.append(structure)
+
+        return pending
+
+    def get_num_active(self):
+        """
+        Number of active processes on the computer. Both the active calculations on the computer
+        (submitted by anybody) and the active processes of the campaign are counted, the maximum is returned.
+        Processes of the campaign that have not yet submitted a calculation are therefore considered.
+        """
+        num_calcs = get_num_active_calculations(self._computer)
+
+        num_campaign = len([
+            state for state, _ in self.get_processes_state().values() if state in ACTIVE_STATES or state is None
+        ])
+
+        return max(num_calcs, num_campaign)
+
+    def submit_new_batch(self, dry_run=False):
+        """
+        Submit new processes, as many as the free slots on the computer.
+        The builders are generated serially, since the ORM and the caches of the input generator
+        are not thread safe, with seekpath run in a pool of `num_workers` processes.
+        Each process is labelled with the campaign before the submission, so that it is recognized
+        (see `adopt_orphan_processes`) even if the campaign is interrupted before adding it to the group.
+        :param dry_run: if True, the builders are not submitted.
+        :return: a dictionary with the uuid of the structures as keys and the submitted processes
+                 (or the builders in case of `dry_run`) as values.
+        """
+        from aiida.engine import submit
+
+        num_to_submit = self._max_active - self.get_num_active()
+        if num_to_submit <= 0:
+            return {}
+
+        structures = self.get_pending_structures()[:num_to_submit]
+        if not structures:
+            return {}
+
+        builders = list(
+            self._generator.get_filled_builders(
+                structures, self._calc_engines, self._protocol, num_workers=self._num_workers, **self._generator_kwargs
+            )
+        )
+
+        submitted = {}
+        for structure, builder in zip(structures, builders):
+            if dry_run:
+                submitted[structure.uuid] = builder
+                continue
+            builder.metadata.label = CAMPAIGN_LABEL_PREFIX + self._campaign_group.label
+            process = submit(builder)
+            process.set_extra(CAMPAIGN_EXTRA_KEY, structure.uuid)
+            self._campaign_group.add_nodes([process])
+            submitted[structure.uuid] = process
+
+        return submitted
+
+    def run(self, sleep_interval=60, callback=None):
+        """
+        Submit all the structures, waiting `sleep_interval` seconds each time no slot is available.
+        Return when all the structures are submitted (it does not wait the end of the processes).
+        :param callback: optional function called with the dictionary returned by `submit_new_batch`
+                         after each submission.
+        """
+        while True:
+            submitted = self.submit_new_batch()
+            if callback is not None and submitted:
+                callback(submitted)
+            if not self.get_pending_structures():
+                break
+            time.sleep(sleep_interval)
+
+    def get_status(self):
+        """
+        Return a dictionary summarizing the state of the campaign, see `get_campaign_status`.
+        """
+        return get_campaign_status(self._structures_group, self._campaign_group)
@@ -0,0 +1,368 @@
+"""
+Cost model for Siesta calculations. The walltime and the memory of the finished SiestaCalculations
+in the database are fitted as power laws of the size of the problem: the number of orbitals (`no_u`),
+the number of non-zero elements of the sparse matrices (`nnz`), the number of mesh points,
+the number of kpoints and the number of MPI ranks. In practice a linear least squares fit is
+performed on the logarithms of the quantities.
+The model is used to choose the `resources` and the `max_wallclock_seconds` of new calculations.
+Since `no_u`, `nnz` and the mesh are only known after a calculation is run, for new calculations they
+are estimated from the structure and the input parameters (see `estimate_features`).
+"""
+import time
+import numpy as np
+from aiida import orm
+
+#Features of the model, in order
+FEATURES = ("no_u", "nnz", "mesh_points", "kpoints", "ranks")
+
+#Approximate number of orbitals per atom for each basis size, for elements
+#with s-p valence, with s-d valence (transition metals) and for H and He.
+_ORBITALS_PER_ATOM = {
+    "sz": (4, 6, 1),
+    "szp": (9, 9, 4),
+    "dz": (8, 12, 2),
+    "dzp": (13, 15, 5),
+    "tzp": (17, 21, 6),
+    "tzdp": (22, 30, 9),
+}
+
+#Radius (Ang) of the sphere of atoms interacting with an atom, used to estimate `nnz`
+_INTERACTION_RADIUS = 7.0
+
+_BOHR_TO_ANG = 0.529177210903
+
+#Process-level cache of the fitted models, see `get_cost_model`
+_COST_MODELS_CACHE = {}
+
+#Minimum age (seconds) of a cached model before it is fitted again on new calculations
+_COST_MODELS_TTL = 600
+
+
+def _num_valence_kind(symbol):
+    """
+    Index in the tuples of `_ORBITALS_PER_ATOM`: 2 for H and He, 1 for transition metals
+    (and lanthanides/actinides), 0 otherwise.
+    """
+    from aiida.common.constants import elements
+
+    atomic_number = [num for num, element in elements.items() if element["symbol"] == symbol][0]
+    if atomic_number <= 2:
+        return 2
+    if 21 <= atomic_number <= 30 or 39 <= atomic_number <= 48 or 57 <= atomic_number <= 80 or atomic_number >= 89:
+        return 1
+    return 0
+
+
+def _get_mesh_cutoff_ry(parameters):
+    """
+    The `mesh-cutoff` in Ry from a dictionary of parameters (Siesta default 300 Ry).
+    """
+    from aiida_siesta.utils.tkdict import FDFDict
+
+    value = FDFDict(parameters).get("meshcutoff")
+    if value is None:
+        return 300.
+    value = str(value).split()
+    cutoff = float(value[0])
+    if len(value) > 1 and value[1].lower() == "ev":
+        cutoff = cutoff / 13.605693122994
+    if len(value) > 1 and value[1].lower() == "mev":
+        cutoff = cutoff / 13605.693122994
+    if len(value) > 1 and value[1].lower() == "ha":
+        cutoff = cutoff * 2.
+    return cutoff
+
+
+def estimate_features(structure, parameters, basis=None, kpoints=None, ranks=1):
+    """
+    Estimate the features of the cost model for a calculation that was not run yet.
+    :param structure: the StructureData.
+    :param parameters: python dictionary of the parameters.
+    :param basis: python dictionary of the basis (only `pao-basis-size` is used).
+    :param kpoints: KpointsData with a mesh, or None (gamma only).
+    :param ranks: number of MPI ranks.
+    :return: a dictionary with the keys in `FEATURES`.
+    """
+    from aiida_siesta.utils.tkdict import FDFDict
+
+    basis_size = str(FDFDict(basis if basis else {}).get("paobasissize", "dzp")).lower()
+    orbitals = _ORBITALS_PER_ATOM.get(basis_size, _ORBITALS_PER_ATOM["dzp"])
+    orbitals_per_kind = {kind.name: orbitals[_num_valence_kind(kind.symbol)] for kind in structure.kinds}
+    no_u = sum([orbitals_per_kind[site.kind_name] for site in structure.sites])
+
+    # Each orbital interacts with the orbitals in a sphere, periodic images included
+    volume = structure.get_cell_volume()
+    interacting_orbitals = no_u / volume * 4. / 3. * np.pi * _INTERACTION_RADIUS**3
+    nnz = no_u * max(interacting_orbitals, 1.)
+
+    # The spacing of the real space grid is pi/sqrt(cutoff) in Bohr
+    spacing = np.pi / np.sqrt(_get_mesh_cutoff_ry(parameters)) * _BOHR_TO_ANG
+    mesh_points = volume / spacing**3
+
+    num_kpoints = 1
+    if kpoints is not None:
+        try:
+            num_kpoints = int(np.prod(kpoints.get_kpoints_mesh()[0]))
+        except AttributeError:
+            num_kpoints = len(kpoints.get_kpoints())
+
+    return {"no_u": no_u, "nnz": nnz, "mesh_points": mesh_points, "kpoints": num_kpoints, "ranks": ranks}
+
+
+def _get_cost_calcs_query(computer=None, project=None):
+    """
+    Return the QueryBuilder of the SiestaCalculations finished ok (optionally only the ones run on `computer`),
+    with tag 'calc'.
+    """
+    calc_filters = {'attributes.process_label': 'SiestaCalculation', 'attributes.exit_status': 0}
+    query = orm.QueryBuilder()
+    if computer is not None:
+        query.append(orm.Computer, filters={'label': computer}, tag='computer')
+        query.append(orm.CalcJobNode, with_computer='computer', filters=calc_filters, project=project, tag='calc')
+    else:
+        query.append(orm.CalcJobNode, filters=calc_filters, project=project, tag='calc')
+
+    return query
+
+
+def get_cost_data_watermark(computer=None):
+    """
+    Return the tuple (number, largest pk) of the SiestaCalculations finished ok (optionally only the ones
+    run on `computer`). It changes when calculations are added to or removed from the data of the fit,
+    and it is much cheaper to obtain than the data.
+    """
+    query = _get_cost_calcs_query(computer, project=['id'])
+    count = query.count()
+    query.order_by({'calc': {'id': 'desc'}})
+    query.limit(1)
+    last = query.all()
+
+    return count, last[0][0] if last else None
+
+
+def collect_cost_data(computer=None):
+    """
+    Collect from the database the features, walltime and memory of the SiestaCalculations finished ok.
+    :param computer: optional label of a computer, to consider only the calculations run there.
+    :return: a dictionary with numpy arrays for the keys in `FEATURES`, "walltime" (seconds)
+             and "memory" (MB, NaN if not parsed).
+    """
+    query = _get_cost_calcs_query(computer, project=['id', 'attributes.resources'])
+    query.append(
+        orm.Dict,
+        with_incoming='calc',
+        edge_filters={'label': 'output_parameters'},
+        project=[
+            'attributes.no_u', 'attributes.nnz', 'attributes.mesh', 'attributes.global_time', 'attributes.max_memory',
+            'attributes.siesta:Nodes'
+        ]
+    )
+
+    # The kpoints meshes are collected with a second query (calculations without kpoints are gamma only)
+    query_kp = orm.QueryBuilder()
+    query_kp.append(orm.CalcJobNode, filters={'attributes.process_label': 'SiestaCalculation'}, tag='calc')
+    query_kp.append(
+        orm.KpointsData, with_outgoing='calc', edge_filters={'label': 'kpoints'}, project=['attributes.mesh']
+    )
+    query_kp.add_projection('calc', 'id')
+    kpoints_meshes = {pk: mesh for mesh, pk in query_kp.iterall()}
+
+    rows = []
+    for pk, resources, no_u, nnz, mesh, walltime, memory, nodes in query.iterall():
+        if None in (no_u, nnz, mesh, walltime):
+            continue
+        try:
+            ranks = int(nodes)
+        except (TypeError, ValueError):
+            resources = resources if resources else {}
+            ranks = resources.get("num_machines", 1) * resources.get("num_mpiprocs_per_machine", 1)
+        kpoints = int(np.prod(kpoints_meshes[pk])) if kpoints_meshes.get(pk) else 1
+        memory = np.nan if memory is None else memory
+        rows.append([no_u, nnz, np.prod(mesh), kpoints, ranks, walltime, memory])
+
+    data = np.array(rows, dtype=float).reshape(-1, len(FEATURES) + 2)
+    result = {feature: data[:, index] for index, feature in enumerate(FEATURES)}
+    result["walltime"] = data[:, len(FEATURES)]
+    result["memory"] = data[:, len(FEATURES) + 1]
+
+    return result
+
+
+def _design_matrix(features):
+    columns = [np.log(np.asarray(features[feature], dtype=float)) for feature in FEATURES]
+    return np.column_stack([np.ones_like(columns[0])] + columns)
+
+
+def _fit_log_linear(design, target, regularization):
+    """
+    Ridge-regularized least squares fit of log(target), the intercept is not regularized.
+    Return the coefficients and the standard deviation of the residuals.
+    """
+    log_target = np.log(target)
+    penalty = regularization * np.eye(design.shape[1])
+    penalty[0, 0] = 0.
+    coefficients = np.linalg.solve(design.T @ design + penalty, design.T @ log_target)
+    residuals = log_target - design @ coefficients
+
+    return coefficients, float(np.std(residuals))
+
+
+class CostModel:
+    """
+    Power law model of walltime and memory as functions of the `FEATURES`.
+    The memory is the maximum memory per MPI rank.
+    """
+
+    def __init__(self, walltime_coefficients=None, memory_coefficients=None, walltime_std=0., memory_std=0.):
+        self.walltime_coefficients = walltime_coefficients
+        self.memory_coefficients = memory_coefficients
+        self.walltime_std = walltime_std
+        self.memory_std = memory_std
+
+    @classmethod
+    def fit(cls, data, regularization=1.e-3):
+        """
+        Fit the model.
+        :param data: dictionary with arrays for the keys in `FEATURES`, "walltime" and "memory",
+                     like the one returned by `collect_cost_data`.
+        :param regularization: ridge parameter, it keeps the fit stable when the data do not span
+                               all the features (for instance all calculations with the same ranks).
+        """
+        num_points = len(data["walltime"])
+        if num_points < len(FEATURES) + 2:
+            raise ValueError(f"Not enough calculations ({num_points}) to fit the cost model")
+
+        design = _design_matrix(data)
+        walltime_coeff, walltime_std = _fit_log_linear(design, data["walltime"], regularization)
+
+        has_memory = np.isfinite(data["memory"]) & (data["memory"] > 0)
+        if np.sum(has_memory) >= len(FEATURES) + 2:
+            memory_coeff, memory_std = _fit_log_linear(design[has_memory], data["memory"][has_memory], regularization)
+        else:
+            memory_coeff, memory_std = None, 0.
+
+        return cls(walltime_coeff, memory_coeff, walltime_std, memory_std)
+
+    def predict_walltime(self, features, confidence=2.):
+        """
+        Predict the walltime in seconds. The prediction is increased by `confidence` standard
+        deviations of the residuals of the fit.
+        """
+        log_time = _design_matrix({key: [features[key]] for key in FEATURES}) @ self.walltime_coefficients
+        return float(np.exp(log_time[0] + confidence * self.walltime_std))
+
+    def predict_memory(self, features, confidence=2.):
+        """
+        Predict the maximum memory per MPI rank in MB. Returns None if the memory was not fitted.
+        """
+        if self.memory_coefficients is None:
+            return None
+        log_memory = _design_matrix({key: [features[key]] for key in FEATURES}) @ self.memory_coefficients
+        return float(np.exp(log_memory[0] + confidence * self.memory_std))
+
+    def suggest_options(self, features, settings):
+        """
+        Choose the number of machines and the `max_wallclock_seconds` for a calculation.
+        The smallest number of machines (up to `max_num_machines`) is selected, such that the predicted
+        walltime is below `target_walltime` and the memory fits in the machines.
+        :param features: dictionary with the keys in `FEATURES` (the `ranks` are ignored).
+        :param settings: dictionary with keys `num_mpiprocs_per_machine` (required), `max_num_machines`
+                         (default 1), `target_walltime` (seconds, default 86400), `memory_per_machine`
+                         (MB, optional), `safety_factor` (default 1.5, multiplies the predicted walltime)
+                         and `min_walltime` (seconds, default 600).
+        :return: a dictionary with the keys `resources` and `max_wallclock_seconds`.
+        """
+        procs = settings["num_mpiprocs_per_machine"]
+        max_machines = settings.get("max_num_machines", 1)
+        target = settings.get("target_walltime", 86400)
+        memory_per_machine = settings.get("memory_per_machine")
+
+        machines = 1
+        for machines in range(1, max_machines + 1):
+            trial = dict(features, ranks=machines * procs)
+            walltime = self.predict_walltime(trial)
+            memory = self.predict_memory(trial)
+            memory_ok = memory is None or memory_per_machine is None or memory * procs <= memory_per_machine
+            if walltime <= target and memory_ok:
+                break
+
+        walltime = self.predict_walltime(dict(features, ranks=machines * procs)) * settings.get("safety_factor", 1.5)
+        walltime = max(walltime, settings.get("min_walltime", 600))
+
+        return {
+            "resources": {
+                "num_machines": machines,
+                "num_mpiprocs_per_machine": procs
+            },
+            "max_wallclock_seconds": int(np.ceil(walltime))
+        }
+
+    def to_dict(self):
+        """
+        Return the model as a python dictionary, for instance to store it in a Dict.
+        """
+        return {
+            "walltime_coefficients": list(self.walltime_coefficients),
+            "memory_coefficients": None if self.memory_coefficients is None else list(self.memory_coefficients),
+            "walltime_std": self.walltime_std,
+            "memory_std": self.memory_std,
+        }
+
+    @classmethod
+    def from_dict(cls, dictionary):
+        memory_coefficients = dictionary.get("memory_coefficients")
+        return cls(
+            np.array(dictionary["walltime_coefficients"]),
+            None if memory_coefficients is None else np.array(memory_coefficients),
+            dictionary.get("walltime_std", 0.),
+            dictionary.get("memory_std", 0.),
+        )
+
+
+def clear_cost_models_cache():
+    """
+    Empty the process-level cache of the fitted cost models.
+    """
+    _COST_MODELS_CACHE.clear()
+
+
+def get_cost_model(computer=None, refit=False, ttl=None):
+    """
+    Return the cost model fitted on the calculations in the database (optionally only the ones
+    run on `computer`). The fitted model is cached at process level, together with the watermark of the
+    data (see `get_cost_data_watermark`). The model is fitted again, with `refit` True, or when the watermark
+    changed and the cached model is older than `ttl` seconds (default `_COST_MODELS_TTL`).
+    Checking the watermark requires only a cheap query, but collecting the data and fitting
+    require a full scan of the calculations: to avoid them, fit the model once and pass it
+    (`CostModel.to_dict()`) where a model is accepted.
+    :raise ValueError: if not enough calculations are present in the database.
+    """
+    ttl = _COST_MODELS_TTL if ttl is None else ttl
+    watermark = get_cost_data_watermark(computer)
+    if not refit and computer in _COST_MODELS_CACHE:
+        cached_watermark, fit_time, model = _COST_MODELS_CACHE[computer]
+        if cached_watermark == watermark or time.time() - fit_time < ttl:
+            return model
+
+    model = CostModel.fit(collect_cost_data(computer))
+    _COST_MODELS_CACHE[computer] = (watermark, time.time(), model)
+
+    return model
+
+
+def get_options_from_cost_model(structure, parameters, basis, kpoints, settings, options=None, model=None):
+    """
+    Return the computational options with `resources` and `max_wallclock_seconds`
+    chosen by the cost model. The other entries of `options` are kept.
+    :param settings: see `CostModel.suggest_options`, the optional `computer` key
+                     restricts the fit to the calculations run on that computer.
+    :param model: optional CostModel already fitted. If None, the model is obtained with `get_cost_model`.
+    :raise ValueError: if not enough calculations are present in the database to fit the model.
+    """
+    if model is None:
+        model = get_cost_model(settings.get("computer"))
+    features = estimate_features(structure, parameters, basis, kpoints)
+    new_options = dict(options) if options else {}
+    new_options.update(model.suggest_options(features, settings))
+
+    return new_options
@@ -0,0 +1,185 @@
+"""
+Canonical form of a dictionary of fdf keywords. Two dictionaries describing the same Siesta input
+(for instance using `MeshCutoff: "200 Ry"` or `mesh-cutoff: "2721.138 eV"`, `WriteForces: T`
+or `write-forces: True`, `SolutionMethod: diagon` or `solution-method: Diagon`) have the same canonical form.
+The keys, the booleans, the units and the values of the keywords that select among a fixed set of options
+(`_ENUMERATION_KEYS`) are case insensitive, the other string values (file names, labels, ...) are kept as
+they are. It is used to compute the hash of
+the `parameters` and `basis` inputs of a SiestaCalculation, so that equivalent inputs are
+recognized by the AiiDA caching mechanism.
+"""
+import re
+from aiida_siesta.utils.tkdict import FDFDict
+
+#Conversion factors to a reference unit for each physical dimension.
+#The reference units are eV, Ang, fs, eV/Ang, GPa, amu and deg.
+_UNITS_CONVERSION = {
+    "energy": {
+        "ev": 1.0,
+        "mev": 1.0e-3,
+        "ry": 13.605693122994,
+        "mry": 13.605693122994e-3,
+        "ha": 27.211386245988,
+        "hartree": 27.211386245988,
+        "j": 6.241509074e18,
+        "kcal/mol": 0.0433641043,
+        "kj/mol": 0.0103642688,
+        "k": 8.617333262e-5,
+        "kelvin": 8.617333262e-5,
+    },
+    "length": {
+        "ang": 1.0,
+        "bohr": 0.529177210903,
+        "nm": 10.0,
+        "m": 1.0e10,
+        "cm": 1.0e8,
+    },
+    "time": {
+        "fs": 1.0,
+        "ps": 1.0e3,
+        "ns": 1.0e6,
+        "s": 1.0e15,
+    },
+    "force": {
+        "ev/ang": 1.0,
+        "ry/bohr": 13.605693122994 / 0.529177210903,
+        "ry/ang": 13.605693122994,
+        "ev/bohr": 1.0 / 0.529177210903,
+        "n": 6.241509074e8,
+    },
+    "pressure": {
+        "gpa": 1.0,
+        "mpa": 1.0e-3,
+        "kbar": 0.1,
+        "bar": 1.0e-4,
+        "pa": 1.0e-9,
+        "atm": 1.01325e-4,
+        "ev/ang**3": 160.21766208,
+        "ry/bohr**3": 13.605693122994 / 0.529177210903**3 * 160.21766208,
+    },
+    "mass": {
+        "amu": 1.0,
+        "kg": 6.0221407621e26,
+        "g": 6.0221407621e23,
+    },
+    "angle": {
+        "deg": 1.0,
+        "rad": 57.29577951308232,
+    },
+}
+
+#Keywords (translated with `FDFDict.translate_key`) whose value is one of a fixed set of options,
+#compared case insensitively by Siesta
+_ENUMERATION_KEYS = (
+    "solutionmethod",
+    "mdtypeofrun",
+    "xcfunctional",
+    "xcauthors",
+    "spin",
+    "paobasissize",
+    "paobasistype",
+    "diagalgorithm",
+    "scfmixermethod",
+    "scfmix",
+    "occupationfunction",
+    "atomiccoordinatesformat",
+)
+
+_TRUE_VALUES = ("t", ".true.", "true", "yes")
+_FALSE_VALUES = ("f", ".false.", "false", "no")
+
+#Number of significant digits kept when comparing floats
+_SIGNIFICANT_DIGITS = 10
+
+
+def _normalize_number(number):
+    """
+    Return the float rounded to a fixed number of significant digits.
+    """
+    return float(f"{float(number):.{_SIGNIFICANT_DIGITS}g}")
+
+
+def _to_float(string):
+    """
+    Convert a string to float, also accepting the fortran double precision exponent (1.0d-4).
+    Raises ValueError if the string is not a number.
+    """
+    if re.match(r"^[+-]?[\d.]+[dD][+-]?\d+$", string):
+        string = string.replace("d", "e").replace("D", "e")
+    return float(string)
+
+
+def _split_unit(value):
+    """
+    Split a string like "200 Ry" in the (float, unit) tuple. Returns None if the
+    string is not a number followed by a known unit.
+    """
+    parts = value.split()
+    if len(parts) != 2:
+        return None
+    try:
+        number = _to_float(parts[0])
+    except ValueError:
+        return None
+    unit = parts[1].lower()
+    for dimension, units in _UNITS_CONVERSION.items():
+        if unit in units:
+            return _normalize_number(number * units[unit]), dimension
+
+    return None
+
+
+def normalize_fdf_value(value):
+    """
+    Normalize the value of an fdf keyword.
+     * Booleans (T, .true., yes, ...) become python booleans.
+     * Numbers (also when passed as strings) become floats with a fixed number of significant digits.
+     * Physical quantities with units are converted to the reference unit of their dimension.
+     * Blocks (multiline strings) are split in lines and their spacing normalized.
+     * Other strings only get normalized spacing. They are not lowercased, since they might be
+       case sensitive (file names, labels, ...).
+    """
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return _normalize_number(value)
+    if isinstance(value, (list, tuple)):
+        return [normalize_fdf_value(val) for val in value]
+    if not isinstance(value, str):
+        return value
+
+    if "\n" in value:
+        lines = [" ".join(line.split()) for line in value.split("\n")]
+        return "\n".join([line for line in lines if line])
+
+    stripped = " ".join(value.split())
+    if stripped.lower() in _TRUE_VALUES:
+        return True
+    if stripped.lower() in _FALSE_VALUES:
+        return False
+    try:
+        return _normalize_number(_to_float(stripped))
+    except ValueError:
+        pass
+    with_unit = _split_unit(stripped)
+    if with_unit is not None:
+        return list(with_unit)
+
+    return stripped
+
+
+def get_canonical_fdf_dict(fdf_dict):
+    """
+    Return the canonical form of a dictionary of fdf keywords: keys are translated
+    with `FDFDict.translate_key` and values are normalized with `normalize_fdf_value`.
+    The string values of the keywords in `_ENUMERATION_KEYS` are also lowercased.
+    """
+    canonical = {}
+    for key, value in fdf_dict.items():
+        key = FDFDict.translate_key(key)
+        value = normalize_fdf_value(value)
+        if key in _ENUMERATION_KEYS and isinstance(value, str):
+            value = value.lower()
+        canonical[key] = value
+
+    return canonical
@@ -0,0 +1,274 @@
+"""
+Estimate of the memory and scratch footprint of a Siesta calculation before its submission.
+The sizes of the problem (`no_u`, `nnz`, mesh points and kpoints, see `aiida_siesta.utils.cost_model`)
+are estimated from the inputs and converted into the memory of the main arrays:
+the sparse matrices (H, S, DM, EDM and the mixing history), the real space grid arrays and,
+for the solvers working on dense matrices, the dense H, S and eigenvectors.
+The estimate is calibrated with the ratio between the measured `max_memory` and the
+estimate obtained from the `no_u`, `nnz` and `mesh` parsed for the calculations in the database.
+All the sizes are in MB.
+"""
+import numpy as np
+
+#Number of spin components of the matrices for each spin option
+_SPIN_COMPONENTS = {
+    "non-polarized": 1,
+    "polarized": 2,
+    "non-collinear": 4,
+    "spin-orbit": 8,
+}
+
+#Number of dense matrices (H, S, eigenvectors...) of size no_u x no_u allocated by each solver
+_DENSE_MATRICES = {
+    "diagon": 3,
+    "elsi": 3,
+    "transiesta": 3,
+    "omm": 2,
+    "pexsi": 0,
+    "ordern": 0,
+}
+
+#Memory of the executable, libraries and MPI buffers of each rank
+_BASE_MEMORY = 100.
+
+#Files written in the working directory when the corresponding flag is True
+_GRID_FILE_FLAGS = (
+    "save-rho",
+    "save-delta-rho",
+    "save-rho-xc",
+    "save-total-potential",
+    "save-electrostatic-potential",
+    "save-neutral-atom-potential",
+    "save-total-charge",
+    "save-bader-charge",
+)
+
+_MB = 1024.**2
+
+#Process-level cache of the fitted calibration factors, see `get_memory_calibration`
+_CALIBRATION_CACHE = {}
+
+
+def get_num_spin_components(parameters):
+    """
+    The number of spin components of the matrices from a dictionary of parameters.
+    Both the `spin` keyword and the old `spin-polarized`, `non-collinear-spin` and `spin-orbit` flags are read.
+    """
+    from aiida_siesta.utils.tkdict import FDFDict
+
+    fdf = FDFDict(parameters)
+    spin = str(fdf.get("spin", "")).lower().replace("colinear", "collinear")
+    if spin in ("so", "spinorbit", "spin-orbit"):
+        spin = "spin-orbit"
+    if spin in ("nc", "noncollinear"):
+        spin = "non-collinear"
+    if spin in _SPIN_COMPONENTS:
+        return _SPIN_COMPONENTS[spin]
+
+    for key, spin in [("spinorbit", "spin-orbit"), ("noncollinearspin", "non-collinear"),
+                      ("spinpolarized", "polarized")]:
+        if fdf.get(key) in (True, "T", ".true.", "true"):
+            return _SPIN_COMPONENTS[spin]
+
+    return 1
+
+
+def get_num_orbitals(ions):
+    """
+    The number of orbitals of each species, from a dictionary {kind name: IonData}.
+    The count is exact: each orbital of the PAO basis (see `PaoManager`) contributes 2l+1 functions.
+    """
+    from aiida_siesta.utils.pao_manager import PaoManager
+
+    num_orbitals = {}
+    for name, ion in ions.items():
+        pao_manager = PaoManager()
+        pao_manager.set_from_ion(ion)
+        orbitals = pao_manager.to_array()
+        num_orbitals[name] = int(np.sum(2 * orbitals["l"] + 1))
+
+    return num_orbitals
+
+
+def get_footprint(features, num_spin=1, solver="diagon", mixing_history=2, calibration=1.):
+    """
+    The memory per MPI rank from the sizes of the problem.
+    :param features: dictionary with `no_u`, `nnz`, `mesh_points`, `kpoints` and `ranks`,
+                     like the one of `aiida_siesta.utils.cost_model.estimate_features`.
+    :param num_spin: number of spin components (1, 2, 4 or 8).
+    :param solver: the `solution-method` (lowercase).
+    :param mixing_history: number of previous steps stored by the scf mixer.
+    :param calibration: factor multiplying the memory of the arrays.
+    :return: a dictionary with the memory (MB) of the `sparse`, `grid` and `dense` arrays and the `total`.
+    """
+    ranks = max(features["ranks"], 1)
+    gamma_only = features["kpoints"] <= 1
+
+    # H, DM and EDM for each spin component, S, the mixing history, plus the integer index of the elements
+    num_sparse = 3 * num_spin + 1 + 2 * mixing_history * num_spin
+    sparse = features["nnz"] * (8. * num_sparse + 4.) / ranks / _MB
+
+    # Single precision grid arrays: charge, potentials and neutral atom terms, some for each spin component
+    grid = features["mesh_points"] * 4. * (6 + 2 * min(num_spin, 4)) / ranks / _MB
+
+    # The dense matrices are distributed (ScaLAPACK) and complex for non-gamma and non-collinear calculations
+    word = 8. if gamma_only and num_spin <= 2 else 16.
+    size = features["no_u"] * (2 if num_spin > 2 else 1)
+    dense = _DENSE_MATRICES.get(solver, 3) * size**2 * word / ranks / _MB
+
+    total = _BASE_MEMORY + calibration * (sparse + grid + dense)
+
+    return {"sparse": sparse, "grid": grid, "dense": dense, "total": total}
+
+
+def get_scratch_size(features, parameters, num_spin=1):
+    """
+    The size (MB) of the files written in the working directory: the DM file and, if requested,
+    the HSX file and the grid files.
+    """
+    from aiida_siesta.utils.tkdict import FDFDict
+
+    fdf = FDFDict(parameters)
+
+    def flag(key):
+        return fdf.get(key) in (True, "T", ".true.", "true")
+
+    scratch = features["nnz"] * (8. * num_spin + 4.)
+    if flag("save-hs"):
+        scratch += features["nnz"] * (8. * (num_spin + 1) + 4. + 24.)
+    num_grid_files = sum(1 for key in _GRID_FILE_FLAGS if flag(key))
+    scratch += num_grid_files * features["mesh_points"] * 4. * min(num_spin, 4)
+
+    return scratch / _MB
+
+
+def estimate_footprint(  # pylint: disable=too-many-arguments
+    structure, parameters, basis=None, kpoints=None, ranks=1, ions=None, calibration=None
+):
+    """
+    Estimate the memory and the scratch footprint of a calculation that was not run yet.
+    :param structure: the StructureData.
+    :param parameters: python dictionary of the parameters.
+    :param basis: python dictionary of the basis (only `pao-basis-size` is used).
+    :param kpoints: KpointsData with a mesh, or None (gamma only).
+    :param ranks: number of MPI ranks.
+    :param ions: optional dictionary {kind name: IonData}. If present, the number of orbitals
+                 is obtained from the ions instead of the `pao-basis-size`.
+    :param calibration: factor multiplying the memory of the arrays. If None, the factor cached by
+                        `get_memory_calibration` is used, if any, otherwise 1.
+    :return: a dictionary with the memory per rank (`memory_per_rank`, with the details of the `sparse`,
+             `grid` and `dense` arrays), the memory of all the ranks (`memory`) and the `scratch`, in MB.
+    """
+    from aiida_siesta.utils.cost_model import estimate_features
+    from aiida_siesta.utils.tkdict import FDFDict
+
+    features = estimate_features(structure, parameters, basis, kpoints, ranks)
+    if ions:
+        num_orbitals = get_num_orbitals(ions)
+        no_u = sum(num_orbitals[site.kind_name] for site in structure.sites)
+        # The nnz scales with the square of the orbitals per atom
+        features["nnz"] *= (no_u / features["no_u"])**2
+        features["no_u"] = no_u
+
+    if calibration is None:
+        calibration = _CALIBRATION_CACHE.get(None, 1.)
+
+    fdf = FDFDict(parameters)
+    num_spin = get_num_spin_components(parameters)
+    solver = str(fdf.get("solutionmethod", "diagon")).lower()
+    mixing_history = int(fdf.get("scfmixerhistory", 2))
+
+    memory = get_footprint(features, num_spin, solver, mixing_history, calibration)
+
+    footprint = {
+        "memory_per_rank": memory["total"],
+        "memory": memory["total"] * ranks,
+        "scratch": get_scratch_size(features, parameters, num_spin),
+        "sparse": memory["sparse"],
+        "grid": memory["grid"],
+        "dense": memory["dense"],
+        "no_u": features["no_u"],
+        "nnz": features["nnz"],
+        "mesh_points": features["mesh_points"],
+    }
+
+    return {key: float(value) for key, value in footprint.items()}
+
+
+def fit_memory_calibration(data):
+    """
+    Fit the calibration factor: the median ratio between the measured memory of the arrays (the
+    `max_memory` minus the base memory) and the estimate from the parsed `no_u`, `nnz` and `mesh`.
+    The spin and the solver of the calculations are not collected, the defaults are assumed.
+    :param data: dictionary like the one returned by `aiida_siesta.utils.cost_model.collect_cost_data`.
+    :raise ValueError: if less than three calculations have the memory parsed.
+    """
+    has_memory = np.isfinite(data["memory"]) & (data["memory"] > _BASE_MEMORY)
+    if np.sum(has_memory) < 3:
+        raise ValueError(f"Not enough calculations ({np.sum(has_memory)}) to calibrate the memory estimate")
+
+    ratios = []
+    for index in np.nonzero(has_memory)[0]:
+        features = {key: data[key][index] for key in ("no_u", "nnz", "mesh_points", "kpoints", "ranks")}
+        arrays = get_footprint(features, calibration=1.)["total"] - _BASE_MEMORY
+        ratios.append((data["memory"][index] - _BASE_MEMORY) / arrays)
+
+    return float(np.median(ratios))
+
+
+def get_memory_calibration(computer=None, refit=False):
+    """
+    Return the calibration factor fitted on the calculations in the database (optionally only the ones
+    run on `computer`). The factor is cached at process level, unless `refit` is True.
+    :raise ValueError: if not enough calculations are present in the database.
+    """
+    from aiida_siesta.utils.cost_model import collect_cost_data
+
+    if refit or computer not in _CALIBRATION_CACHE:
+        _CALIBRATION_CACHE[computer] = fit_memory_calibration(collect_cost_data(computer))
+
+    return _CALIBRATION_CACHE[computer]
+
+
+def get_options_from_footprint(  # pylint: disable=too-many-arguments
+    structure, parameters, basis, kpoints, options, memory_per_machine, max_num_machines=None, computer=None
+):
+    """
+    Return the computational options with the `num_machines` of the `resources` increased until the
+    estimated memory fits in `memory_per_machine` (MB). The other entries of `options` are kept.
+    A warning is issued if the `resources` are changed or if the memory does not fit in `max_num_machines`.
+    :param computer: the label of a computer, the calibration is fitted on the calculations run there.
+    """
+    import warnings
+
+    resources = dict(options.get("resources", {}))
+    procs = resources.get("num_mpiprocs_per_machine", 1)
+    machines = resources.get("num_machines", 1)
+    max_num_machines = max_num_machines or max(machines, 64)
+
+    try:
+        calibration = get_memory_calibration(computer)
+    except ValueError:
+        calibration = 1.
+
+    new_machines = machines
+    while True:
+        footprint = estimate_footprint(structure, parameters, basis, kpoints, new_machines * procs, None, calibration)
+        fits = footprint["memory_per_rank"] * procs <= memory_per_machine
+        if fits or new_machines >= max_num_machines:
+            break
+        new_machines += 1
+
+    if not fits:
+        warnings.warn(
+            f"The estimated memory ({footprint['memory_per_rank'] * procs:.0f} MB per machine) does not fit "
+            f"in {memory_per_machine} MB even with {new_machines} machines"
+        )
+    if new_machines != machines:
+        warnings.warn(f"The estimated memory does not fit in {machines} machines, `num_machines` set to {new_machines}")
+        resources["num_machines"] = new_machines
+
+    new_options = dict(options)
+    new_options["resources"] = resources
+
+    return new_options
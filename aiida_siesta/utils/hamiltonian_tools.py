@@ -0,0 +1,255 @@
+"""
+Tools to obtain bands and density of states locally, from the Hamiltonian and overlap
+matrices saved by Siesta in the .TSHS or .HSX files. No new Siesta calculation is needed,
+the matrices are read with sisl and H(k) is diagonalized for batches of kpoints at the time.
+The size of the batches is limited by the available memory. Optionally the batches are distributed
+over a pool of processes.
+"""
+import os
+import numpy as np
+from aiida import orm
+from aiida.engine import calcfunction
+
+#Files searched in the folder, in order of preference
+HAMILTONIAN_EXTENSIONS = (".TSHS", ".HSX")
+
+_WORKER_DATA = {}
+
+
+def read_hamiltonian(folder):
+    """
+    Read with sisl the Hamiltonian saved by Siesta.
+    :param folder: a FolderData (for instance the `retrieved` of a SiestaCalculation, where
+                   the .TSHS/.HSX file was added to the retrieve list) or a RemoteData
+                   (for instance the `remote_folder`). In the second case the file is copied
+                   locally through the transport.
+    :return: the sisl.Hamiltonian.
+    """
+    import tempfile
+    import sisl
+
+    if isinstance(folder, orm.RemoteData):
+        list_of_files = folder.listdir()
+    else:
+        list_of_files = folder.list_object_names()
+
+    filename = None
+    for extension in HAMILTONIAN_EXTENSIONS:
+        for name in sorted(list_of_files):
+            if name.endswith(extension):
+                filename = name
+                break
+        if filename is not None:
+            break
+    if filename is None:
+        raise ValueError(f"No file with extension {HAMILTONIAN_EXTENSIONS} found in {folder}")
+
+    with tempfile.TemporaryDirectory() as dirpath:
+        local_path = os.path.join(dirpath, filename)
+        if isinstance(folder, orm.RemoteData):
+            folder.getfile(filename, local_path)
+        else:
+            with folder.open(filename, mode='rb') as source, open(local_path, 'wb') as destination:
+                destination.write(source.read())
+        hamiltonian = sisl.get_sile(local_path).read_hamiltonian()
+
+    return hamiltonian
+
+
+def get_batch_size(num_orb, nspin=1, max_memory=256., batch_size=64):
+    """
+    Number of kpoints diagonalized together, such that the dense complex matrices of a batch
+    (H(k) for each spin, S(k), its Cholesky factor and the work arrays, about 4 + nspin matrices
+    of no x no per kpoint) fit in `max_memory` MB.
+    :param num_orb: the number of orbitals.
+    :param nspin: the number of (collinear) spin components.
+    :param max_memory: the memory (MB) available for a batch.
+    :param batch_size: the maximum number of kpoints of a batch.
+    """
+    per_kpoint = (4 + nspin) * num_orb**2 * 16. / 1024.**2
+    return int(max(1, min(batch_size, max_memory // per_kpoint)))
+
+
+def eigenvalues_batch(hamiltonian, kpoints):
+    """
+    Eigenvalues of H(k) for a batch of kpoints at once.
+    H(k) and S(k) are built by sisl from the sparse matrices, one kpoint at the time, and the
+    (generalized) eigenvalue problems of the batch are solved with batched linear algebra.
+    The memory is therefore proportional to the number of kpoints of the batch, see `get_batch_size`.
+    :param hamiltonian: a collinear (unpolarized or spin-polarized) sisl.Hamiltonian.
+    :param kpoints: the kpoints in reduced coordinates, shape (nk, 3).
+    :return: the eigenvalues, shape (nspin, nk, no).
+    """
+    nspin = 2 if hamiltonian.spin.is_polarized else 1
+
+    def _hermitian(matrices):
+        #Remove numerical noise breaking the hermiticity
+        return 0.5 * (matrices + np.conj(np.swapaxes(matrices, -1, -2)))
+
+    if not hamiltonian.orthogonal:
+        s_k = _hermitian(np.array([hamiltonian.Sk(kpoint, format='array') for kpoint in kpoints]))
+        #Reduce H c = e S c to a standard problem with the Cholesky factor of S = L L^H
+        chol = np.linalg.cholesky(s_k)
+        del s_k
+
+    eigenvalues = []
+    for ispin in range(nspin):
+        spin_kwargs = {'spin': ispin} if nspin == 2 else {}
+        h_k = _hermitian(np.array([hamiltonian.Hk(kpoint, format='array', **spin_kwargs) for kpoint in kpoints]))
+        if not hamiltonian.orthogonal:
+            half = np.linalg.solve(chol, h_k)
+            h_k = np.linalg.solve(chol, np.conj(np.swapaxes(half, -1, -2)))
+            del half
+        eigenvalues.append(np.linalg.eigvalsh(h_k))
+        del h_k
+
+    return np.array(eigenvalues)
+
+
+def _init_worker(hamiltonian):
+    """
+    Initializer of the processes in the pool, the Hamiltonian is passed only once to each process.
+    """
+    _WORKER_DATA["hamiltonian"] = hamiltonian
+
+
+def _worker_eigenvalues(kpoints):
+    return eigenvalues_batch(_WORKER_DATA["hamiltonian"], kpoints)
+
+
+def get_eigenvalues(hamiltonian, kpoints, batch_size=64, num_workers=1, max_memory=256.):
+    """
+    Eigenvalues of a sisl.Hamiltonian on a list of kpoints.
+    The kpoints are processed in batches of at most `batch_size` kpoints, reduced so that a batch fits
+    in `max_memory` MB (see `get_batch_size`). With `num_workers` > 1 the batches are distributed over
+    a pool of processes, each one using up to `max_memory`. The default (1) creates no pool, which is the
+    safe choice inside a daemon worker. The non-collinear and spin-orbit cases are delegated to the
+    sisl `eigh`, one kpoint at the time.
+    :param hamiltonian: the sisl.Hamiltonian.
+    :param kpoints: the kpoints in reduced coordinates, shape (nk, 3).
+    :param batch_size: maximum number of kpoints diagonalized together.
+    :param num_workers: number of processes in the pool. With 1, no pool is created.
+    :param max_memory: the memory (MB) available for each batch.
+    :return: the eigenvalues, shape (nk, nbands) or (2, nk, nbands) for spin polarized calculations.
+    """
+    kpoints = np.atleast_2d(np.asarray(kpoints, dtype=float))
+
+    if not hamiltonian.spin.is_diagonal:
+        return np.array([hamiltonian.eigh(k=kpoint) for kpoint in kpoints])
+
+    nspin = 2 if hamiltonian.spin.is_polarized else 1
+    batch_size = get_batch_size(hamiltonian.no, nspin, max_memory, batch_size)
+    batches = [kpoints[i:i + batch_size] for i in range(0, len(kpoints), batch_size)]
+
+    if num_workers > 1 and len(batches) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(
+            max_workers=num_workers, initializer=_init_worker, initargs=(hamiltonian,)
+        ) as executor:
+            results = list(executor.map(_worker_eigenvalues, batches))
+    else:
+        results = [eigenvalues_batch(hamiltonian, batch) for batch in batches]
+
+    eigenvalues = np.concatenate(results, axis=1)
+    if eigenvalues.shape[0] == 1:
+        return eigenvalues[0]
+    return eigenvalues
+
+
+def get_gaussian_dos(energies, eigenvalues, smearing, num_kpoints, max_elements=10**7):
+    """
+    The gaussian smeared density of states, all the kpoints with the same weight.
+    The eigenvalues are summed in chunks, so that the temporary matrix of the gaussians
+    (energies x eigenvalues of the chunk) has at most `max_elements` elements.
+    :param energies: the energies (eV) where the DOS is computed.
+    :param eigenvalues: the eigenvalues (eV) of all the kpoints, any shape.
+    :param smearing: the width (eV) of the gaussians.
+    :param num_kpoints: the number of kpoints, for the normalization.
+    :return: the DOS (states/eV per cell) at `energies`.
+    """
+    eigenvalues = np.ravel(eigenvalues)
+    chunk = max(1, max_elements // len(energies))
+    dos = np.zeros(len(energies))
+    for start in range(0, len(eigenvalues), chunk):
+        eig_chunk = eigenvalues[start:start + chunk]
+        dos += np.exp(-((energies[:, np.newaxis] - eig_chunk[np.newaxis, :]) / smearing)**2).sum(axis=1)
+
+    return dos / (smearing * np.sqrt(np.pi) * num_kpoints)
+
+
+def _get_options(options):
+    if options is None:
+        return {}
+    return options.get_dict()
+
+
+def _get_eigenvalues_options(opts):
+    return {key: opts[key] for key in ("batch_size", "num_workers", "max_memory") if key in opts}
+
+
+@calcfunction
+def get_bands_from_hamiltonian(hamiltonian_folder, bandskpoints, options=None):
+    """
+    Calcfunction calculating the bands on an arbitrary path of kpoints from the Hamiltonian
+    saved by Siesta (.TSHS or .HSX file), without running Siesta again.
+    :param hamiltonian_folder: FolderData or RemoteData containing the .TSHS/.HSX file.
+    :param bandskpoints: KpointsData with the explicit list of kpoints. The cell must be set,
+                         the labels, if present, are kept.
+    :param options: optional Dict with keys `batch_size`, `num_workers` and `max_memory`, see `get_eigenvalues`.
+    :return: a BandsData. The energies are in eV, as read by sisl (for .TSHS files the
+             Fermi energy is at zero).
+    """
+    opts = _get_options(options)
+    hamiltonian = read_hamiltonian(hamiltonian_folder)
+    eigenvalues = get_eigenvalues(hamiltonian, bandskpoints.get_kpoints(), **_get_eigenvalues_options(opts))
+
+    bands = orm.BandsData()
+    bands.set_kpointsdata(bandskpoints)
+    bands.set_bands(eigenvalues, units="eV")
+
+    return bands
+
+
+@calcfunction
+def get_dos_from_hamiltonian(hamiltonian_folder, kpoints, options=None):
+    """
+    Calcfunction calculating the density of states from the Hamiltonian saved by Siesta
+    (.TSHS or .HSX file), without running Siesta again.
+    :param hamiltonian_folder: FolderData or RemoteData containing the .TSHS/.HSX file.
+    :param kpoints: KpointsData with a mesh (all the kpoints of the mesh are computed,
+                    no symmetry reduction) or an explicit list of kpoints (same weight for all).
+    :param options: optional Dict. Keys `emin`, `emax` (eV, default the eigenvalues range),
+                    `npoints` (default 1000), `smearing` (eV, the width of the gaussians, default 0.1),
+                    `batch_size`, `num_workers` and `max_memory` (see `get_eigenvalues`).
+    :return: a XyData with the energies (eV) in x and the DOS (states/eV per cell) in y.
+             For spin polarized calculations two arrays `dos_up` and `dos_down` are present.
+    """
+    opts = _get_options(options)
+
+    try:
+        mesh, offset = kpoints.get_kpoints_mesh()
+        grid = np.meshgrid(*[(np.arange(num) + off) / num for num, off in zip(mesh, offset)], indexing='ij')
+        kpts = np.stack([axis.ravel() for axis in grid], axis=1)
+    except AttributeError:
+        kpts = kpoints.get_kpoints()
+
+    hamiltonian = read_hamiltonian(hamiltonian_folder)
+    eigenvalues = get_eigenvalues(hamiltonian, kpts, **_get_eigenvalues_options(opts))
+    if eigenvalues.ndim == 2:
+        eigenvalues = eigenvalues[np.newaxis]
+
+    emin = opts.get("emin", eigenvalues.min() - 1.)
+    emax = opts.get("emax", eigenvalues.max() + 1.)
+    smearing = opts.get("smearing", 0.1)
+    energies = np.linspace(emin, emax, opts.get("npoints", 1000))
+
+    dos = [get_gaussian_dos(energies, eig_spin, smearing, len(kpts)) for eig_spin in eigenvalues]
+
+    xydata = orm.XyData()
+    xydata.set_x(energies, "energy", "eV")
+    if len(dos) == 1:
+        xydata.set_y(dos[0], "dos", "states/eV")
+    else:
+        xydata.set_y([dos[0], dos[1]], ["dos_up", "dos_down"], ["states/eV", "states/eV"])
+
+    return xydata
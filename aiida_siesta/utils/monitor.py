@@ -0,0 +1,224 @@
+"""
+Live monitoring of running Siesta calculations.
+The tail of the output file and of the MESSAGES file in the remote working directory is read
+through the transport, incrementally: only the bytes written since the previous poll are transferred.
+The dDmax history of the scf cycle is updated with the new lines and, when a divergence or
+stagnation rule fires, the job is killed. Before killing, the file `MONITOR_FILE`, reporting the
+reason, is written in the remote folder. It is retrieved with the other files and the parser
+returns the `SCF_DIVERGED` exit code, handled by the SiestaBaseWorkChain.
+
+The monitoring is activated with the key `MONITOR` of the `settings` input of the calculation,
+a dictionary overriding `DEFAULT_MONITOR_SETTINGS` (an empty dictionary uses the defaults).
+The polling is performed by `run_monitor` (command `aiida-siesta monitor`), that can run next to the daemon.
+The state of the monitor of each calculation (offsets and scf history) is stored in its extras.
+"""
+import json
+import os
+import time
+
+from aiida_siesta.utils.scf_mixing import analyse_scf_history, update_scf_history
+
+#File written in the remote folder when the monitor kills a calculation
+MONITOR_FILE = 'aiida_monitor.json'
+
+#Key of the extras of the calculations storing the state of the monitor
+MONITOR_EXTRA_KEY = 'siesta_monitor'
+
+#`min_iterations`: no decision is taken before this number of scf iterations.
+#`divergence_factor`: the scf is "diverging" if the last dDmax is larger than the minimum dDmax of the
+#cycle multiplied by this factor.
+#`stagnation_iterations`: the "oscillating" and "stalled" rules (see `analyse_scf_history`, applied to
+#the last `window` iterations) are checked only after this number of iterations.
+#`rules`: the rules that kill the calculation.
+DEFAULT_MONITOR_SETTINGS = {
+    "min_iterations": 10,
+    "divergence_factor": 100.,
+    "stagnation_iterations": 30,
+    "window": 20,
+    "rules": ["diverging", "oscillating", "stalled"],
+}
+
+
+def check_scf_history(history, settings=None):
+    """
+    Apply the divergence and stagnation rules to the dDmax history of the current scf cycle.
+    :param history: list of dDmax.
+    :param settings: dictionary overriding `DEFAULT_MONITOR_SETTINGS`.
+    :return: the name of the rule that fired ("diverging", "oscillating" or "stalled"), None otherwise.
+    """
+    settings = dict(DEFAULT_MONITOR_SETTINGS, **(settings or {}))
+    rules = settings["rules"]
+
+    if len(history) < settings["min_iterations"]:
+        return None
+
+    if "diverging" in rules and history[-1] > settings["divergence_factor"] * min(history):
+        return "diverging"
+
+    if len(history) >= settings["stagnation_iterations"]:
+        diagnosis = analyse_scf_history(history, window=settings["window"])
+        if diagnosis in ("oscillating", "stalled") and diagnosis in rules:
+            return diagnosis
+
+    return None
+
+
+class ScfMonitor:
+    """
+    Incremental reader of the output and MESSAGES files of a running calculation.
+    For each file, the offset of the bytes already read and the last incomplete line are kept,
+    so that each poll transfers only the new part of the files.
+    """
+
+    def __init__(self, settings=None, state=None):
+        """
+        :param settings: dictionary overriding `DEFAULT_MONITOR_SETTINGS`.
+        :param state: the state returned by `to_dict` after a previous poll.
+        """
+        self.settings = dict(DEFAULT_MONITOR_SETTINGS, **(settings or {}))
+        state = state or {}
+        self.offsets = dict(state.get("offsets", {}))
+        self.partial_lines = dict(state.get("partial_lines", {}))
+        self.history = list(state.get("history", []))
+        self.last_iteration = state.get("last_iteration", 0)
+        self.terminated = state.get("terminated", False)
+
+    def to_dict(self):
+        """
+        Return the state of the monitor as a dictionary of python types.
+        """
+        return {
+            "offsets": self.offsets,
+            "partial_lines": self.partial_lines,
+            "history": self.history,
+            "last_iteration": self.last_iteration,
+            "terminated": self.terminated,
+        }
+
+    def read_new_lines(self, transport, path):
+        """
+        Read the part of a remote file written since the previous call.
+        :param transport: an open transport.
+        :param path: the absolute path of the remote file.
+        :return: the list of the new complete lines.
+        """
+        from aiida.common.escaping import escape_for_bash
+
+        offset = self.offsets.get(path, 0)
+        retval, stdout, _ = transport.exec_command_wait(f'tail -c +{offset + 1} {escape_for_bash(path)}')
+        if retval != 0 or not stdout:
+            return []
+
+        self.offsets[path] = offset + len(stdout.encode('utf8'))
+        lines = (self.partial_lines.get(path, '') + stdout).split('\n')
+        self.partial_lines[path] = lines.pop()
+
+        return lines
+
+    def poll(self, transport, workdir, output_filename, messages_filename='MESSAGES'):
+        """
+        Read the new lines of the output and MESSAGES files and apply the rules.
+        If Siesta reported a fatal error in MESSAGES, the calculation is terminating by itself
+        and no rule is applied anymore.
+        :return: the name of the rule that fired, None otherwise.
+        """
+        if self.terminated:
+            return None
+
+        messages = self.read_new_lines(transport, os.path.join(workdir, messages_filename))
+        if any(line.startswith('FATAL') for line in messages):
+            self.terminated = True
+            return None
+
+        lines = self.read_new_lines(transport, os.path.join(workdir, output_filename))
+        self.history, self.last_iteration = update_scf_history(lines, self.history, self.last_iteration)
+
+        return check_scf_history(self.history, self.settings)
+
+
+def get_monitor_settings(node):
+    """
+    Return the monitor settings of a calculation, None if the monitoring is not active.
+    """
+    if 'settings' not in node.inputs:
+        return None
+    settings = {str(key).upper(): value for key, value in node.inputs.settings.get_dict().items()}
+
+    return settings.get('MONITOR')
+
+
+def kill_calculation(node, transport, reason, history):
+    """
+    Write `MONITOR_FILE` in the remote folder of the calculation and kill the job through the scheduler.
+    The calculation is then retrieved and parsed as usual.
+    """
+    import tempfile
+
+    with tempfile.NamedTemporaryFile('w', suffix='.json') as handle:
+        json.dump({"reason": reason, "scf_history": history}, handle)
+        handle.flush()
+        transport.putfile(handle.name, os.path.join(node.get_remote_workdir(), MONITOR_FILE))
+
+    scheduler = node.computer.get_scheduler()
+    scheduler.set_transport(transport)
+
+    return scheduler.kill(node.get_job_id())
+
+
+def monitor_calculation(node, transport):
+    """
+    Poll a running calculation, killing it if a rule fires. The state of the monitor is kept in the extras.
+    :param node: the CalcJobNode of a running SiestaCalculation with the monitoring active.
+    :param transport: an open transport to the computer of the calculation.
+    :return: the name of the rule that fired, None otherwise.
+    """
+    monitor = ScfMonitor(get_monitor_settings(node), node.get_extra(MONITOR_EXTRA_KEY, None))
+    reason = monitor.poll(transport, node.get_remote_workdir(), node.get_option('output_filename'))
+    if reason is not None:
+        monitor.terminated = kill_calculation(node, transport, reason, monitor.history)
+    node.set_extra(MONITOR_EXTRA_KEY, monitor.to_dict())
+
+    return reason
+
+
+def get_monitored_calculations():
+    """
+    Return the SiestaCalculations running on the scheduler with the monitoring active.
+    """
+    from aiida import orm
+
+    calc_filters = {
+        'process_type': 'aiida.calculations:siesta.siesta',
+        'attributes.process_state': {
+            'in': ['waiting', 'running']
+        },
+        'attributes.scheduler_state': 'running',
+    }
+    query = orm.QueryBuilder()
+    query.append(orm.CalcJobNode, filters=calc_filters, project='*', tag='calc')
+    query.append(orm.Dict, with_outgoing='calc', edge_filters={'label': 'settings'})
+
+    return [node for (node,) in query.iterall() if get_monitor_settings(node) is not None]
+
+
+def run_monitor(interval=60, once=False, callback=None):
+    """
+    Poll all the monitored calculations every `interval` seconds. A transport is opened for each computer.
+    :param once: if True, poll only once.
+    :param callback: optional function called with the node and the rule that fired, when a job is killed.
+    """
+    while True:
+        calculations = {}
+        for node in get_monitored_calculations():
+            calculations.setdefault(node.computer.pk, []).append(node)
+
+        for nodes in calculations.values():
+            with nodes[0].get_transport() as transport:
+                for node in nodes:
+                    reason = monitor_calculation(node, transport)
+                    if reason is not None and callback is not None:
+                        callback(node, reason)
+
+        if once:
+            break
+        time.sleep(interval)
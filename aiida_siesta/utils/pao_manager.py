@@ -2,10 +2,36 @@
 The PAO Manager
 """
 
+import numpy as np
 from aiida.plugins import DataFactory
 
 ANG_TO_BOHR = 1.8897161646321
 
+#Columns of the structured array representation of the orbitals of a PAO basis.
+#`pol` signals polarized orbitals, for them `n` and `l` are the ones of the orbital that is polarized,
+#like in the keys of `PaoManager._pol_dict`. The radius is in Å.
+PAO_DTYPE = np.dtype([("n", int), ("l", int), ("Z", int), ("pol", bool), ("radius", float)])
+
+
+def _get_species_card(name, shells):
+    """
+    Create the part of the PAO block relative to one species.
+
+    :param name: the name of the species.
+    :param shells: list of tuples (n, l, radii, num_pol), one for each n, l shell, where radii are the radii
+        (in Å) of the Zs of the shell and num_pol the number of polarized orbitals of the shell (0 if not polarized).
+    :return: a string with the card, no final new line. Conversion into Bohr is performed.
+    """
+    card = str(name) + " " + str(len(shells)) + "\n"
+    for n, l, radii, num_pol in shells:  #pylint: disable=invalid-name
+        if num_pol:
+            card += "  n={}  {}  {}  P {} \n".format(n, l, len(radii), num_pol)
+        else:
+            card += "  n={}  {}  {} \n".format(n, l, len(radii))
+        card += '\t'.join([f' {radius * ANG_TO_BOHR}' for radius in radii]) + "\n"
+
+    return card[:-1]
+
 
 class PaoManager:
     """
@@ -79,8 +105,8 @@ class PaoManager:
     def set_from_ion(self, ion_data_instance):
         """
         Sets the basic attributes of the class from an IonData.
-        It goes through orbitals and extracts the two fundamental dictionaries of the class:
-        `_gen_dict` and `_pol_dict`.
+        It goes through orbitals (obtained without parsing the radial functions) and extracts
+        the two fundamental dictionaries of the class: `_gen_dict` and `_pol_dict`.
 
         :param ion_data_instance: the IonData instance from which to exctract the info.
         """
@@ -92,8 +118,7 @@ class PaoManager:
 
         gen_dict = {}
         pol_dict = {}
-        for orbital in ion_data_instance.get_orbitals():
-            i = orbital.attributes
+        for i in ion_data_instance.get_orbitals_info():
             if not i["P"]:
                 if i["n"] not in gen_dict:
                     gen_dict[i["n"]] = {i["l"]: {i["Z"]: i["R"]}}
@@ -336,31 +361,47 @@ class PaoManager:
 
         self._validate_attrs(raise_if_empty=True)
 
-        number_of_l = 0
-        dictl = self._gen_dict
-        pol = self._pol_dict
-        for i in dictl:
-            number_of_l = number_of_l + len(dictl[i])
+        shells = []
+        for i in self._gen_dict:
+            for j in self._gen_dict[i]:
+                num_pol = len(self._pol_dict[i][j]) if i in self._pol_dict and j in self._pol_dict[i] else 0
+                shells.append((i, j, list(self._gen_dict[i][j].values()), num_pol))
 
-        atomic_paobasis_card = str(self.name) + " " + str(number_of_l) + "\n"
-        for i in dictl:
-            for j in dictl[i]:
-                if i in pol:
-                    if j in pol[i]:
-                        atomic_paobasis_card += "  n={}  {}  {}  P {} \n".format(i, j, len(dictl[i][j]), len(pol[i][j]))
-                        listi = [dictl[i][j][l] * ANG_TO_BOHR for l in dictl[i][j]]
-                        atomic_paobasis_card += '\t'.join([f' {val}' for val in listi]) + "\n"
-                    else:
-                        atomic_paobasis_card += "  n={}  {}  {} \n".format(i, j, len(dictl[i][j]))
-                        #print("  n={}  {}  {}".format(i, j, len(dictl[i][j])))
-                        listi = [dictl[i][j][l] * ANG_TO_BOHR for l in dictl[i][j]]
-                        atomic_paobasis_card += '\t'.join([f' {val}' for val in listi]) + "\n"
-                else:
-                    atomic_paobasis_card += "  n={}  {}  {} \n".format(i, j, len(dictl[i][j]))
-                    listi = [dictl[i][j][l] * ANG_TO_BOHR for l in dictl[i][j]]
-                    atomic_paobasis_card += '\t'.join([f' {val}' for val in listi]) + "\n"
+        return _get_species_card(self.name, shells)
+
+    def to_array(self):
+        """
+        Return the orbitals as a structured array with dtype `PAO_DTYPE` (columns n, l, Z, pol, radius).
+        Unpolarized orbitals come first, in the order of the PAO block, then the polarized ones.
+        """
+        self._validate_attrs()
+
+        rows = []
+        for pol, dictl in [(False, self._gen_dict), (True, self._pol_dict)]:
+            for i in dictl:
+                for j in dictl[i]:
+                    for z, radius in dictl[i][j].items():
+                        rows.append((i, j, int(z), pol, radius))
+
+        return np.array(rows, dtype=PAO_DTYPE)
+
+    def set_from_array(self, name, orbitals):
+        """
+        Sets the attributes of the class from a structured array, the inverse of `to_array`.
 
-        return atomic_paobasis_card[:-1]
+        :param name: the name of the site associated to this PAO.
+        :param orbitals: structured array with (at least) the columns of `PAO_DTYPE`.
+        """
+        gen_dict = {}
+        pol_dict = {}
+        for orbital in orbitals:
+            dictl = pol_dict if orbital["pol"] else gen_dict
+            shell = dictl.setdefault(int(orbital["n"]), {}).setdefault(int(orbital["l"]), {})
+            shell[int(orbital["Z"])] = float(orbital["radius"])
+
+        self.name = name
+        self._gen_dict = gen_dict
+        self._pol_dict = pol_dict
 
     def pao_size(self):
         """
@@ -403,3 +444,177 @@ class PaoManager:
         )
 
         return string
+
+
+class PaoBasisSet:
+    """
+    Array-backed PAO basis of many species at once, designed for batch operations (for instance
+    the radius scalings of basis optimizations). The orbitals of all the species are kept in a single
+    structured array with the columns of `PAO_DTYPE` plus a `species` column, the index of the
+    species in `self.names`. Radii are in Å, like in the `PaoManager`.
+    The methods `change_all_radius` and `reset_radius` act on all (or a selection of) the species
+    with single array operations and `get_pao_block` returns the combined block for all the species.
+    """
+
+    DTYPE = np.dtype([("species", int)] + [(field, PAO_DTYPE.fields[field][0]) for field in PAO_DTYPE.names])
+
+    def __init__(self, names, orbitals):
+        """
+        :param names: list with the names of the species.
+        :param orbitals: structured array with dtype `PaoBasisSet.DTYPE`.
+        """
+        self.names = list(names)
+        self.orbitals = np.asarray(orbitals, dtype=self.DTYPE)
+
+    @classmethod
+    def from_pao_managers(cls, pao_managers):
+        """
+        Create the basis set from a list of `PaoManager` instances, one for each species.
+        """
+        arrays = []
+        for index, pao_manager in enumerate(pao_managers):
+            array = pao_manager.to_array()
+            orbitals = np.zeros(len(array), dtype=cls.DTYPE)
+            orbitals["species"] = index
+            for field in PAO_DTYPE.names:
+                orbitals[field] = array[field]
+            arrays.append(orbitals)
+
+        orbitals = np.concatenate(arrays) if arrays else np.zeros(0, dtype=cls.DTYPE)
+
+        return cls([pao_manager.name for pao_manager in pao_managers], orbitals)
+
+    @classmethod
+    def from_ions(cls, ions):
+        """
+        Create the basis set from a list of IonData, one for each species.
+        """
+        pao_managers = []
+        for ion in ions:
+            pao_manager = PaoManager()
+            pao_manager.set_from_ion(ion)
+            pao_managers.append(pao_manager)
+
+        return cls.from_pao_managers(pao_managers)
+
+    def get_pao_manager(self, name):
+        """
+        Return a `PaoManager` for the species `name`.
+        """
+        pao_manager = PaoManager()
+        pao_manager.set_from_array(name, self.orbitals[self.orbitals["species"] == self._get_index(name)])
+
+        return pao_manager
+
+    def _get_index(self, name):
+        try:
+            return self.names.index(name)
+        except ValueError:
+            raise ValueError(f"No species {name} in the basis set")
+
+    def _get_species_values(self, values, species):
+        """
+        Return an array with one value for each orbital row, taken from `values`, that can be a number
+        (same for all the species) or a dictionary {name: value}.
+        Rows of species not in `species` (if not None) or not in the dictionary get NaN.
+        """
+        per_species = np.full(len(self.names), np.nan)
+        if isinstance(values, dict):
+            for name, value in values.items():
+                per_species[self._get_index(name)] = value
+        else:
+            per_species[:] = values
+
+        if species is not None:
+            selected = np.zeros(len(self.names), dtype=bool)
+            selected[[self._get_index(name) for name in species]] = True
+            per_species[~selected] = np.nan
+
+        return per_species[self.orbitals["species"]]
+
+    def change_all_radius(self, percentage, species=None):
+        """
+        Increment or decrement the radius of all orbitals of a percentage.
+
+        :param percentage: positive (for inscreasing) or negative (for decrising) float representing
+            the percentage of change of the radius. Either a number, applied to all the species, or
+            a dictionary {name: percentage}.
+        :param species: optional list of names of the species to change, by default all.
+
+        All radii are changed, also the polarized one.
+        """
+        percentages = self._get_species_values(percentage, species)
+        mask = ~np.isnan(percentages)
+        self.orbitals["radius"][mask] *= 1 + percentages[mask] / 100
+
+    def reset_radius(self, radius_units, new_radius, n, l, Z=1, species=None):  #pylint: disable=invalid-name
+        """
+        Reset the radius of the orbital with n, l, Z quantum numbers in many species at once.
+
+        :param radius_units: either Bohr or Ang
+        :param new_radius: new radius that will be set, in Bohr or Ang. Either a number, applied to all
+            the species, or a dictionary {name: radius}.
+        :param n: int, principal quantum number of the orbital
+        :param l: int, angular quantum number of the orbital
+        :param Z: int, the Z orbital to be changed.
+        :param species: optional list of names of the species to change, by default all the ones in
+            `new_radius` (if a dictionary) or all.
+
+        Like in `PaoManager.reset_radius`, if a Z=1 orbital is changed, also the corresponding
+        polarized orbital is changed and the following Zs of the polarized orbital are set to zero.
+        """
+        PaoManager._validate_nlz(n, l, Z)  #pylint: disable=protected-access
+
+        if radius_units not in ["Bohr", "Ang"]:
+            raise ValueError("`radius_units` only accepts 'Bohr' or 'Ang'")
+
+        radii = self._get_species_values(new_radius, species)
+        if radius_units == "Bohr":
+            radii = radii / ANG_TO_BOHR
+
+        orbitals = self.orbitals
+        selected = ~np.isnan(radii)
+        shell = (orbitals["n"] == n) & (orbitals["l"] == l)
+        mask = selected & shell & (orbitals["Z"] == Z) & ~orbitals["pol"]
+
+        missing = set(orbitals["species"][selected]) - set(orbitals["species"][mask])
+        if missing:
+            names = [self.names[index] for index in sorted(missing)]
+            raise ValueError(f"No orbital defined with n={n}, l={l}, Z={Z} for species {names}")
+
+        orbitals["radius"][mask] = radii[mask]
+
+        if Z == 1:
+            pol_mask = selected & shell & orbitals["pol"]
+            first = pol_mask & (orbitals["Z"] == 1)
+            orbitals["radius"][first] = radii[first]
+            orbitals["radius"][pol_mask & (orbitals["Z"] > 1)] = 0.000
+
+    def get_pao_block(self):
+        """
+        Create the combined PAO block for all the species.
+
+        return: a string card containing the block, in the format of the value of the
+            "%block pao-basis" key of the basis dictionary (terminated by "%endblock pao-basis").
+
+        Conversion into Bohr is performed.
+        """
+        if not len(self.orbitals):  #pylint: disable=len-as-condition
+            raise RuntimeError("No orbitals set, nothing to return")
+
+        orbitals = self.orbitals
+        card = '\n'
+        for index, name in enumerate(self.names):
+            species_orbitals = orbitals[orbitals["species"] == index]
+            gen = species_orbitals[~species_orbitals["pol"]]
+            pol = species_orbitals[species_orbitals["pol"]]
+            shells = []
+            for n, l in dict.fromkeys(zip(gen["n"].tolist(), gen["l"].tolist())):  #pylint: disable=invalid-name
+                in_shell = (gen["n"] == n) & (gen["l"] == l)
+                radii = gen["radius"][in_shell][np.argsort(gen["Z"][in_shell], kind="stable")]
+                num_pol = int(np.count_nonzero((pol["n"] == n) & (pol["l"] == l)))
+                shells.append((n, l, radii.tolist(), num_pol))
+            if shells:
+                card += _get_species_card(name, shells) + '\n'
+
+        return card + '%endblock pao-basis'
@@ -52,6 +52,9 @@ class InputGenerator(ProtocolManager, metaclass=ABCMeta):
 
         self._workchain_class = workchain_class
 
+        #The codes already loaded, see `_load_code`
+        self._codes = {}
+
     def how_to_pass_computation_options(self):
         message = (
             "Computational resources are passed to get_filled_builder with the argument "
@@ -76,6 +79,60 @@ class InputGenerator(ProtocolManager, metaclass=ABCMeta):
         I think we should allow to change signature of this method.
         """
 
+    def get_inputs_dict_many(self, structures, calc_engines, protocol, num_workers=1, chunk_size=100, **kwargs):
+        """
+        Generator yielding the dictionaries of inputs for many structures, in the same order.
+        The structures are processed in chunks of `chunk_size`, for each chunk the method
+        `_prepare_many` is called first, where subclasses can run in a pool of processes the costly
+        operations that do not require the database. With `num_workers` > 1, a single pool of
+        `num_workers` processes is created for the whole stream and passed to `_prepare_many`.
+        The pool is not used for anything else: `get_inputs_dict` is then called in this process
+        for each structure, with `calc_engines`, `protocol` and `kwargs`.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        from itertools import islice
+
+        executor = ProcessPoolExecutor(max_workers=num_workers) if num_workers > 1 else None
+        try:
+            iterator = iter(structures)
+            while True:
+                chunk = list(islice(iterator, chunk_size))
+                if not chunk:
+                    break
+                self._prepare_many(chunk, executor, **kwargs)
+                for structure in chunk:
+                    yield self.get_inputs_dict(structure, calc_engines, protocol, **kwargs)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def get_filled_builders(self, structures, calc_engines, protocol, num_workers=1, chunk_size=100, **kwargs):
+        """
+        Generator yielding the filled builders for many structures, in the same order.
+        See `get_inputs_dict_many`.
+        """
+        inputs_many = self.get_inputs_dict_many(structures, calc_engines, protocol, num_workers, chunk_size, **kwargs)
+        for inp_dict in inputs_many:
+            yield self._fill_builder(inp_dict)
+
+    def _prepare_many(self, structures, executor, **kwargs):
+        """
+        Hook called by `get_inputs_dict_many` before the generation of the inputs of a chunk of structures.
+        `executor` is the pool of processes shared by all the chunks, None if `num_workers` is 1.
+        It does nothing here.
+        """
+
+    def _load_code(self, identifier):
+        """
+        Load a code, each code is loaded only once per instance.
+        """
+        from aiida.orm import load_code
+
+        if identifier not in self._codes:
+            self._codes[identifier] = load_code(identifier)
+
+        return self._codes[identifier]
+
     def _fill_builder(self, inp_dict):
         """
         Return a builder, prefilled. Needs `_workchain_class` to obtain the builder
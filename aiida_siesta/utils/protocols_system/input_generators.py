@@ -1,5 +1,76 @@
 from .generator_absclass import InputGenerator
 
+#Parameters of seekpath for the bands path
+SEEKPATH_PARAMETERS = {'reference_distance': 0.01, 'symprec': 0.0001}
+
+#Process-level cache of the seekpath results, the key is the hash of the structure
+_SEEKPATH_CACHE = {}
+_SEEKPATH_CACHE_MAXSIZE = 10000
+
+
+def _run_seekpath(structure_tuple):
+    """
+    Run seekpath on a structure in the spglib format. Only pure python objects are involved,
+    therefore it can be executed in a pool of processes.
+    """
+    import seekpath
+    return seekpath.get_explicit_k_path(structure=structure_tuple, **SEEKPATH_PARAMETERS)
+
+
+def _store_seekpath_result(key, rawdict):
+    if len(_SEEKPATH_CACHE) >= _SEEKPATH_CACHE_MAXSIZE:
+        _SEEKPATH_CACHE.clear()
+    _SEEKPATH_CACHE[key] = rawdict
+
+
+def precompute_seekpath(structures, executor=None):
+    """
+    Run seekpath for the structures that are not already in the cache. If an `executor` (a pool of
+    processes) is passed, the calculations are distributed over it. The results are stored in the cache.
+    """
+    from aiida.tools.data.structure import structure_to_spglib_tuple
+
+    to_compute = {}
+    for structure in structures:
+        key = structure.get_hash()
+        if key not in _SEEKPATH_CACHE and key not in to_compute:
+            to_compute[key] = structure_to_spglib_tuple(structure)[0]
+
+    if executor is not None and len(to_compute) > 1:
+        results = list(executor.map(_run_seekpath, to_compute.values()))
+    else:
+        results = [_run_seekpath(structure_tuple) for structure_tuple in to_compute.values()]
+
+    for key, rawdict in zip(to_compute.keys(), results):
+        _store_seekpath_result(key, rawdict)
+
+
+def get_seekpath_bands_path(structure):
+    """
+    Return the primitive structure and the explicit kpoints on the high-symmetry path obtained
+    with seekpath, like `aiida.tools.get_explicit_kpoints_path`. The results of seekpath are memoized
+    using the hash of the structure.
+    """
+    from aiida.orm import KpointsData
+    from aiida.tools.data.structure import structure_to_spglib_tuple, spglib_tuple_to_structure
+
+    structure_tuple, kind_info, kinds = structure_to_spglib_tuple(structure)
+    key = structure.get_hash()
+    if key not in _SEEKPATH_CACHE:
+        _store_seekpath_result(key, _run_seekpath(structure_tuple))
+    rawdict = _SEEKPATH_CACHE[key]
+
+    primitive_tuple = (rawdict['primitive_lattice'], rawdict['primitive_positions'], rawdict['primitive_types'])
+    primitive_structure = spglib_tuple_to_structure(primitive_tuple, kind_info, kinds)
+
+    explicit_kpoints = KpointsData()
+    explicit_kpoints.set_cell_from_structure(primitive_structure)
+    explicit_kpoints.set_kpoints(rawdict['explicit_kpoints_abs'], cartesian=True)
+    labels = rawdict['explicit_kpoints_labels']
+    explicit_kpoints.labels = [(index, label) for index, label in enumerate(labels) if label]
+
+    return primitive_structure, explicit_kpoints
+
 
 class SiestaCalculationInputGenerator(InputGenerator):
     """
@@ -16,7 +87,10 @@ class SiestaCalculationInputGenerator(InputGenerator):
         "siesta": {
             'code': 'Put here the code name, must be for plugin siesta.siesta',
             'options': 'Put here the computational options for running the relaxation, following the usual '
-            'aiida schema'
+            'aiida schema',
+            'cost_model': 'Optional, settings of the cost model choosing `resources` and `max_wallclock_seconds`',
+            'memory_per_machine': 'Optional, memory (MB) of a machine, `num_machines` is increased until it fits',
+            'benchmark_layout': 'Optional, if True the resources of the closest stored benchmark are used'
         }
     }
 
@@ -77,8 +151,7 @@ class SiestaCalculationInputGenerator(InputGenerator):
         relaxation_type and spin as well)
         """
 
-        from aiida.orm import (Dict, KpointsData)
-        from aiida.orm import load_code
+        from aiida.orm import Dict
         from aiida.tools import get_explicit_kpoints_path
 
         #Checks
@@ -107,12 +180,9 @@ class SiestaCalculationInputGenerator(InputGenerator):
                 }
                 result = get_explicit_kpoints_path(structure, method='legacy', **legacy_kpath_parameters)
                 ok_structure = structure
+                bandskpoints = result['explicit_kpoints']
             else:
-                seekpath_kpath_parameters = {'reference_distance': 0.01, 'symprec': 0.0001}
-                result = get_explicit_kpoints_path(structure, **seekpath_kpath_parameters)
-                ok_structure = result['primitive_structure']
-            bandskpoints = KpointsData()
-            bandskpoints = result['explicit_kpoints']
+                ok_structure, bandskpoints = get_seekpath_bands_path(structure)
         else:
             ok_structure = structure
             bandskpoints = None
@@ -144,12 +214,45 @@ class SiestaCalculationInputGenerator(InputGenerator):
         #Kpoints (might not be present, for molecules for instance)
         kpoints_mesh = self._get_kpoints(protocol, ok_structure)
 
+        #Solver options depending on the size of the system
+        parameters = self._add_size_options(protocol, parameters, ok_structure, basis, kpoints_mesh, spin)
+
         #Pseudo fam
         pseudos = self._get_pseudos(protocol, ok_structure)
 
         #Computational resources
         options = calc_engines['siesta']["options"]
-        code = load_code(calc_engines['siesta']["code"])
+        if "cost_model" in calc_engines['siesta']:
+            from aiida_siesta.utils.cost_model import get_options_from_cost_model
+            try:
+                options = get_options_from_cost_model(
+                    ok_structure, parameters, basis, kpoints_mesh, calc_engines['siesta']["cost_model"], options
+                )
+            except ValueError as exc:
+                import warnings
+                warnings.warn(f"Cost model not available ({exc}), the `options` in `calc_engines` are used")
+        code = self._load_code(calc_engines['siesta']["code"])
+        if calc_engines['siesta'].get("benchmark_layout", False):
+            from aiida_siesta.utils.benchmark import get_benchmark_layout
+            from aiida_siesta.utils.cost_model import estimate_features
+            from aiida_siesta.utils.tkdict import FDFDict
+            no_u = estimate_features(ok_structure, parameters, basis, kpoints_mesh)["no_u"]
+            layout = get_benchmark_layout(no_u, code.computer.label)
+            if layout is None:
+                import warnings
+                warnings.warn("No benchmark available for this system size, the `resources` are not changed")
+            else:
+                options = dict(options, resources=layout["resources"])
+                parameters = FDFDict(parameters)
+                for keyword, value in layout["parallel_options"].items():
+                    parameters[keyword] = value
+                parameters = parameters.get_untranslated_dict()
+        if "memory_per_machine" in calc_engines['siesta']:
+            from aiida_siesta.utils.footprint import get_options_from_footprint
+            options = get_options_from_footprint(
+                ok_structure, parameters, basis, kpoints_mesh, options, calc_engines['siesta']["memory_per_machine"],
+                calc_engines['siesta'].get("max_num_machines")
+            )
 
         inputs = {
             'structure': ok_structure,
@@ -170,6 +273,15 @@ class SiestaCalculationInputGenerator(InputGenerator):
 
         return inputs
 
+    def _prepare_many(self, structures, executor, bands_path_generator=None, **kwargs):  #pylint: disable=arguments-differ
+        """
+        Before the generation of the inputs of a chunk of structures, the seekpath calculations are
+        performed in the pool of processes and memoized. Only seekpath runs in the pool, the rest of
+        the inputs is generated in the calling process.
+        """
+        if bands_path_generator == "seekpath":
+            precompute_seekpath(structures, executor)
+
     # pylint: disable=arguments-differ
     def get_filled_builder(
         self, structure, calc_engines, protocol, bands_path_generator=None, relaxation_type=None, spin=None
@@ -245,6 +357,33 @@ class EosWorkChainInputGenerator(BaseWorkChainInputGenerator):
     }
 
 
+class MultiFidelityRelaxWorkChainInputGenerator(BaseWorkChainInputGenerator):
+    """
+    Inputs generator for the MultiFidelityRelaxWorkChain, makes use of the methods
+    of the BaseWorkChainInputsGenerator. The `get_inputs_dict` implements a check for the
+    presence of `relaxation_type` and adds the `stages`, taken from the `relax_stages` of the protocol.
+    """
+
+    def get_inputs_dict(
+        self, structure, calc_engines, protocol, bands_path_generator=None, relaxation_type=None, spin=None
+    ):
+
+        from aiida.orm import List
+
+        if not relaxation_type:
+            raise RuntimeError(
+                'Method `get_inputs_dict` of class `{0}` requires `relaxation_type`'.format(self.__class__.__name__)
+            )
+
+        inps = super().get_inputs_dict(structure, calc_engines, protocol, bands_path_generator, relaxation_type, spin)
+
+        if not self.is_valid_protocol(protocol):
+            protocol = self.get_default_protocol_name()
+        inps['stages'] = List(list=self.get_protocol(protocol).get('relax_stages', []))
+
+        return inps
+
+
 class StmWorkChainInputGenerator(BaseWorkChainInputGenerator):
     """
     Inputs generator for the STMWorkChain, makes use of the methods
@@ -299,7 +438,6 @@ class StmWorkChainInputGenerator(BaseWorkChainInputGenerator):
     ):
 
         from aiida.orm import (Dict, Float, Str)
-        from aiida.orm import load_code
 
         siesta_in = super().get_inputs_dict(
             structure, calc_engines, protocol, bands_path_generator, relaxation_type, spin
@@ -327,7 +465,7 @@ class StmWorkChainInputGenerator(BaseWorkChainInputGenerator):
         siesta_in["emin"] = Float(-6.5)
         siesta_in["emax"] = Float(+0.1)
         siesta_in["stm_options"] = Dict(dict=calc_engines['stm']["options"])
-        siesta_in["stm_code"] = load_code(calc_engines['stm']["code"])
+        siesta_in["stm_code"] = self._load_code(calc_engines['stm']["code"])
 
         return siesta_in
 
@@ -1,8 +1,80 @@
 import os
+import copy
 import yaml
 from aiida.orm import Group
 from aiida.common import exceptions
 
+#Process-level cache shared by all the instances of ProtocolManager (and therefore of the
+#input generators). The parsed registry is stored together with the key (paths and modification
+#times of the registry files) used to detect changes. The pseudo families are memoized
+#in `aiida_siesta.data.common`.
+_REGISTRY_CACHE = {}
+
+
+def _get_registry_key():
+    """
+    Return the key identifying the current state of the protocols registry: the paths and
+    modification times of the default registry and of the custom one in `AIIDA_SIESTA_PROTOCOLS`.
+    """
+    filepath = os.path.join(os.path.dirname(__file__), 'protocols_registry.yaml')
+    key = [(filepath, os.path.getmtime(filepath))]
+    if 'AIIDA_SIESTA_PROTOCOLS' in os.environ:
+        bisfilepath = os.environ['AIIDA_SIESTA_PROTOCOLS']
+        if os.path.isfile(bisfilepath):
+            key.append((bisfilepath, os.path.getmtime(bisfilepath)))
+        else:
+            key.append((bisfilepath, None))
+
+    return tuple(key)
+
+
+def clear_protocols_cache():
+    """
+    Empty the process-level caches of the protocols registry and of the pseudo families.
+    """
+    from aiida_siesta.data.common import clear_family_pseudos_memo
+
+    _REGISTRY_CACHE.clear()
+    clear_family_pseudos_memo()
+
+
+#Elements that are not metals, used to guess if a system is metallic (see `is_likely_metallic`)
+_NON_METALS = (
+    'H', 'He', 'B', 'C', 'N', 'O', 'F', 'Ne', 'Si', 'P', 'S', 'Cl', 'Ar', 'Ge', 'As', 'Se', 'Br', 'Kr', 'Sb', 'Te', 'I',
+    'Xe', 'At', 'Rn'
+)
+
+
+def is_likely_metallic(structure):
+    """
+    A rough hint of the metallicity of a system: True if all its elements are metals.
+    """
+    return all(kind.symbol not in _NON_METALS for kind in structure.kinds)
+
+
+def select_size_heuristic(size_heuristics, no_u, num_kpoints=1, metallic=False, spin=None):
+    """
+    Select the rule of the `size_heuristics` of a protocol that applies to a system.
+    A rule applies if the number of orbitals is at least `min_orbitals` and the optional conditions
+    `max_kpoints`, `metallic` and `spin` (list of allowed spin options, "none" for no spin) are satisfied.
+    Among the rules that apply, the one with the largest `min_orbitals` is selected.
+    :return: the name of the selected rule, None if no rule applies.
+    """
+    selected = None
+    for name, rule in size_heuristics.items():
+        if no_u < rule["min_orbitals"]:
+            continue
+        if "max_kpoints" in rule and num_kpoints > rule["max_kpoints"]:
+            continue
+        if "metallic" in rule and rule["metallic"] != metallic:
+            continue
+        if "spin" in rule and (spin if spin is not None else "none") not in rule["spin"]:
+            continue
+        if selected is None or rule["min_orbitals"] > size_heuristics[selected]["min_orbitals"]:
+            selected = name
+
+    return selected
+
 
 class ProtocolManager:
     """
@@ -44,6 +116,16 @@ class ProtocolManager:
         self._protocols_checks()
 
     def _initialize_protocols(self):
+        """
+        Load the protocols from the registry files. The parsed registry is cached at process level
+        and parsed again only if the files are modified or `AIIDA_SIESTA_PROTOCOLS` changes.
+        """
+        key = _get_registry_key()
+        if _REGISTRY_CACHE.get("key") == key:
+            self._protocols = copy.deepcopy(_REGISTRY_CACHE["protocols"])
+            self._default_protocol = 'standard_psml'
+            return
+
         filepath = os.path.join(os.path.dirname(__file__), 'protocols_registry.yaml')
 
         with open(filepath) as thefile:
@@ -63,11 +145,22 @@ class ProtocolManager:
 
         self._default_protocol = 'standard_psml'
 
+        _REGISTRY_CACHE.clear()
+        _REGISTRY_CACHE["key"] = key
+        _REGISTRY_CACHE["protocols"] = copy.deepcopy(self._protocols)
+
     def _protocols_checks(self):
         """
         Here implemented all the checks on the correct structure of each protocol. It also checks
         that, for each protocol, the correct pseudo family already loaded in the database.
+        Once passed, the checks are not repeated until the registry changes (or the profile is changed).
         """
+        from aiida.manage.configuration import get_profile
+
+        profile = get_profile()
+        checked_key = profile.name if profile is not None else None
+        if _REGISTRY_CACHE.get("checked") == checked_key and "checked" in _REGISTRY_CACHE:
+            return
 
         def raise_invalid(message):
             raise RuntimeError('invalid protocol registry `{}`: '.format(self.__class__.__name__) + message)
@@ -109,9 +202,24 @@ class ProtocolManager:
                         'but no family with this name is loaded in the database'.format(k, famname)
                     )
 
+            for name, rule in v.get('size_heuristics', {}).items():
+                if not isinstance(rule, dict) or not isinstance(rule.get('parameters'), dict):
+                    raise_invalid('size heuristic `{}` of protocol `{}` does not define `parameters`'.format(name, k))
+                if not isinstance(rule.get('min_orbitals'), (int, float)):
+                    raise_invalid('size heuristic `{}` of protocol `{}` does not define `min_orbitals`'.format(name, k))
+
+            for stage in v.get('relax_stages', []):
+                if not isinstance(stage, dict) or not set(stage).issubset(('parameters', 'basis', 'kpoints')):
+                    raise_invalid(
+                        'the `relax_stages` of protocol `{}` must be dictionaries with (some of) the keys '
+                        '`parameters`, `basis` and `kpoints`'.format(k)
+                    )
+
         if self._default_protocol not in self._protocols:
             raise_invalid('default protocol `{}` is not a defined protocol'.format(self._default_protocol))
 
+        _REGISTRY_CACHE["checked"] = checked_key
+
     #Some methods to return informations about the protocols
     #available and the _calc_types, describing the use of resources
     def is_valid_protocol(self, name):
@@ -244,6 +352,28 @@ class ProtocolManager:
 
         return parameters
 
+    def _add_size_options(self, key, orig_param, structure, basis, kpoints, spin=None):  # pylint: disable=too-many-arguments
+        """
+        Add to the parameters dictionary the solver options of the `size_heuristics` of the protocol.
+        The rule is selected (see `select_size_heuristic`) according to the number of orbitals estimated
+        from the structure and the basis, the number of kpoints, a hint of the metallicity of the system
+        and the spin option. Its parameters override the ones in `orig_param`.
+        """
+        from aiida_siesta.utils.cost_model import estimate_features
+
+        if "size_heuristics" not in self._protocols[key]:
+            return orig_param.copy()
+
+        features = estimate_features(structure, orig_param, basis, kpoints)
+        name = select_size_heuristic(
+            self._protocols[key]["size_heuristics"], features["no_u"], features["kpoints"],
+            is_likely_metallic(structure), spin
+        )
+        if name is None:
+            return orig_param.copy()
+
+        return {**orig_param, **self._protocols[key]["size_heuristics"][name]["parameters"]}
+
     def _get_basis(self, key, structure):  # noqa: MC0001  - is mccabe too complex funct -
         """
         Method to construct the `basis` input.
@@ -314,10 +444,20 @@ class ProtocolManager:
 
         return kpoints_mesh
 
+    @staticmethod
+    def _get_family_pseudos(family_name):
+        """
+        Return the dictionary element: pseudo of a family. It is memoized at process level by
+        `get_family_pseudos` and recomputed only if the content of the group changes.
+        """
+        from aiida_siesta.data.common import get_family_pseudos
+
+        return get_family_pseudos(Group.get(label=family_name))
+
     def _get_pseudos(self, key, structure):
 
-        from aiida_siesta.data.common import get_pseudos_from_structure
+        from aiida_siesta.data.common import get_pseudos_from_family_pseudos
 
         family = self._protocols[key]["pseudo_family"]
-        pseudos = get_pseudos_from_structure(structure, family)
+        pseudos = get_pseudos_from_family_pseudos(structure, self._get_family_pseudos(family), family)
         return pseudos
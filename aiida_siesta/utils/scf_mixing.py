@@ -0,0 +1,161 @@
+"""
+Tools used by the SiestaBaseWorkChain to react to a failed self-consistent cycle.
+The history of dDmax of the failed run is extracted from the output file and analysed.
+If the cycle was still converging, the calculation is simply restarted from the density matrix.
+If it was oscillating or stalled, the mixing parameters are changed following a ladder
+of increasingly conservative settings.
+"""
+import re
+import numpy as np
+from aiida_siesta.utils.fdf_canonical import normalize_fdf_value
+from aiida_siesta.utils.tkdict import FDFDict
+
+#Each rung is applied on top of the parameters of the failed calculation. The `scf-mixer-weight`
+#is never increased and the `electronic-temperature` is never decreased, the other keywords are set
+#to the value of the rung.
+DEFAULT_SCF_MIXING_LADDER = [
+    {
+        "scf-mixer-weight": 0.1,
+        "scf-mixer-history": 6
+    },
+    {
+        "scf-mixer-weight": 0.05,
+        "scf-mixer-history": 8,
+        "electronic-temperature": "500 K"
+    },
+    {
+        "scf-mixer-method": "Broyden",
+        "scf-mixer-weight": 0.02,
+        "scf-mixer-history": 10,
+        "electronic-temperature": "1000 K"
+    },
+]
+
+#Siesta default of the mixing weight
+DEFAULT_MIXER_WEIGHT = 0.25
+
+#Siesta default of the electronic temperature, in eV (300 K)
+DEFAULT_ELECTRONIC_TEMPERATURE = 300 * 8.617333262e-5
+
+#Legacy keywords (Siesta 4.0) replaced by the keywords of the ladder. They are removed when
+#the new keyword is set, otherwise Siesta would use the legacy value.
+LEGACY_SCF_KEYWORDS = {"scfmixerweight": "dmmixingweight", "scfmixerhistory": "dmnumberpulay"}
+
+#Key of the extras of the `output_parameters` recording the changes of the ladder
+SCF_MIXING_EXTRA_KEY = 'scf_mixing_changes'
+
+#A line of the scf cycle in the output file, the fifth field is dDmax
+SCF_LINE = re.compile(r"^\s*scf:\s+(\d+)\s+(\S+)\s+(\S+)\s+(\S+)\s+(\S+)")
+
+
+def update_scf_history(lines, history, last_iteration):
+    """
+    Update the dDmax history of the last self-consistent cycle with new lines of the output file.
+    Used to parse the output incrementally.
+    :param lines: iterable of lines of the output file.
+    :param history: list of dDmax of the current cycle, as returned by a previous call.
+    :param last_iteration: the last scf iteration found by a previous call (0 at the beginning).
+    :return: a tuple with the updated history and last iteration.
+    """
+    for line in lines:
+        match = SCF_LINE.match(line)
+        if match is None:
+            continue
+        iteration = int(match.group(1))
+        # A new scf cycle (for instance a new geometry step) starts
+        if iteration <= last_iteration:
+            history = []
+        last_iteration = iteration
+        try:
+            history.append(float(match.group(5)))
+        except ValueError:
+            continue
+
+    return history, last_iteration
+
+
+def get_scf_history(output_content):
+    """
+    Extract the values of dDmax of the last self-consistent cycle reported in the output file.
+    :param output_content: string, the content of the Siesta output file.
+    :return: list of floats, the dDmax of each scf iteration of the last cycle.
+    """
+    history, _ = update_scf_history(output_content.split('\n'), [], 0)
+
+    return history
+
+
+def analyse_scf_history(history, window=20, min_points=4):
+    """
+    Classify the behaviour of a self-consistent cycle from its dDmax history.
+    The analysis is performed on the last `window` iterations.
+    :param history: list of dDmax.
+    :return: a string among "undetermined" (too few iterations), "oscillating" (the
+             dDmax goes up and down more than half of the times), "converging" (dDmax
+             decreases on average) and "stalled".
+    """
+    values = np.array([val for val in history[-window:] if val > 0])
+    if len(values) < min_points:
+        return "undetermined"
+
+    log_values = np.log10(values)
+    differences = np.diff(log_values)
+    sign_changes = np.sum(np.diff(np.sign(differences)) != 0)
+    if sign_changes > 0.5 * (len(differences) - 1):
+        return "oscillating"
+
+    slope = np.polyfit(np.arange(len(log_values)), log_values, 1)[0]
+    if slope < -0.01:
+        return "converging"
+
+    return "stalled"
+
+
+def _get_electronic_temperature(value):
+    """
+    Return the electronic temperature in eV. A number without units is in Ry, the fdf default.
+    :return: a float, or None if the value is not an energy.
+    """
+    value = normalize_fdf_value(value)
+    if isinstance(value, float):
+        return normalize_fdf_value(f"{value} Ry")[0]
+    if isinstance(value, list) and value[1] == "energy":
+        return value[0]
+
+    return None
+
+
+def escalate_scf_parameters(param_dict, rung):
+    """
+    Apply a rung of the mixing ladder to the parameters.
+    The new `scf-mixer-weight` is the minimum between the one of the rung and the current one,
+    the new `electronic-temperature` is the maximum. The legacy keywords `DM.MixingWeight` and
+    `DM.NumberPulay` are removed when the corresponding keyword of the rung is set.
+    :param param_dict: python dictionary with the parameters of the failed calculation.
+    :param rung: python dictionary with the fdf keywords to change.
+    :return: a tuple with the new python dictionary of parameters and a dictionary
+             of the changes (keyword: (old value, new value)).
+    """
+    param = FDFDict(param_dict)
+    changes = {}
+    for key, value in rung.items():
+        translated_key = FDFDict.translate_key(key)
+        legacy_key = LEGACY_SCF_KEYWORDS.get(translated_key)
+        old_value = param.get(key)
+        if old_value is None and legacy_key is not None:
+            old_value = param.get(legacy_key)
+        if translated_key == "scfmixerweight":
+            current = old_value if old_value is not None else DEFAULT_MIXER_WEIGHT
+            value = min(float(current), float(value))
+        if translated_key == "electronictemperature" and old_value is not None:
+            current = _get_electronic_temperature(old_value)
+            if current is None or current >= _get_electronic_temperature(value):
+                value = old_value
+        if legacy_key is not None and legacy_key in param:
+            legacy_name = param.get_last_untranslated_key(legacy_key)
+            changes[legacy_name] = (param.pop(legacy_key), None)
+        if old_value != value or key not in param:
+            param[key] = value
+            changes[key] = (old_value, value)
+
+    return param.get_untranslated_dict(), changes
@@ -16,6 +16,15 @@ def drop_md_keys(param):
     return param
 
 
+def is_same_cell(structure, other_structure, tolerance=1.e-5):
+    """
+    Return True if the two structures have the same lattice vectors, in the same order.
+    """
+    import numpy as np
+
+    return np.allclose(structure.cell, other_structure.cell, atol=tolerance)
+
+
 @calcfunction
 def get_bandgap(e_fermi, band):
     """
@@ -90,6 +99,9 @@ class BandgapWorkChain(WorkChain):
     was specified, the bands are computed anyway on a kpoints path automatically
     assigned using seekpath and the input (output) structure
     of the single-point (relaxation/md) calculation.
+    With `restart_bands_from_dm`, the separate calculation of the bands restarts from
+    the density matrix of the relaxation, while for fixed-cell relaxations the bands
+    are directly computed in the relaxation run.
     """
 
     @classmethod
@@ -106,6 +118,20 @@ class BandgapWorkChain(WorkChain):
             }),
             help='dictionary of seekpath parameters that are pased to `get_explicit_kpoints_path`'
         )
+        spec.input(
+            'restart_bands_from_dm',
+            valid_type=orm.Bool,
+            default=lambda: orm.Bool(False),
+            help='If True, the final calculation of the bands (if needed) restarts from the density matrix '
+            'of the main run. Also, for relaxations with fixed cell, the bands are computed in the main run'
+        )
+        spec.input(
+            'bands_num_chunks',
+            valid_type=orm.Int,
+            required=False,
+            help='If set, the bands are calculated in a separate step, splitting the kpoints in this number '
+            'of chunks, each one calculated in parallel restarting from the density matrix of the main run'
+        )
         spec.output('band_gap_info', valid_type=orm.Dict, required=False)
         spec.outline(
             cls.preprocess,
@@ -124,9 +150,14 @@ class BandgapWorkChain(WorkChain):
         In case of relaxation, the relaxation is run, but an extra step at the end of
         the calculation will calculate the bands.
         """
+        from aiida_siesta.utils.fdf_canonical import normalize_fdf_value
+
         self.ctx.need_fin_step = False
         var_geom = False
+        var_cell = False
         self.ctx.need_to_generate_bandskp = False
+        #If True, the bandskpoints generated by seekpath are used with the input structure
+        self.ctx.keep_input_structure = False
 
         #The relaxation in Siesta is triggered by md-steps keyword.
         #I verified taht md-type of run alone do not trigger veriable geometry.
@@ -135,10 +166,52 @@ class BandgapWorkChain(WorkChain):
             if item in [FDFDict.translate_key("mdsteps"), FDFDict.translate_key("mdnumcgsteps")]:
                 if fdf_par[item] != 0:
                     var_geom = True
-                    break
+        #Variable cell can be requested by md-variable-cell, md-relax-cell-only or by the
+        #Parrinello-Rahman MD (pr and npr types of run)
+        for item in fdf_par:
+            if item in [FDFDict.translate_key("mdvariablecell"), FDFDict.translate_key("mdrelaxcellonly")]:
+                if normalize_fdf_value(fdf_par[item]) is True:
+                    var_cell = True
+            if item == FDFDict.translate_key("mdtypeofrun"):
+                if str(fdf_par[item]).lower() in ["pr", "npr"]:
+                    var_cell = True
+
+        if "bands_num_chunks" in self.inputs:
+            self.report(
+                "The bands will be calculated in a separate final step, splitting the kpoints in "
+                f"{self.inputs.bands_num_chunks.value} chunks, restarting from the density matrix of the main run."
+            )
+            self.ctx.need_fin_step = True
+            #For a single point without bandskpoints, the structure is changed by seekpath already in the
+            #main run, so that the density matrix can be reused.
+            if "bandskpoints" not in self.inputs and not var_geom:
+                self.ctx.need_to_generate_bandskp = True
+            return
 
         if "bandskpoints" not in self.inputs:
-            if var_geom:
+            if var_geom and not var_cell and self.inputs.restart_bands_from_dm.value:
+                #The structure to relax must not be changed, the bands can be calculated in the same run
+                #of the relaxation only if seekpath leaves the cell unchanged. The kpoints path depends only
+                #on the lattice, a different setting of the sites chosen by seekpath is not relevant.
+                seekpath_parameters = self.inputs.seekpath_dict.get_dict()
+                result = get_explicit_kpoints_path(self.inputs.structure, **seekpath_parameters)
+                if is_same_cell(self.inputs.structure, result['primitive_structure']):
+                    self.report(
+                        "The kpoints path for the calculation of bands will be automatically generated "
+                        "using seekpath. Because the relaxation is performed at fixed cell, the bands are "
+                        "calculated in the same run of the relaxation."
+                    )
+                    self.ctx.need_to_generate_bandskp = True
+                    self.ctx.keep_input_structure = True
+                else:
+                    self.report(
+                        "The kpoints path for the calculation of bands will be automatically generated "
+                        "using seekpath. Seekpath would change the cell of the input structure, therefore "
+                        "the bands are calculated in a separate final step, restarting from the density matrix "
+                        "of the relaxation. The cell of the final step is returned in `output_structure`."
+                    )
+                    self.ctx.need_fin_step = True
+            elif var_geom:
                 self.report(
                     "The kpoints path for the calculation of bands will be automatically generated "
                     "using seekpath. Because a relaxation was requested, the bands calculation will "
@@ -165,9 +238,15 @@ class BandgapWorkChain(WorkChain):
         if self.ctx.need_to_generate_bandskp:
             seekpath_parameters = self.inputs.seekpath_dict.get_dict()
             result = get_explicit_kpoints_path(inputs["structure"], **seekpath_parameters)
-            inputs["structure"] = result['primitive_structure']
-            inputs["bandskpoints"] = result['explicit_kpoints']
-            self.report("Added bandskpoints to the calculation using seekpath")
+            if not self.ctx.keep_input_structure:
+                inputs["structure"] = result['primitive_structure']
+            if not self.ctx.need_fin_step:
+                inputs["bandskpoints"] = result['explicit_kpoints']
+                self.report("Added bandskpoints to the calculation using seekpath")
+
+        #The bands will be calculated in the final step
+        if self.ctx.need_fin_step:
+            inputs.pop("bandskpoints", None)
 
         running = self.submit(SiestaBaseWorkChain, **inputs)
         self.report(f'Launched SiestaBaseWorkChain<{running.pk}> to perform the siesta calculation.')
@@ -181,27 +260,83 @@ class BandgapWorkChain(WorkChain):
         if not self.ctx.workchain_base.is_finished_ok:
             return self.exit_codes.ERROR_MAIN_WC
 
+        self.ctx.chunked_bands = False
+
         if self.ctx.need_fin_step:
+            if 'output_structure' in self.ctx.workchain_base.outputs:
+                out_structure = self.ctx.workchain_base.outputs.output_structure
+            else:
+                out_structure = self.ctx.workchain_base.inputs.structure
+
+            if "bands_num_chunks" in self.inputs and "bandskpoints" in self.inputs:
+                return self.run_chunked_bands(out_structure, self.inputs.bandskpoints)
+
             seekpath_parameters = self.inputs.seekpath_dict.get_dict()
-            out_structure = self.ctx.workchain_base.outputs.output_structure
             result = get_explicit_kpoints_path(out_structure, **seekpath_parameters)
+
+            if "bands_num_chunks" in self.inputs:
+                old_kinds = [site.kind_name for site in out_structure.sites]
+                new_kinds = [site.kind_name for site in result['primitive_structure'].sites]
+                if old_kinds == new_kinds:
+                    return self.run_chunked_bands(result['primitive_structure'], result['explicit_kpoints'])
+                self.report(
+                    "Seekpath changed the atoms in the cell, the density matrix of the main run can not be reused. "
+                    "The bands are calculated in a single final step."
+                )
+
             new_calc = self.ctx.workchain_base.get_builder_restart()
             new_calc.structure = result['primitive_structure']
             new_calc.bandskpoints = result['explicit_kpoints']
             new_param = drop_md_keys(new_calc.parameters.get_dict())
             new_calc.parameters = orm.Dict(dict=new_param)
+            if self.inputs.restart_bands_from_dm.value:
+                #The density matrix is indexed by orbitals, it can be reused only if seekpath
+                #did not change the number and the order of the atoms.
+                old_kinds = [site.kind_name for site in out_structure.sites]
+                new_kinds = [site.kind_name for site in result['primitive_structure'].sites]
+                if old_kinds == new_kinds:
+                    new_calc.parent_calc_folder = self.ctx.workchain_base.outputs.remote_folder
+                    self.report("The calculation of bands will restart from the density matrix of the main run")
+                else:
+                    self.report(
+                        "Seekpath changed the atoms in the cell, the density matrix of the main run can not be reused"
+                    )
             running = self.submit(new_calc)
             self.report(f'Launched SiestaBaseWorkChain<{running.pk}> to calculate bands.')
             return ToContext(final_run=running)
 
+    def run_chunked_bands(self, structure, bandskpoints):
+        """
+        Submit the ParallelBandsWorkChain, calculating the bands in chunks
+        of kpoints, all restarting from the density matrix of the main run.
+        """
+        from aiida_siesta.workflows.parallel_bands import ParallelBandsWorkChain
+
+        inputs = AttributeDict(self.exposed_inputs(SiestaBaseWorkChain))
+        inputs.structure = structure
+        inputs.bandskpoints = bandskpoints
+        inputs.parent_calc_folder = self.ctx.workchain_base.outputs.remote_folder
+        inputs.num_chunks = self.inputs.bands_num_chunks
+        self.ctx.chunked_bands = True
+        running = self.submit(ParallelBandsWorkChain, **inputs)
+        self.report(f'Launched ParallelBandsWorkChain<{running.pk}> to calculate bands.')
+        return ToContext(final_run=running)
+
     def run_results(self):
         if self.ctx.need_fin_step:
             if not self.ctx.final_run.is_finished_ok:
                 return self.exit_codes.ERROR_FINAL_WC
-            outps = self.ctx.final_run.outputs
+            #The ParallelBandsWorkChain only returns the bands, the rest comes from the main run
+            if self.ctx.chunked_bands:
+                outps = {name: self.ctx.workchain_base.outputs[name] for name in self.ctx.workchain_base.outputs}
+                outps['bands'] = self.ctx.final_run.outputs.bands
+            else:
+                outps = self.ctx.final_run.outputs
             self.out('output_structure', self.ctx.final_run.inputs.structure)
         else:
             outps = self.ctx.workchain_base.outputs
+            if 'output_structure' in outps:
+                self.out('output_structure', outps['output_structure'])
 
         if 'forces_and_stress' in outps:
             self.out('forces_and_stress', outps['forces_and_stress'])
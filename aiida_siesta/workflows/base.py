@@ -63,6 +63,51 @@ def validate_inputs(value, _):
             return string_out
 
 
+def validate_scf_mixing_ladder(value, _):
+    """
+    Validate the `scf_mixing_ladder` input port.
+    """
+    if value:
+        for rung in value.get_list():
+            if not isinstance(rung, dict):
+                return "each element of the `scf_mixing_ladder` must be a dictionary of fdf keywords."
+
+
+def update_md_steps(param_dict, last_step):
+    """
+    Update the parameters for the restart of a relaxation or molecular dynamics stopped at
+    step `last_step` (the step that was running when the calculation was stopped).
+    For relaxations, the number of steps is reduced by the steps already performed.
+    For molecular dynamics, the initial time step is moved to `last_step`, leaving unchanged the final one.
+    The length of an MD run is given either by `md-final-time-step` or by the number of steps.
+    :param param_dict: python dictionary with the parameters of the stopped calculation.
+    :param last_step: int, the last geometry step reached.
+    :return: the new python dictionary of parameters, None if no geometry steps are involved.
+    """
+    param = FDFDict(param_dict)
+    run_type = FDFDict.translate_key(str(param.get("mdtypeofrun", "cg")))
+    # The Siesta default is 0 steps, meaning a single point calculation
+    num_steps = int(param.get("mdsteps", param.get("mdnumcgsteps", 0)))
+
+    if run_type == "lua":
+        return None
+
+    if run_type in ["cg", "broyden", "fire"]:
+        if num_steps == 0:
+            return None
+        param.pop("mdnumcgsteps", None)
+        param["md-steps"] = max(num_steps - last_step, 1)
+    else:
+        if num_steps == 0 and "mdfinaltimestep" not in param:
+            return None
+        first_step = int(param.get("mdinitialtimestep", 1))
+        param["md-initial-time-step"] = max(last_step, first_step)
+        if "mdfinaltimestep" not in param:
+            param["md-final-time-step"] = first_step + num_steps - 1
+
+    return param.get_untranslated_dict()
+
+
 class SiestaBaseWorkChain(BaseRestartWorkChain):
     """
     Base Workchain to launch a total energy calculation via Siesta
@@ -76,6 +121,28 @@ class SiestaBaseWorkChain(BaseRestartWorkChain):
         spec.expose_inputs(SiestaCalculation, exclude=('metadata',))
         spec.input('pseudo_family', valid_type=orm.Str, required=False)
         spec.input('options', valid_type=orm.Dict, validator=validate_options)
+        spec.input(
+            'cost_model_settings',
+            valid_type=orm.Dict,
+            required=False,
+            help='If present, `resources` and `max_wallclock_seconds` of the calculations are chosen by the cost '
+            'model fitted on the calculations in the database. See `CostModel.suggest_options` for the settings.'
+        )
+        spec.input(
+            'cost_model',
+            valid_type=orm.Dict,
+            required=False,
+            help='The cost model already fitted (`CostModel.to_dict()`), used with the `cost_model_settings` '
+            'instead of fitting the model on the calculations in the database.'
+        )
+        spec.input(
+            'scf_mixing_ladder',
+            valid_type=orm.List,
+            required=False,
+            validator=validate_scf_mixing_ladder,
+            help='List of dictionaries of fdf keywords, applied in order when the scf is not converging. '
+            'If not set, the `DEFAULT_SCF_MIXING_LADDER` of `aiida_siesta.utils.scf_mixing` is used.'
+        )
 
         spec.outline(
             cls.preprocess,
@@ -95,6 +162,9 @@ class SiestaBaseWorkChain(BaseRestartWorkChain):
 
         spec.exit_code(403, 'ERROR_BASIS_POL', message='Basis polarization problem.')
         spec.exit_code(404, 'ERROR_BANDS_PARSING', message='Error in the parsing of bands')
+        spec.exit_code(
+            405, 'ERROR_SCF_DIVERGED', message='The scf diverged also with all the rungs of the scf mixing ladder.'
+        )
 
     def preprocess(self):
         """
@@ -121,6 +191,9 @@ class SiestaBaseWorkChain(BaseRestartWorkChain):
             }
         }
 
+        if 'cost_model_settings' in self.inputs:
+            self._set_options_from_cost_model()
+
         # Ions or pseudos
         if 'ions' in self.inputs:
             self.ctx.inputs['ions'] = self.inputs.ions
@@ -148,13 +221,55 @@ class SiestaBaseWorkChain(BaseRestartWorkChain):
         if 'parent_calc_folder' in self.inputs:
             self.ctx.inputs['parent_calc_folder'] = self.inputs.parent_calc_folder
 
+        # The rung of the scf mixing ladder reached and the record of the changes in the parameters
+        self.ctx.scf_mixing_level = 0
+        self.ctx.scf_mixing_changes = []
+
+    def _set_options_from_cost_model(self):
+        """
+        Replace `resources` and `max_wallclock_seconds` in the options with the ones chosen by the cost model.
+        The model is the `cost_model` input, if present. Otherwise it is fitted on the calculations in the
+        database (see `get_cost_model`, the fit is cached), and if it can not be fitted (not enough calculations
+        in the database) the options are unchanged.
+        """
+        from aiida_siesta.utils.cost_model import CostModel, get_options_from_cost_model
+
+        model = CostModel.from_dict(self.inputs.cost_model.get_dict()) if 'cost_model' in self.inputs else None
+        try:
+            options = get_options_from_cost_model(
+                self.inputs.structure,
+                self.inputs.parameters.get_dict(),
+                self.inputs.basis.get_dict() if 'basis' in self.inputs else None,
+                self.inputs.kpoints if 'kpoints' in self.inputs else None,
+                self.inputs.cost_model_settings.get_dict(),
+                self.ctx.inputs['metadata']['options'],
+                model,
+            )
+        except ValueError as exc:
+            self.report(f'Cost model not available ({exc}), using the input options')
+            return
+
+        self.report(
+            'Options chosen by the cost model: {0} machines, max_wallclock_seconds {1}'.format(
+                options['resources']['num_machines'], options['max_wallclock_seconds']
+            )
+        )
+        self.ctx.inputs['metadata']['options'] = options
+
     def postprocess(self):
         """
         In theory, the BaseRestartWorkChain should already return all the output
         requested in spec if they are returned (output nodes) by the last completed
         process. However this fails for `output_namespaces` (issue #4623 aiida-core).
         For this reason I do the procedure to attach the `output_namespaces` here.
+        The changes applied by the scf mixing ladder, if any, are stored in the extras
+        of the `output_parameters` (key `SCF_MIXING_EXTRA_KEY`).
         """
+        from aiida_siesta.utils.scf_mixing import SCF_MIXING_EXTRA_KEY
+
+        if self.ctx.scf_mixing_changes and "output_parameters" in self.outputs:
+            self.outputs["output_parameters"].set_extra(SCF_MIXING_EXTRA_KEY, self.ctx.scf_mixing_changes)
+
         if "ion_files" in self.spec().outputs:
             ions = {}
             node = self.ctx.children[self.ctx.iteration - 1]
@@ -186,7 +301,9 @@ class SiestaBaseWorkChain(BaseRestartWorkChain):
     def handle_error_scf_not_conv(self, node):
         """
         SCF convergence was not reached.  We need to restart from the
-        previous calculation without changing any of the input parameters.
+        previous calculation. The history of dDmax of the failed run is analysed:
+        if the scf was still converging, no input parameter is changed,
+        if it was oscillating or stalled, the next rung of the mixing ladder is applied.
         """
 
         self.report(f'SiestaCalculation<{node.pk}> did not achieve scf convergence.')
@@ -198,7 +315,113 @@ class SiestaBaseWorkChain(BaseRestartWorkChain):
         # The presence of `parent_calc_folder` triggers the real restart, so we add it.
         self.ctx.inputs['parent_calc_folder'] = node.outputs.remote_folder
 
-        #Should be also increase the number of scf max iterations?
+        self._escalate_scf_mixing(node)
+
+        return ProcessHandlerReport(do_break=True)
+
+    def _escalate_scf_mixing(self, node, diagnosis=None):
+        """
+        Analyse the scf history of `node` and, if needed, apply the next rung of the mixing ladder
+        to the parameters of the next calculation. Each change is reported and recorded in
+        `ctx.scf_mixing_changes`, that is also stored in the extras of the WorkChain
+        (key `SCF_MIXING_EXTRA_KEY`), so that it is available even if the WorkChain fails.
+        :param diagnosis: if passed, the scf history is not analysed and the rung is always applied.
+        :return: True if the parameters were changed.
+        """
+        from aiida_siesta.utils.scf_mixing import (
+            DEFAULT_SCF_MIXING_LADDER, SCF_MIXING_EXTRA_KEY, analyse_scf_history, escalate_scf_parameters,
+            get_scf_history
+        )
+
+        if diagnosis is None:
+            try:
+                output_content = node.outputs.retrieved.get_object_content(node.get_option('output_filename'))
+            except (IOError, OSError):
+                self.report('Output file not found, the scf history can not be analysed')
+                return False
+
+            diagnosis = analyse_scf_history(get_scf_history(output_content))
+            self.report(f'The scf cycle of SiestaCalculation<{node.pk}> was {diagnosis}')
+            if diagnosis not in ["oscillating", "stalled"]:
+                return False
+
+        if 'scf_mixing_ladder' in self.inputs:
+            ladder = self.inputs.scf_mixing_ladder.get_list()
+        else:
+            ladder = DEFAULT_SCF_MIXING_LADDER
+
+        if self.ctx.scf_mixing_level >= len(ladder):
+            self.report('The scf mixing ladder is exhausted, restarting with the same parameters')
+            return False
+
+        new_param, changes = escalate_scf_parameters(
+            self.ctx.inputs['parameters'].get_dict(), ladder[self.ctx.scf_mixing_level]
+        )
+        self.ctx.scf_mixing_level += 1
+        self.ctx.scf_mixing_changes.append({
+            "calculation": node.pk,
+            "diagnosis": diagnosis,
+            "level": self.ctx.scf_mixing_level,
+            "changes": changes
+        })
+        self.node.set_extra(SCF_MIXING_EXTRA_KEY, self.ctx.scf_mixing_changes)
+        for key, (old, new) in changes.items():
+            self.report(f'Scf mixing ladder level {self.ctx.scf_mixing_level}: `{key}` changed from {old} to {new}')
+        if changes:
+            self.ctx.inputs['parameters'] = orm.Dict(dict=new_param)
+
+        return bool(changes)
+
+    @process_handler(priority=75, exit_codes=_proc_exit_cod.SCF_DIVERGED)  #pylint: disable = no-member
+    def handle_error_scf_diverged(self, node):
+        """
+        The calculation was killed by the monitor because the scf was diverging or stagnating
+        (see `aiida_siesta.utils.monitor`). No density matrix is reused: the `parent_calc_folder`
+        (set, for instance, by a previous walltime restart) is removed, since its density matrix led
+        to the divergence. The calculation is restarted from scratch with the next rung of the mixing ladder.
+        If the ladder is exhausted, the workchain stops.
+        """
+        reason = node.outputs.output_parameters.get_dict().get("monitor_kill_reason", "diverging")
+        self.report(f'SiestaCalculation<{node.pk}> was killed by the monitor, the scf was {reason}.')
+
+        self.ctx.inputs.pop('parent_calc_folder', None)
+
+        if not self._escalate_scf_mixing(node, diagnosis=reason):
+            return ProcessHandlerReport(do_break=True, exit_code=self.exit_codes.ERROR_SCF_DIVERGED)
+
+        return ProcessHandlerReport(do_break=True)
+
+    @process_handler(priority=85, exit_codes=_proc_exit_cod.WALLTIME_EXCEEDED)  #pylint: disable = no-member
+    def handle_error_walltime(self, node):
+        """
+        The calculation was stopped because the walltime was reached. We restart from the last
+        density matrix (through `parent_calc_folder`) and from the geometry of the .XV file
+        (parsed in `output_structure`). For relaxations and MD, the geometry steps already
+        performed are subtracted from the total, so that the global count of steps is preserved.
+        For MD, also the velocities and the state of the integrator are needed: the .XV and the
+        restart files of the integrator are copied from the parent folder (`MD_RESTART` setting).
+        """
+
+        self.report(f'SiestaCalculation<{node.pk}> was stopped because of the walltime, restarting.')
+
+        if "output_structure" in node.outputs:
+            self.ctx.inputs['structure'] = node.outputs.output_structure
+
+        # The presence of `parent_calc_folder` triggers the real restart, so we add it.
+        self.ctx.inputs['parent_calc_folder'] = node.outputs.remote_folder
+
+        last_step = node.outputs.output_parameters.get_dict().get("last_md_step")
+        if last_step:
+            new_param = update_md_steps(self.ctx.inputs['parameters'].get_dict(), last_step)
+            if new_param is not None:
+                self.report(f'The geometry steps are continued after step {last_step}')
+                self.ctx.inputs['parameters'] = orm.Dict(dict=new_param)
+
+        run_type = FDFDict(self.ctx.inputs['parameters'].get_dict()).get("mdtypeofrun", "")
+        if FDFDict.translate_key(str(run_type)) in SiestaCalculation._md_types_of_run:
+            settings = self.ctx.inputs['settings'].get_dict() if 'settings' in self.ctx.inputs else {}
+            settings['MD_RESTART'] = True
+            self.ctx.inputs['settings'] = orm.Dict(dict=settings)
 
         return ProcessHandlerReport(do_break=True)
 
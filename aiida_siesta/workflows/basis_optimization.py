@@ -0,0 +1,291 @@
+from aiida import orm
+from aiida.common import AttributeDict
+from aiida.engine import WorkChain, ToContext, calcfunction, while_
+from aiida_siesta.utils.tkdict import FDFDict
+from aiida_siesta.workflows.base import SiestaBaseWorkChain
+
+
+def validate_inputs(value, _):
+    """
+    Validate the entire input namespace.
+    """
+    if 'ions' in value:
+        return "The basis is optimized through a `%block pao-basis`, `ions` can not be used."
+
+    bounds = value['radius_bounds'].get_list()
+    if len(bounds) != 2 or not 0 < bounds[0] < 1 < bounds[1]:
+        return "`radius_bounds` must be a list [lower, upper] with 0 < lower < 1 < upper."
+
+
+def get_ion_files(node):
+    """
+    Return a dictionary {kind name: IonData} with the `ion_files` outputs of a SiestaBaseWorkChain.
+    """
+    ions = {}
+    for name in node.outputs:
+        if "ion_files" in name:
+            ions[name.replace("ion_files__", "")] = node.get_outgoing(link_label_filter=name).one().node
+
+    return ions
+
+
+@calcfunction
+def get_optimization_results(optimal_basis, results):
+    """
+    Calcfunction returning the outputs of the `BasisOptimizationWorkChain`.
+    :param optimal_basis: the basis Dict of the best calculation.
+    :param results: Dict with the optimal basis enthalpy and the history of the optimization.
+    :return: a dictionary with the `optimal_basis` and `results_dict` outputs.
+    """
+    return {'optimal_basis': orm.Dict(dict=optimal_basis.get_dict()), 'results_dict': orm.Dict(dict=results.get_dict())}
+
+
+class BasisOptimizationWorkChain(WorkChain):
+    """
+    WorkChain to optimize the radii of the PAO basis, minimizing the `basis_enthalpy` returned by Siesta.
+    A reference SiestaBaseWorkChain provides the starting basis (through its ion files) and the
+    starting value. Then, at each generation, a population of candidate PAO blocks is sampled
+    by a population-based optimizer (see `aiida_siesta.utils.basis_optimizer`) and all the candidates are
+    run in parallel as a batch of SiestaBaseWorkChains, starting from the density matrix of the best
+    calculation so far. The size of the population is, if not fixed in input, the number of free
+    slots on the computer.
+    """
+
+    @classmethod
+    def define(cls, spec):
+        super().define(spec)
+        spec.expose_inputs(SiestaBaseWorkChain, exclude=('metadata',))
+        spec.input(
+            'max_generations',
+            valid_type=orm.Int,
+            default=lambda: orm.Int(10),
+            help='Maximum number of generations, the reference calculation excluded'
+        )
+        spec.input(
+            'population_size',
+            valid_type=orm.Int,
+            required=False,
+            help='Number of candidates of each generation. If not set, it is the number of free slots '
+            'on the computer (`max_active_processes` minus the active calculations), at least 2.'
+        )
+        spec.input(
+            'max_active_processes',
+            valid_type=orm.Int,
+            default=lambda: orm.Int(16),
+            help='Maximum number of active calculations on the computer, used to set the size of the population'
+        )
+        spec.input(
+            'radius_bounds',
+            valid_type=orm.List,
+            default=lambda: orm.List(list=[0.7, 1.5]),
+            help='Lower and upper bound of the radii, as factors of the radii of the reference basis'
+        )
+        spec.input(
+            'initial_step',
+            valid_type=orm.Float,
+            default=lambda: orm.Float(0.1),
+            help='Initial width of the sampling distribution of the radii (as factors of the reference radii)'
+        )
+        spec.input(
+            'enthalpy_tolerance',
+            valid_type=orm.Float,
+            default=lambda: orm.Float(0.001),
+            help='Convergence is reached when the best basis enthalpy improved less than this value (eV) '
+            'in the last three generations'
+        )
+        spec.input('seed', valid_type=orm.Int, default=lambda: orm.Int(0), help='Seed of the random sampling')
+        spec.output('optimal_basis', valid_type=orm.Dict, help='The basis dictionary with the optimal pao block')
+        spec.output('results_dict', valid_type=orm.Dict, help='Optimal basis enthalpy and history of the optimization')
+        spec.outline(
+            cls.run_reference,
+            cls.inspect_reference,
+            while_(cls.should_run_generation)(
+                cls.run_generation,
+                cls.inspect_generation,
+            ),
+            cls.return_results,
+        )
+        spec.inputs.validator = validate_inputs
+        spec.exit_code(200, 'ERROR_REFERENCE_WC', message='The reference SiestaBaseWorkChain failed')
+        spec.exit_code(201, 'ERROR_GENERATION_WC', message='All the SiestaBaseWorkChain of a generation failed')
+        spec.exit_code(202, 'ERROR_NO_BASIS_ENTHALPY', message='The basis enthalpy was not returned by Siesta')
+
+    def run_reference(self):
+        """
+        Run the SiestaBaseWorkChain with the input basis.
+        """
+        inputs = AttributeDict(self.exposed_inputs(SiestaBaseWorkChain))
+        running = self.submit(SiestaBaseWorkChain, **inputs)
+        self.report(f'Launched reference SiestaBaseWorkChain<{running.pk}>.')
+
+        return ToContext(reference=running)
+
+    def inspect_reference(self):
+        """
+        Set up the optimizer from the results of the reference calculation.
+        """
+        from aiida_siesta.utils.basis_optimizer import DiagonalEvolutionStrategy
+
+        reference = self.ctx.reference
+        if not reference.is_finished_ok:
+            return self.exit_codes.ERROR_REFERENCE_WC
+        if "basis_enthalpy" not in reference.outputs.output_parameters.attributes:
+            return self.exit_codes.ERROR_NO_BASIS_ENTHALPY
+
+        pao_basis = self._get_reference_basis()
+        num_vars = int((~pao_basis.orbitals["pol"]).sum())
+        optimizer = DiagonalEvolutionStrategy(
+            num_vars,
+            bounds=self.inputs.radius_bounds.get_list(),
+            initial_step=self.inputs.initial_step.value,
+            ftol=self.inputs.enthalpy_tolerance.value,
+            seed=self.inputs.seed.value
+        )
+        optimizer.set_reference(reference.outputs.output_parameters["basis_enthalpy"])
+        self.report(f'Reference basis enthalpy {optimizer.best_value} eV, {num_vars} radii to optimize.')
+
+        self.ctx.optimizer = optimizer.to_dict()
+        self.ctx.best_node = reference.uuid
+
+    def _get_reference_basis(self):
+        """
+        Return the `PaoBasisSet` of the ion files of the reference calculation.
+        It is recomputed when needed, so that no object is kept in the context.
+        """
+        from aiida_siesta.utils.pao_manager import PaoManager, PaoBasisSet
+
+        pao_managers = []
+        for name, ion in get_ion_files(self.ctx.reference).items():
+            pao_manager = PaoManager()
+            pao_manager.set_from_ion(ion)
+            pao_manager.name = name
+            pao_managers.append(pao_manager)
+
+        return PaoBasisSet.from_pao_managers(pao_managers)
+
+    def _get_basis_dict(self, factors):
+        """
+        Return the basis Dict of a candidate: the input basis with the `%block pao-basis` containing
+        the radii of the reference basis (unpolarized orbitals) multiplied by `factors`.
+        """
+        pao_basis = self._get_reference_basis()
+        unpolarized = ~pao_basis.orbitals["pol"]
+        pao_basis.orbitals["radius"][unpolarized] *= factors
+
+        basis = FDFDict(self.inputs.basis.get_dict() if 'basis' in self.inputs else {})
+        basis.pop(FDFDict.translate_key('%block pao-basis'), None)
+        basis = basis.get_untranslated_dict()
+        basis['%block pao-basis'] = pao_basis.get_pao_block()
+
+        return orm.Dict(dict=basis)
+
+    def _get_population_size(self):
+        """
+        The size of the population, from input or from the free slots on the computer.
+        """
+        from aiida_siesta.utils.campaign import get_num_active_calculations
+
+        if 'population_size' in self.inputs:
+            return self.inputs.population_size.value
+
+        free_slots = self.inputs.max_active_processes.value - get_num_active_calculations(self.inputs.code.computer)
+
+        return max(free_slots, 2)
+
+    def should_run_generation(self):
+        """
+        Stop when the optimizer is converged or the maximum number of generations is reached.
+        """
+        from aiida_siesta.utils.basis_optimizer import DiagonalEvolutionStrategy
+
+        optimizer = DiagonalEvolutionStrategy.from_dict(self.ctx.optimizer)
+        if optimizer.converged:
+            self.report(f'Optimization converged after {optimizer.generation} generations.')
+            return False
+        if optimizer.generation >= self.inputs.max_generations.value:
+            self.report('Maximum number of generations reached without convergence.')
+            return False
+
+        return True
+
+    def run_generation(self):
+        """
+        Submit a SiestaBaseWorkChain for each candidate of the generation. All of them restart from the
+        density matrix of the best calculation so far. Only the radii change, so the number of orbitals
+        (and therefore the structure of the density matrix) is the same of the reference.
+        """
+        from aiida_siesta.utils.basis_optimizer import DiagonalEvolutionStrategy
+
+        optimizer = DiagonalEvolutionStrategy.from_dict(self.ctx.optimizer)
+        samples = optimizer.ask(self._get_population_size())
+
+        inputs = AttributeDict(self.exposed_inputs(SiestaBaseWorkChain))
+        inputs.parent_calc_folder = orm.load_node(self.ctx.best_node).outputs.remote_folder
+
+        calcs = {}
+        for index, factors in enumerate(samples):
+            inputs.basis = self._get_basis_dict(factors)
+            running = self.submit(SiestaBaseWorkChain, **inputs)
+            calcs[f'candidate_{index}'] = running
+        self.report(
+            f'Generation {optimizer.generation}: launched {len(calcs)} SiestaBaseWorkChain '
+            f'<{", ".join(str(calc.pk) for calc in calcs.values())}>.'
+        )
+
+        self.ctx.samples = samples.tolist()
+        self.ctx.candidates = list(calcs)
+
+        return ToContext(**calcs)
+
+    def inspect_generation(self):
+        """
+        Pass the basis enthalpies of the candidates to the optimizer. Failed candidates are ignored.
+        """
+        from aiida_siesta.utils.basis_optimizer import DiagonalEvolutionStrategy
+
+        optimizer = DiagonalEvolutionStrategy.from_dict(self.ctx.optimizer)
+        previous_best = optimizer.best_value
+
+        values = []
+        for key in self.ctx.candidates:
+            node = self.ctx[key]
+            if node.is_finished_ok:
+                values.append(node.outputs.output_parameters.attributes.get("basis_enthalpy"))
+            else:
+                values.append(None)
+        try:
+            optimizer.tell(self.ctx.samples, values)
+        except ValueError:
+            return self.exit_codes.ERROR_GENERATION_WC
+
+        if optimizer.best_value < previous_best:
+            self.ctx.best_node = self.ctx[self.ctx.candidates[values.index(optimizer.best_value)]].uuid
+        self.report(f'Generation {optimizer.generation - 1}: best basis enthalpy {optimizer.best_value} eV.')
+
+        self.ctx.optimizer = optimizer.to_dict()
+
+    def return_results(self):
+        """
+        Return the optimal basis and the history of the optimization.
+        """
+        from aiida_siesta.utils.basis_optimizer import DiagonalEvolutionStrategy
+
+        optimizer = DiagonalEvolutionStrategy.from_dict(self.ctx.optimizer)
+        best_node = orm.load_node(self.ctx.best_node)
+        if best_node.uuid == self.ctx.reference.uuid:
+            optimal_basis = self._get_basis_dict(optimizer.best_x)
+        else:
+            optimal_basis = best_node.inputs.basis
+
+        results = {
+            "basis_enthalpy": optimizer.best_value,
+            "basis_enthalpy_units": "eV",
+            "reference_basis_enthalpy": optimizer.history[0],
+            "generations": optimizer.generation,
+            "converged": optimizer.converged,
+            "history": optimizer.history,
+            "optimal_workchain": best_node.uuid,
+        }
+        outputs = get_optimization_results(optimal_basis, orm.Dict(dict=results))
+        self.out('optimal_basis', outputs['optimal_basis'])
+        self.out('results_dict', outputs['results_dict'])
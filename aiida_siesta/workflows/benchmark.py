@@ -0,0 +1,177 @@
+from aiida import orm
+from aiida.common import AttributeDict
+from aiida.engine import WorkChain, ToContext, calcfunction
+from aiida_siesta.utils.tkdict import FDFDict
+from aiida_siesta.workflows.base import SiestaBaseWorkChain
+
+
+def validate_resources_list(value, _):
+    """
+    Validate the `resources_list` input port.
+    """
+    if not value.get_list():
+        return "`resources_list` must contain at least one `resources` dictionary."
+    for resources in value.get_list():
+        if not isinstance(resources, dict):
+            return "each element of `resources_list` must be a `resources` dictionary."
+
+
+def validate_parallel_options(value, _):
+    """
+    Validate the `parallel_options` input port.
+    """
+    if not value.get_list():
+        return "`parallel_options` must contain at least one dictionary (possibly empty)."
+    for options in value.get_list():
+        if not isinstance(options, dict):
+            return "each element of `parallel_options` must be a dictionary of fdf keywords."
+
+
+@calcfunction
+def get_benchmark_results(configurations, min_efficiency, computer, **output_parameters):
+    """
+    Calcfunction returning the outputs of the `ParallelBenchmarkWorkChain`.
+    :param configurations: List of dictionaries with the `resources` and the `parallel_options`
+                           of each configuration and the `key` of its `output_parameters`.
+    :param min_efficiency: Float, see `aiida_siesta.utils.benchmark.analyse_benchmark`.
+    :param computer: Str with the label of the computer.
+    :param output_parameters: the `output_parameters` of the finished calculations.
+    :return: a dictionary with the `results_dict` and `recommended_configuration` outputs.
+    """
+    from aiida_siesta.utils.benchmark import analyse_benchmark
+
+    rows = []
+    no_u = None
+    for configuration in configurations.get_list():
+        row = {"resources": configuration["resources"], "parallel_options": configuration["parallel_options"]}
+        row["global_time"] = None
+        row["timing_decomposition"] = None
+        if configuration["key"] in output_parameters:
+            attributes = output_parameters[configuration["key"]].attributes
+            row["global_time"] = attributes.get("global_time")
+            row["timing_decomposition"] = attributes.get("timing_decomposition")
+            no_u = attributes.get("no_u", no_u)
+        rows.append(row)
+
+    analysis = analyse_benchmark(rows, min_efficiency.value)
+    recommended = analysis["table"][analysis["recommended"]]
+    recommended_configuration = {
+        "resources": recommended["resources"],
+        "parallel_options": recommended["parallel_options"]
+    }
+    results = {
+        "table": analysis["table"],
+        "recommended": analysis["recommended"],
+        "recommended_configuration": recommended_configuration,
+        "no_u": no_u,
+        "computer": computer.value,
+        "global_time_units": "s",
+    }
+
+    return {
+        'results_dict': orm.Dict(dict=results),
+        'recommended_configuration': orm.Dict(dict=recommended_configuration)
+    }
+
+
+class ParallelBenchmarkWorkChain(WorkChain):
+    """
+    WorkChain running the same Siesta input on a matrix of `resources` (MPI ranks, OpenMP threads,
+    machines) and of parallel fdf options (for instance `diag-paralleloverk` or `blocksize`).
+    All the configurations run concurrently. The `global_time` and the timing decomposition of each one
+    are collected in a table, with the speedup and the parallel efficiency, and the fastest configuration
+    with an efficiency above `min_efficiency` is recommended. The results are stored in the database
+    and the input generators can use them to choose the layout of new calculations.
+    """
+
+    @classmethod
+    def define(cls, spec):
+        super().define(spec)
+        spec.expose_inputs(SiestaBaseWorkChain, exclude=('metadata',))
+        spec.input(
+            'resources_list',
+            valid_type=orm.List,
+            validator=validate_resources_list,
+            help='List of `resources` dictionaries. The OpenMP threads are set with `num_cores_per_mpiproc`'
+        )
+        spec.input(
+            'parallel_options',
+            valid_type=orm.List,
+            default=lambda: orm.List(list=[{}]),
+            validator=validate_parallel_options,
+            help='List of dictionaries of fdf keywords, added to the parameters'
+        )
+        spec.input(
+            'min_efficiency',
+            valid_type=orm.Float,
+            default=lambda: orm.Float(0.7),
+            help='Minimum parallel efficiency of the recommended configuration'
+        )
+        spec.output('results_dict', valid_type=orm.Dict, help='Table of timings, speedup and efficiency')
+        spec.output(
+            'recommended_configuration', valid_type=orm.Dict, help='The recommended resources and parallel options'
+        )
+        spec.outline(
+            cls.run_benchmarks,
+            cls.return_results,
+        )
+        spec.exit_code(200, 'ERROR_ALL_BENCHMARKS_FAILED', message='All the benchmark calculations failed')
+
+    def run_benchmarks(self):
+        """
+        Submit a SiestaBaseWorkChain for each combination of `resources` and parallel options.
+        """
+        inputs = AttributeDict(self.exposed_inputs(SiestaBaseWorkChain))
+
+        calcs = {}
+        configurations = []
+        for resources in self.inputs.resources_list.get_list():
+            for parallel_options in self.inputs.parallel_options.get_list():
+                options = inputs.options.get_dict()
+                options["resources"] = resources
+                if "num_cores_per_mpiproc" in resources:
+                    environment = dict(options.get("environment_variables", {}))
+                    environment["OMP_NUM_THREADS"] = str(resources["num_cores_per_mpiproc"])
+                    options["environment_variables"] = environment
+                parameters = FDFDict(inputs.parameters.get_dict())
+                for keyword, value in parallel_options.items():
+                    parameters[keyword] = value
+
+                key = f'config_{len(configurations)}'
+                inputs.options = orm.Dict(dict=options)
+                inputs.parameters = orm.Dict(dict=parameters.get_untranslated_dict())
+                calcs[key] = self.submit(SiestaBaseWorkChain, **inputs)
+                configurations.append({"resources": resources, "parallel_options": parallel_options, "key": key})
+
+        self.report(
+            f'Launched {len(calcs)} SiestaBaseWorkChain '
+            f'<{", ".join(str(calc.pk) for calc in calcs.values())}> for the benchmark.'
+        )
+        self.ctx.configurations = configurations
+
+        return ToContext(**calcs)
+
+    def return_results(self):
+        """
+        Collect the timings and return the table with speedup and efficiency and the recommended configuration.
+        """
+        output_parameters = {}
+        for configuration in self.ctx.configurations:
+            node = self.ctx[configuration["key"]]
+            if node.is_finished_ok and "global_time" in node.outputs.output_parameters.attributes:
+                output_parameters[configuration["key"]] = node.outputs.output_parameters
+            else:
+                self.report(f'Configuration {configuration["key"]} failed or without timing, it is ignored.')
+
+        if not output_parameters:
+            return self.exit_codes.ERROR_ALL_BENCHMARKS_FAILED
+
+        outputs = get_benchmark_results(
+            orm.List(list=self.ctx.configurations), self.inputs.min_efficiency,
+            orm.Str(self.inputs.code.computer.label), **output_parameters
+        )
+        recommended = outputs['recommended_configuration'].get_dict()
+        self.report(f'Recommended configuration: {recommended["resources"]}, {recommended["parallel_options"]}.')
+
+        self.out('results_dict', outputs['results_dict'])
+        self.out('recommended_configuration', outputs['recommended_configuration'])
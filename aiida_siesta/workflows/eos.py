@@ -73,6 +73,105 @@ def delta_project_BM_fit(volumes, energies):  #pylint: disable=invalid-name
     return E0, volume0, bulk_modulus0, bulk_deriv0
 
 
+def delta_project_BM_fit_many(volumes, energies):  #pylint: disable=invalid-name
+    """
+    Vectorized version of `delta_project_BM_fit`, fitting many E(V) curves at once.
+    The same third order polynomial in V^(-2/3) is fitted for every system, but the
+    least-square problems are solved together (batched pseudo-inverse) and the
+    minimum is located analytically instead of calling `np.roots` system by system.
+    Curves with different number of points can be passed padding with `nan`.
+    :param volumes: array of shape (M, N), the volumes (per atom) of M systems.
+    :param energies: array of shape (M, N), the corresponding energies.
+    :return: five arrays of length M, E0, V0, B0, B1 and the residuals. For the systems
+             where the fit failed (no minimum or residuals > 0.01) E0, V0, B0 and B1 are `nan`.
+    """
+
+    import numpy as np
+
+    volumes = np.atleast_2d(np.asarray(volumes, dtype=float))
+    energies = np.atleast_2d(np.asarray(energies, dtype=float))
+    if volumes.shape != energies.shape:
+        raise ValueError("`volumes` and `energies` must have the same shape")
+
+    mask = np.isfinite(volumes) & np.isfinite(energies) & (volumes > 0)
+    npoints = mask.sum(axis=1)
+    xvals = np.where(mask, volumes, 1.)**(-2. / 3.)
+    yvals = np.where(mask, energies, 0.)
+
+    #Vandermonde matrices (M, N, 4) with the padded rows set to zero, columns scaled as in np.polyfit
+    vander = xvals[:, :, None]**np.arange(3, -1, -1)[None, None, :] * mask[:, :, None]
+    scale = np.sqrt((vander * vander).sum(axis=1))
+    scale[scale == 0] = 1.
+    coeffs = np.einsum("mkn,mn->mk", np.linalg.pinv(vander / scale[:, None, :]), yvals) / scale
+
+    fitted = np.einsum("mnk,mk->mn", vander, coeffs)
+    ssr = np.sum(((fitted - yvals) * mask)**2, axis=1)
+    mean = yvals.sum(axis=1) / np.maximum(npoints, 1)
+    sst = np.sum(((yvals - mean[:, None]) * mask)**2, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        residuals = ssr / sst
+
+    #Minimum of p(x) = c0 x^3 + c1 x^2 + c2 x + c3, root of p'(x) with p''(x) > 0.
+    #The two algebraically equivalent expressions avoid cancellation errors.
+    c_0, c_1, c_2 = coeffs[:, 0], coeffs[:, 1], coeffs[:, 2]
+    disc = c_1**2 - 3. * c_0 * c_2
+    sqrt_disc = np.sqrt(np.where(disc > 0, disc, np.nan))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_min = np.where(c_1 >= 0, -c_2 / (c_1 + sqrt_disc), (-c_1 + sqrt_disc) / (3. * c_0))
+
+    deriv2 = 6. * c_0 * x_min + 2. * c_1
+    deriv3 = 6. * c_0
+    success = (npoints >= 4) & np.isfinite(x_min) & (x_min > 0) & (deriv2 > 0) & (residuals <= 0.01)
+    x_min = np.where(success, x_min, np.nan)
+
+    energy0 = ((c_0 * x_min + c_1) * x_min + c_2) * x_min + coeffs[:, 3]
+    volume0 = x_min**(-3. / 2.)
+    derivV2 = 4. / 9. * x_min**5. * deriv2  #pylint: disable=invalid-name
+    derivV3 = (-20. / 9. * x_min**(13. / 2.) * deriv2 - 8. / 27. * x_min**(15. / 2.) * deriv3)  #pylint: disable=invalid-name
+    bulk_modulus0 = derivV2 / x_min**(3. / 2.)
+    bulk_deriv0 = -1 - x_min**(-3. / 2.) * derivV3 / derivV2
+
+    return energy0, volume0, bulk_modulus0, bulk_deriv0, residuals
+
+
+def collect_eos_data(group_label=None):
+    """
+    Collect, with a single query, the E(V) data of all the finished `EqOfStateFixedCellShape`
+    workchains in the database (or in a group).
+    :param group_label: optional, the label of a group containing the workchains.
+    :return: a list with the pks of the workchains and two arrays of shape (M, N)
+             with volumes and energies per atom. Curves shorter than N are padded with `nan`.
+    """
+    import numpy as np
+    from aiida import orm
+
+    eos_filters = {'process_type': 'aiida.workflows:siesta.eos', 'attributes.exit_status': 0}
+
+    query = orm.QueryBuilder()
+    if group_label is not None:
+        query.append(orm.Group, filters={'label': group_label}, tag='group')
+        query.append(orm.WorkflowNode, with_group='group', filters=eos_filters, project=['id'], tag='eos')
+    else:
+        query.append(orm.WorkflowNode, filters=eos_filters, project=['id'], tag='eos')
+    query.append(orm.Dict, with_incoming='eos', edge_filters={'label': 'results_dict'}, project=['attributes.eos_data'])
+    query.order_by({'eos': {'id': 'asc'}})
+
+    pks = []
+    curves = []
+    for pk, eos_data in query.iterall():
+        pks.append(pk)
+        curves.append(eos_data)
+
+    npoints = max([len(curve) for curve in curves], default=0)
+    volumes = np.full((len(curves), npoints), np.nan)
+    energies = np.full((len(curves), npoints), np.nan)
+    for index, curve in enumerate(curves):
+        volumes[index, :len(curve)] = [point[0] for point in curve]
+        energies[index, :len(curve)] = [point[1] for point in curve]
+
+    return pks, volumes, energies
+
+
 @calcfunction
 def rescale(structure, scale):
     """
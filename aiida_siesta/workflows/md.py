@@ -0,0 +1,212 @@
+import numpy as np
+from aiida import orm
+from aiida.common import AttributeDict
+from aiida.engine import WorkChain, ToContext, while_, calcfunction
+from aiida_siesta.calculations.siesta import SiestaCalculation
+from aiida_siesta.parsers.md_trajectory import MDE_COLUMNS
+from aiida_siesta.utils.tkdict import FDFDict
+from aiida_siesta.workflows.base import validate_options
+
+
+def validate_positive(value, _):
+    """
+    Validate the ports requiring a positive integer.
+    """
+    if value.value < 1:
+        return "the value must be a positive integer."
+
+
+def validate_inputs(value, _):
+    """
+    Validate the entire input namespace.
+    """
+    md_type = FDFDict(value['parameters'].get_dict()).get('mdtypeofrun')
+    if FDFDict.translate_key(str(md_type)) not in SiestaCalculation._md_types_of_run:
+        return "The `parameters` must define a molecular dynamics run (`md-type-of-run`)."
+
+
+@calcfunction
+def concatenate_trajectories(**trajectories):
+    """
+    Calcfunction joining the trajectories of the segments of an MD run, passed with the keys
+    `segment_0`, `segment_1`, ... The steps present in more than one segment (a segment restarted
+    after a failure) are taken from the later segment. The `cells` and the arrays of the .MDE file
+    are kept if they are present in all the segments.
+    :return: a dictionary with the `output_trajectory` and the `md_info` (steps and segments).
+    """
+    segments = [trajectories[key] for key in sorted(trajectories, key=lambda key: int(key.split('_')[-1]))]
+
+    stepids = np.concatenate([segment.get_stepids() for segment in segments])
+    # The index of the last occurrence of each step, sorted by step
+    _, reversed_index = np.unique(stepids[::-1], return_index=True)
+    keep = len(stepids) - 1 - reversed_index
+
+    arrays = {}
+    for name in ('positions', 'cells') + MDE_COLUMNS[1:]:
+        if all(name in segment.get_arraynames() for segment in segments):
+            arrays[name] = np.concatenate([segment.get_array(name) for segment in segments])[keep]
+
+    trajectory = orm.TrajectoryData()
+    trajectory.set_trajectory(
+        segments[0].symbols, arrays.pop('positions'), stepids=stepids[keep], cells=arrays.pop('cells', None)
+    )
+    for name, array in arrays.items():
+        trajectory.set_array(name, array)
+
+    md_info = {
+        "num_segments": len(segments),
+        "first_step": int(stepids[keep][0]),
+        "last_step": int(stepids[keep][-1]),
+        "num_steps": len(keep),
+        "num_repeated_steps": len(stepids) - len(keep),
+    }
+
+    return {'output_trajectory': trajectory, 'md_info': orm.Dict(dict=md_info)}
+
+
+class ChunkedMDWorkChain(WorkChain):
+    """
+    WorkChain running a long molecular dynamics as a sequence of segments of `steps_per_segment` steps,
+    each one a SiestaCalculation of limited walltime and output size.
+    Each segment restarts from the files of the previous one: the density matrix, the geometry and velocities
+    (.XV) and the state of the integrator (.VERLET_RESTART, .NOSE_RESTART, ...) are copied, not symlinked,
+    since Siesta overwrites them at each step (see the `MD_RESTART` setting of the SiestaCalculation).
+    In this way a segment failing partway never modifies the files of its parent, that can be used again.
+    The trajectory of each segment is parsed in its `output_trajectory` and the trajectories of all the
+    segments are concatenated at the end. A segment failing partway (for instance for the walltime)
+    is not fatal: the next segment resumes from the last step it completed.
+    """
+
+    @classmethod
+    def define(cls, spec):
+        super().define(spec)
+        spec.expose_inputs(SiestaCalculation, exclude=('metadata',))
+        spec.input('options', valid_type=orm.Dict, validator=validate_options)
+        spec.input('total_steps', valid_type=orm.Int, validator=validate_positive, help='The total number of MD steps')
+        spec.input(
+            'steps_per_segment',
+            valid_type=orm.Int,
+            validator=validate_positive,
+            help='The number of MD steps of each segment'
+        )
+        spec.input(
+            'max_segment_failures',
+            valid_type=orm.Int,
+            default=lambda: orm.Int(3),
+            help='Maximum number of consecutive segments failing without completing any MD step'
+        )
+        spec.output('output_trajectory', valid_type=orm.TrajectoryData, help='The trajectory of all the segments')
+        spec.output('md_info', valid_type=orm.Dict, help='The steps and the segments of the run')
+        spec.output('output_structure', valid_type=orm.StructureData, required=False, help='The last structure')
+        spec.output('output_parameters', valid_type=orm.Dict, help='The results of the last segment')
+        spec.output('remote_folder', valid_type=orm.RemoteData, help='The folder of the last segment')
+        spec.outline(
+            cls.setup,
+            while_(cls.should_run_segment)(
+                cls.run_segment,
+                cls.inspect_segment,
+            ),
+            cls.return_results,
+        )
+        spec.inputs.validator = validate_inputs
+        spec.exit_code(
+            200,
+            'ERROR_SEGMENT_FAILED',
+            message='The segments failed `max_segment_failures` times in a row without completing any MD step'
+        )
+
+    def setup(self):
+        """
+        The steps are counted from the `md-initial-time-step` of the parameters (1 if not present).
+        """
+        first_step = int(FDFDict(self.inputs.parameters.get_dict()).get('mdinitialtimestep', 1))
+        self.ctx.next_step = first_step
+        self.ctx.final_step = first_step + self.inputs.total_steps.value - 1
+        self.ctx.structure = self.inputs.structure
+        self.ctx.parent_folder = self.inputs.get('parent_calc_folder')
+        self.ctx.md_restart = False
+        self.ctx.segments = []
+        self.ctx.failures = 0
+
+    def should_run_segment(self):
+        return self.ctx.next_step <= self.ctx.final_step
+
+    def run_segment(self):
+        """
+        Run the SiestaCalculation of the next segment, restarting from the previous one.
+        """
+        inputs = AttributeDict(self.exposed_inputs(SiestaCalculation))
+
+        last_step = min(self.ctx.next_step + self.inputs.steps_per_segment.value - 1, self.ctx.final_step)
+        parameters = FDFDict(inputs.parameters.get_dict())
+        parameters['md-initial-time-step'] = self.ctx.next_step
+        parameters['md-final-time-step'] = last_step
+        parameters['write-md-xmol'] = True
+        inputs.parameters = orm.Dict(dict=parameters.get_untranslated_dict())
+
+        # The files of the parent are copied: a symlinked density matrix would be overwritten by the segment
+        settings = inputs.settings.get_dict() if 'settings' in inputs else {}
+        settings = {key: value for key, value in settings.items() if key.upper() != 'PARENT_FOLDER_SYMLINK'}
+        settings['MD_RESTART'] = self.ctx.md_restart
+        inputs.settings = orm.Dict(dict=settings)
+
+        inputs.structure = self.ctx.structure
+        if self.ctx.parent_folder is not None:
+            inputs.parent_calc_folder = self.ctx.parent_folder
+        inputs.metadata = {'options': self.inputs.options.get_dict()}
+
+        running = self.submit(SiestaCalculation, **inputs)
+        self.report(f'Launched SiestaCalculation<{running.pk}> for the steps {self.ctx.next_step}-{last_step}.')
+
+        return ToContext(segment=running)
+
+    def inspect_segment(self):
+        """
+        Find the last step completed by the segment. The next segment restarts from there or,
+        if no step was completed, from the same parent of this segment.
+        """
+        calc = self.ctx.segment
+
+        last_step = None
+        if 'output_trajectory' in calc.outputs:
+            last_step = int(np.max(calc.outputs.output_trajectory.get_stepids()))
+
+        if last_step is None or last_step < self.ctx.next_step:
+            self.ctx.failures += 1
+            self.report(f'SiestaCalculation<{calc.pk}> did not complete any step.')
+            if self.ctx.failures >= self.inputs.max_segment_failures.value:
+                return self.exit_codes.ERROR_SEGMENT_FAILED
+            return None
+
+        if not calc.is_finished_ok:
+            self.report(f'SiestaCalculation<{calc.pk}> failed, resuming from the last good step {last_step}.')
+
+        self.ctx.failures = 0
+        self.ctx.segments.append(calc.uuid)
+        self.ctx.next_step = last_step + 1
+        self.ctx.parent_folder = calc.outputs.remote_folder
+        self.ctx.md_restart = True
+        if 'output_structure' in calc.outputs:
+            self.ctx.structure = calc.outputs.output_structure
+
+        return None
+
+    def return_results(self):
+        """
+        Concatenate the trajectories of the segments and return the results of the last one.
+        """
+        trajectories = {}
+        for index, uuid in enumerate(self.ctx.segments):
+            trajectories[f'segment_{index}'] = orm.load_node(uuid).outputs.output_trajectory
+
+        outputs = concatenate_trajectories(**trajectories)
+        self.out('output_trajectory', outputs['output_trajectory'])
+        self.out('md_info', outputs['md_info'])
+
+        last_segment = orm.load_node(self.ctx.segments[-1])
+        self.out('output_parameters', last_segment.outputs.output_parameters)
+        self.out('remote_folder', last_segment.outputs.remote_folder)
+        if 'output_structure' in last_segment.outputs:
+            self.out('output_structure', last_segment.outputs.output_structure)
+
+        self.report(f'MD completed in {len(self.ctx.segments)} segments.')
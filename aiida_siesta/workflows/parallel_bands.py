@@ -0,0 +1,173 @@
+from aiida import orm
+from aiida.common import AttributeDict
+from aiida.engine import WorkChain, calcfunction, ToContext
+from aiida_siesta.utils.tkdict import FDFDict
+from aiida_siesta.workflows.base import SiestaBaseWorkChain, validate_inputs as validate_base_inputs
+
+
+def validate_num_chunks(value, _):
+    """
+    Validate the `num_chunks` input port.
+    """
+    if value.value < 1:
+        return "the `num_chunks` must be a positive integer."
+
+
+def validate_inputs(value, ctx):
+    """
+    Validate the entire input namespace. The `bandskpoints` and the `parent_calc_folder` are required
+    here, then the validator of the SiestaBaseWorkChain is called.
+    """
+    if 'bandskpoints' not in value:
+        return "The `bandskpoints` input is required."
+    if 'parent_calc_folder' not in value:
+        return "The `parent_calc_folder` input, hosting the density matrix to reuse, is required."
+
+    return validate_base_inputs(value, ctx)
+
+
+def chunks_parameters(param):
+    """
+    From the input parameters, create the ones for the calculation of the bands in a chunk.
+    The md keys are removed and only one scf step is performed starting from the
+    density matrix of the parent calculation, that can not be overwritten because symlinked.
+    """
+    from aiida_siesta.workflows.bandgap import drop_md_keys
+
+    new_param = FDFDict(drop_md_keys(param.get_dict()))
+    new_param["max-scf-iterations"] = 1
+    new_param["scf-must-converge"] = "F"
+    new_param["write-dm"] = "F"
+    new_param["write-dm-end-of-cycle"] = "F"
+
+    return orm.Dict(dict=new_param.get_untranslated_dict())
+
+
+def chunks_settings(settings=None):
+    """
+    Add the `PARENT_FOLDER_SYMLINK` option to the settings, so that all the chunks
+    share the same density matrix file, and the `NON_SCF_BANDS` option, so that the bands are
+    parsed even if the single scf step of a chunk does not reach the scf tolerance.
+    """
+    if settings is None:
+        new_settings = {}
+    else:
+        new_settings = {str(k).upper(): v for (k, v) in settings.get_dict().items()}
+    new_settings["PARENT_FOLDER_SYMLINK"] = True
+    new_settings["NON_SCF_BANDS"] = True
+
+    return orm.Dict(dict=new_settings)
+
+
+@calcfunction
+def split_bandskpoints(bandskpoints, num_chunks):
+    """
+    Calcfunction that splits a list of kpoints in chunks of (almost) the same size.
+    :param bandskpoints: The KpointsData with the explicit list of kpoints.
+    :param num_chunks: Int, the number of chunks.
+    :return: A dictionary of KpointsData with keys chunk_0, chunk_1, ... following the kpoints order.
+             The labels are dropped as each chunk is calculated with the Siesta BandPoints block.
+    """
+    import numpy as np
+
+    kpoints = bandskpoints.get_kpoints()
+    chunks = {}
+    for index, kpoints_chunk in enumerate(np.array_split(kpoints, min(num_chunks.value, len(kpoints)))):
+        new_kpoints = orm.KpointsData()
+        new_kpoints.set_kpoints(kpoints_chunk)
+        chunks[f"chunk_{index}"] = new_kpoints
+
+    return chunks
+
+
+@calcfunction
+def merge_bands(bandskpoints, structure, **chunks):
+    """
+    Calcfunction that merges the bands calculated on chunks of kpoints.
+    :param bandskpoints: The KpointsData before the splitting. Its kpoints and labels are used
+                         for the final BandsData.
+    :param structure: The structure, used to set the cell of the final BandsData.
+    :param chunks: The BandsData of each chunk, with keys chunk_0, chunk_1, ...
+    :return: The merged BandsData. In case of spin polarization, the spin channels
+             are kept (the merging is performed along the kpoints axis).
+    """
+    import numpy as np
+
+    ordered_keys = sorted(chunks.keys(), key=lambda key: int(key.split("_")[-1]))
+    merged = np.concatenate([chunks[key].get_bands() for key in ordered_keys], axis=-2)
+
+    bkp = bandskpoints.clone()
+    bkp.set_cell_from_structure(structure)
+    bands = orm.BandsData()
+    bands.set_kpointsdata(bkp)
+    bands.set_bands(merged, units=chunks[ordered_keys[0]].units)
+
+    return bands
+
+
+class ParallelBandsWorkChain(WorkChain):
+    """
+    Workchain to calculate the bands on a dense kpoints path. The `bandskpoints` are
+    split in chunks and the bands of each chunk are calculated by a separate SiestaBaseWorkChain.
+    No self-consistency is performed, all the chunks start from the converged density matrix
+    in `parent_calc_folder`, that is symlinked (not copied) in the folder of each calculation.
+    The bands of all the chunks are finally merged, in kpoints order, in a single BandsData.
+    """
+
+    @classmethod
+    def define(cls, spec):
+        super().define(spec)
+        spec.expose_inputs(SiestaBaseWorkChain, exclude=('metadata',))
+        spec.input(
+            'num_chunks',
+            valid_type=orm.Int,
+            default=lambda: orm.Int(2),
+            validator=validate_num_chunks,
+            help='Number of chunks in which the bandskpoints are split'
+        )
+        spec.output('bands', valid_type=orm.BandsData, help='The bands on the full bandskpoints path')
+        spec.outline(
+            cls.split_kpoints,
+            cls.run_chunks,
+            cls.run_results,
+        )
+        spec.inputs.validator = validate_inputs
+        spec.exit_code(200, 'ERROR_CHUNK_WC', message='At least one of the SiestaBaseWorkChain of the chunks failed')
+
+    def split_kpoints(self):
+        """
+        Split the bandskpoints in chunks.
+        """
+        self.ctx.chunks = split_bandskpoints(self.inputs.bandskpoints, self.inputs.num_chunks)
+        self.report(f'The bandskpoints have been split in {len(self.ctx.chunks)} chunks')
+
+    def run_chunks(self):
+        """
+        Submit a SiestaBaseWorkChain for each chunk. They all share the same parameters and settings.
+        """
+        inputs = AttributeDict(self.exposed_inputs(SiestaBaseWorkChain))
+        inputs.parameters = chunks_parameters(self.inputs.parameters)
+        inputs.settings = chunks_settings(self.inputs.settings if 'settings' in self.inputs else None)
+
+        calcs = {}
+        for name, kpoints in self.ctx.chunks.items():
+            inputs.bandskpoints = kpoints
+            running = self.submit(SiestaBaseWorkChain, **inputs)
+            self.report(f'Launched SiestaBaseWorkChain<{running.pk}> to calculate the bands of {name}.')
+            calcs[name] = running
+
+        return ToContext(**calcs)
+
+    def run_results(self):
+        """
+        Merge the bands of all the chunks.
+        """
+        bands_chunks = {}
+        for name in self.ctx.chunks:
+            if not self.ctx[name].is_finished_ok:
+                return self.exit_codes.ERROR_CHUNK_WC
+            bands_chunks[name] = self.ctx[name].outputs.bands
+
+        bands = merge_bands(self.inputs.bandskpoints, self.inputs.structure, **bands_chunks)
+        self.out('bands', bands)
+        self.report("Bands of all the chunks merged")
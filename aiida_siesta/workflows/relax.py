@@ -0,0 +1,185 @@
+from aiida import orm
+from aiida.common import AttributeDict
+from aiida.engine import WorkChain, ToContext, while_
+from aiida_siesta.utils.tkdict import FDFDict
+from aiida_siesta.workflows.base import SiestaBaseWorkChain
+
+#Keys allowed in each stage of the ladder
+STAGE_KEYS = ('parameters', 'basis', 'kpoints')
+
+
+def validate_stages(value, _):
+    """
+    Validate the `stages` input port.
+    """
+    for stage in value.get_list():
+        if not isinstance(stage, dict) or not set(stage).issubset(STAGE_KEYS):
+            return f"each stage must be a dictionary with (some of) the keys {', '.join(STAGE_KEYS)}."
+        if 'kpoints' in stage and 'distance' not in stage['kpoints']:
+            return "the `kpoints` of a stage must define the `distance`."
+
+
+def validate_inputs(value, _):
+    """
+    Validate the entire input namespace.
+    """
+    if FDFDict(value['parameters'].get_dict()).get('mdtypeofrun') is None:
+        return "The `parameters` must define a relaxation (`md-type-of-run`)."
+    if 'ions' in value and any('basis' in stage for stage in value['stages'].get_list()):
+        return "The basis of a stage can not be changed when `ions` are used."
+
+
+def get_stage_inputs(inputs, stage, structure):
+    """
+    Return the inputs of a stage: the `parameters` and the `basis` of the stage override the production
+    ones and, if the production calculation has kpoints, the mesh is obtained from the kpoints `distance`
+    of the stage.
+    :param inputs: the inputs of the production SiestaBaseWorkChain.
+    :param stage: dictionary with the optional keys in `STAGE_KEYS`.
+    :param structure: the starting structure of the stage.
+    """
+    inputs = AttributeDict(inputs)
+    inputs.structure = structure
+
+    for key in ('parameters', 'basis'):
+        if key in stage:
+            fdf = FDFDict(inputs[key].get_dict() if key in inputs else {})
+            for keyword, value in stage[key].items():
+                fdf[keyword] = value
+            inputs[key] = orm.Dict(dict=fdf.get_untranslated_dict())
+
+    if 'kpoints' in stage and 'kpoints' in inputs:
+        kpoints = orm.KpointsData()
+        kpoints.set_cell_from_structure(structure)
+        kpoints.set_kpoints_mesh_from_density(
+            distance=stage['kpoints']['distance'], offset=stage['kpoints'].get('offset', [0., 0., 0.])
+        )
+        inputs.kpoints = kpoints
+
+    return inputs
+
+
+def is_basis_compatible(inputs, other_inputs):
+    """
+    Return True if the density matrix of a calculation can be reused by another one: the ions or
+    the basis (in canonical form) and the species are the same, so that the orbitals are the same.
+    Only the atomic positions and the cell might differ.
+    """
+    from aiida_siesta.utils.fdf_canonical import get_canonical_fdf_dict
+
+    kinds = {kind.name for kind in inputs['structure'].kinds}
+    if kinds != {kind.name for kind in other_inputs['structure'].kinds}:
+        return False
+
+    if 'ions' in inputs:
+        ions = {name: ion.uuid for name, ion in inputs['ions'].items()}
+        return 'ions' in other_inputs and ions == {name: ion.uuid for name, ion in other_inputs['ions'].items()}
+
+    basis = get_canonical_fdf_dict(inputs['basis'].get_dict()) if 'basis' in inputs else {}
+    other_basis = get_canonical_fdf_dict(other_inputs['basis'].get_dict()) if 'basis' in other_inputs else {}
+
+    return basis == other_basis
+
+
+class MultiFidelityRelaxWorkChain(WorkChain):
+    """
+    WorkChain relaxing a structure through a ladder of stages of increasing accuracy.
+    The inputs of the SiestaBaseWorkChain are the ones of the production (last) stage, while the `stages`
+    list the modifications (cheaper `parameters`, `basis` and kpoints) of the preceding stages.
+    Each stage starts from the structure relaxed by the previous one and, when the basis of the two
+    stages is the same, also from its density matrix. A failure in a preliminary stage is not fatal:
+    the next stage starts from the last good structure.
+    The ladder of each protocol is defined in the `relax_stages` entry of the protocol registry.
+    """
+
+    @classmethod
+    def define(cls, spec):
+        super().define(spec)
+        spec.expose_inputs(SiestaBaseWorkChain, exclude=('metadata',))
+        spec.input(
+            'stages',
+            valid_type=orm.List,
+            default=lambda: orm.List(list=[]),
+            validator=validate_stages,
+            help='The preliminary stages, from the cheapest. Each one is a dictionary of `parameters` and `basis` '
+            'overriding the production ones and of `kpoints` (with the `distance` of the mesh)'
+        )
+        spec.expose_outputs(SiestaBaseWorkChain)
+        spec.outline(
+            cls.setup,
+            while_(cls.should_run_stage)(
+                cls.run_stage,
+                cls.inspect_stage,
+            ),
+            cls.return_results,
+        )
+        spec.inputs.validator = validate_inputs
+        spec.exit_code(200, 'ERROR_PRODUCTION_WC', message='The SiestaBaseWorkChain of the production stage failed')
+
+    @classmethod
+    def inputs_generator(cls):  # pylint: disable=no-self-argument,no-self-use
+        from aiida_siesta.utils.protocols_system.input_generators import MultiFidelityRelaxWorkChainInputGenerator
+        return MultiFidelityRelaxWorkChainInputGenerator(cls)
+
+    def setup(self):
+        """
+        The production stage (no modification) is appended to the preliminary stages.
+        """
+        self.ctx.stages = self.inputs.stages.get_list() + [{}]
+        self.ctx.stage_index = 0
+        self.ctx.structure = self.inputs.structure
+        self.ctx.previous = None
+
+    def should_run_stage(self):
+        return self.ctx.stage_index < len(self.ctx.stages)
+
+    def _get_inputs(self, index, structure):
+        return get_stage_inputs(self.exposed_inputs(SiestaBaseWorkChain), self.ctx.stages[index], structure)
+
+    def run_stage(self):
+        """
+        Run the SiestaBaseWorkChain of the current stage, restarting from the density matrix of the
+        previous stage if the basis is compatible.
+        """
+        index = self.ctx.stage_index
+        inputs = self._get_inputs(index, self.ctx.structure)
+
+        if self.ctx.previous is not None:
+            previous = orm.load_node(self.ctx.previous)
+            if is_basis_compatible(inputs, self._get_inputs(index - 1, self.ctx.structure)):
+                inputs.parent_calc_folder = previous.outputs.remote_folder
+                self.report(f'Stage {index} restarts from the density matrix of stage {index - 1}.')
+
+        running = self.submit(SiestaBaseWorkChain, **inputs)
+        self.report(f'Launched SiestaBaseWorkChain<{running.pk}> for stage {index} of {len(self.ctx.stages) - 1}.')
+
+        return ToContext(stage_wc=running)
+
+    def inspect_stage(self):
+        """
+        Pass the relaxed structure to the next stage. Only the failure of the production stage is fatal.
+        """
+        index = self.ctx.stage_index
+        node = self.ctx.stage_wc
+        self.ctx.stage_index += 1
+
+        if index == len(self.ctx.stages) - 1:
+            if not node.is_finished_ok:
+                return self.exit_codes.ERROR_PRODUCTION_WC
+            return None
+
+        if node.is_finished_ok and 'output_structure' in node.outputs:
+            self.ctx.structure = node.outputs.output_structure
+            self.ctx.previous = node.uuid
+        else:
+            self.report(f'Stage {index} failed, the next stage starts from the last good structure.')
+            self.ctx.previous = None
+
+        return None
+
+    def return_results(self):
+        """
+        Return the outputs of the production stage.
+        """
+        self.out_many(self.exposed_outputs(self.ctx.stage_wc, SiestaBaseWorkChain))
+        self.report('Multi-fidelity relaxation completed.')
@@ -49,7 +49,7 @@ def test_base(aiida_profile, fixture_sandbox, generate_calc_job,
 
     cmdline_params = ['-option1', '-option2']
     local_copy_list = [(psf.uuid, psf.filename, 'Si.psf'),(psml.uuid, psml.filename,'SiDiff.psml')]
-    retrieve_list = ["w",'BASIS_ENTHALPY', 'MESSAGES','time.json','aiida.out','aiida.xml','*.ion.xml']
+    retrieve_list = ["w",'BASIS_ENTHALPY', 'MESSAGES','time.json','aiida.out','aiida.xml','*.ion.xml','aiida_monitor.json']
     
     # Check the attributes of the returned `CalcInfo`
     assert isinstance(calc_info, datastructures.CalcInfo)
@@ -109,6 +109,132 @@ def test_base(aiida_profile, fixture_sandbox, generate_calc_job,
 #    remote_copy_list = ["as.DM"]
 #    assert sorted(calc_info.remote_copy_list) == sorted(remote_copy_list)
 
+def test_retrieve_hamiltonian(aiida_profile, fixture_sandbox, generate_calc_job, fixture_code, generate_structure,
+    generate_param, generate_psml_data):
+    """
+    Test that the `RETRIEVE_HAMILTONIAN` setting adds the .HSX and .TSHS files to the retrieve list.
+    """
+
+    entry_point_name = 'siesta.siesta'
+
+    psml = generate_psml_data('Si')
+
+    inputs = {
+        'code': fixture_code(entry_point_name),
+        'structure': generate_structure(),
+        'parameters': generate_param(),
+        'pseudos': {
+            'Si': psml,
+            'SiDiff': psml
+        },
+        'settings': orm.Dict(dict={'retrieve_hamiltonian': True}),
+        'metadata': {
+            'options': {
+               'resources': {'num_machines': 1  },
+               'max_wallclock_seconds': 1800,
+               'withmpi': False,
+               }
+        }
+    }
+
+    calc_info = generate_calc_job(fixture_sandbox, entry_point_name, inputs)
+
+    assert 'aiida.HSX' in calc_info.retrieve_list
+    assert 'aiida.TSHS' in calc_info.retrieve_list
+
+
+@pytest.mark.parametrize('symlink', [True, False])
+def test_md_restart(aiida_profile, fixture_sandbox, fixture_localhost, generate_calc_job,
+    fixture_code, generate_structure, generate_param, generate_psml_data, symlink):
+    """
+    Test the restart of an MD run: the density matrix is symlinked only if requested, the .XV and the
+    restart files of the integrator are always copied and the .ANI and .MDE files are retrieved for the parsing.
+    """
+
+    entry_point_name = 'siesta.siesta'
+
+    psml = generate_psml_data('Si')
+    parameters = generate_param().get_dict()
+    parameters['md-typeofrun'] = 'Verlet'
+    parent_folder = orm.RemoteData(computer=fixture_localhost, remote_path='/tmp/parent')
+
+    inputs = {
+        'code': fixture_code(entry_point_name),
+        'structure': generate_structure(),
+        'parameters': orm.Dict(dict=parameters),
+        'pseudos': {
+            'Si': psml,
+            'SiDiff': psml
+        },
+        'parent_calc_folder': parent_folder,
+        'settings': orm.Dict(dict={'PARENT_FOLDER_SYMLINK': symlink, 'MD_RESTART': True}),
+        'metadata': {
+            'options': {
+               'resources': {'num_machines': 1  },
+               'max_wallclock_seconds': 1800,
+               'withmpi': False,
+               }
+        }
+    }
+
+    calc_info = generate_calc_job(fixture_sandbox, entry_point_name, inputs)
+
+    uuid = fixture_localhost.uuid
+    dm_file = (uuid, '/tmp/parent/./*.DM', './')
+    md_files = [(uuid, '/tmp/parent/./*.XV', './'), (uuid, '/tmp/parent/./*_RESTART', './')]
+    if symlink:
+        assert calc_info.remote_symlink_list == [dm_file]
+        assert sorted(calc_info.remote_copy_list) == sorted(md_files)
+    else:
+        assert calc_info.remote_symlink_list == []
+        assert sorted(calc_info.remote_copy_list) == sorted(md_files + [dm_file])
+    assert sorted(calc_info.retrieve_temporary_list) == ['aiida.ANI', 'aiida.MDE', 'aiida.XV']
+
+    with fixture_sandbox.open('aiida.fdf') as handle:
+        input_written = handle.read()
+    assert 'md-use-save-xv' in input_written.lower()
+
+
+def test_hash_canonical_inputs(aiida_profile, fixture_code, generate_structure, generate_psml_data):
+    """
+    Test that the nodes of two calculations with equivalent `parameters`, written with different
+    spellings, units and booleans, have the same hash, while a real change gives a different hash.
+    """
+    from aiida.engine.utils import instantiate_process
+    from aiida.manage.manager import get_manager
+    from aiida_siesta.calculations.siesta import SiestaCalculation, SiestaCalcJobNode
+
+    code = fixture_code('siesta.siesta')
+    structure = generate_structure()
+    psml = generate_psml_data('Si')
+
+    def get_node(parameters):
+        builder = SiestaCalculation.get_builder()
+        builder.code = code
+        builder.structure = structure
+        builder.pseudos = {'Si': psml, 'SiDiff': psml}
+        builder.parameters = orm.Dict(dict=parameters)
+        builder.metadata.options.resources = {'num_machines': 1}
+        builder.metadata.options.max_wallclock_seconds = 1800
+        process = instantiate_process(get_manager().get_runner(), builder)
+        assert isinstance(process.node, SiestaCalcJobNode)
+        return process.node
+
+    node = get_node({'MeshCutoff': '200 Ry', 'WriteForces': 'T', 'DM.Tolerance': '1.d-4', 'DM.File': 'Si.DM'})
+    equivalent = get_node({
+        'mesh-cutoff': '2721.1386245988 eV',
+        'write-forces': True,
+        'dm-tolerance': 0.0001,
+        'dm-file': 'Si.DM'
+    })
+    changed = get_node({'mesh-cutoff': '300 Ry', 'write-forces': True, 'dm-tolerance': 0.0001, 'dm-file': 'Si.DM'})
+    renamed = get_node({'mesh-cutoff': '200 Ry', 'write-forces': True, 'dm-tolerance': 0.0001, 'dm-file': 'si.dm'})
+
+    assert node.get_hash() == equivalent.get_hash()
+    assert node.get_hash() != changed.get_hash()
+    assert node.get_hash() != renamed.get_hash()
+
+
 def test_validators(aiida_profile, fixture_sandbox, generate_calc_job, 
     fixture_code, generate_structure, generate_kpoints_mesh, generate_basis,
     generate_param, generate_psf_data, generate_psml_data, file_regression):
@@ -231,7 +357,7 @@ def test_bandslines(aiida_profile, fixture_sandbox, generate_calc_job,
 
     calc_info = generate_calc_job(fixture_sandbox, entry_point_name, inputs)
 
-    retrieve_list = ['BASIS_ENTHALPY', 'MESSAGES','time.json','aiida.out','aiida.xml','aiida.bands','*.ion.xml']
+    retrieve_list = ['BASIS_ENTHALPY', 'MESSAGES','time.json','aiida.out','aiida.xml','aiida.bands','*.ion.xml','aiida_monitor.json']
 
     assert sorted(calc_info.retrieve_list) == sorted(retrieve_list)
 
@@ -282,7 +408,7 @@ def test_bandspoints(aiida_profile, fixture_sandbox, generate_calc_job,
 
     calc_info = generate_calc_job(fixture_sandbox, entry_point_name, inputs)
 
-    retrieve_list = ['BASIS_ENTHALPY', 'MESSAGES','time.json','aiida.out','aiida.xml','aiida.bands','*.ion.xml']
+    retrieve_list = ['BASIS_ENTHALPY', 'MESSAGES','time.json','aiida.out','aiida.xml','aiida.bands','*.ion.xml','aiida_monitor.json']
 
     assert sorted(calc_info.retrieve_list) == sorted(retrieve_list)
 
@@ -489,7 +615,7 @@ def test_lua(aiida_profile, fixture_sandbox, generate_calc_job,
             (lua_folder.uuid, list_lua_fold[1], list_lua_fold[1])
             ]
 
-    retrieve_list = ['BASIS_ENTHALPY', 'MESSAGES','time.json','aiida.out','aiida.xml','*.ion.xml','NEB.results']
+    retrieve_list = ['BASIS_ENTHALPY', 'MESSAGES','time.json','aiida.out','aiida.xml','*.ion.xml','aiida_monitor.json','NEB.results']
 
     assert sorted(calc_info.local_copy_list) == sorted(local_copy_list)
     assert sorted(calc_info.retrieve_list) == sorted(retrieve_list)
@@ -87,3 +87,86 @@ def test_get_orbitals(generate_ion_data):
     orbit_list = ion.get_orbitals()
     assert len(orbit_list) == 18
     assert isinstance(orbit_list[0],SislAtomicOrbital)
+
+
+def test_ion_header_reader():
+    """
+    Test that the single-pass reading gives the md5 and the data of the full parsing.
+    """
+    import os
+    from aiida.common.files import md5_file
+    from aiida_siesta.data.ion import parse_ion
+    from aiida_siesta.data.header_readers import read_md5_and_header, IonHeaderReader
+
+    filepath = os.path.abspath(os.path.join('tests', 'ions', 'SiDiff.ion.xml'))
+    with open(filepath, 'rb') as handle:
+        md5, reader = read_md5_and_header(handle, IonHeaderReader(), chunk_size=64)
+
+    assert md5 == md5_file(filepath)
+    assert reader.get_parsed_data(filepath) == parse_ion(filepath)
+
+
+def test_get_orbitals_info(generate_ion_data):
+    """
+    Test the extraction of the orbitals without sisl, they must match the ones of `get_orbitals`.
+    """
+    ion = generate_ion_data('Si')
+    orbitals_info = ion.get_orbitals_info()
+
+    assert len(orbitals_info) == 6
+    assert orbitals_info[0] == {"n": 3, "l": 0, "Z": 1, "P": False, "R": pytest.approx(3.156571116), "q0": 2.0}
+
+    shells = {(orb.attributes["n"], orb.attributes["l"], orb.attributes["Z"], orb.attributes["P"])
+              for orb in ion.get_orbitals()}
+    assert shells == {(orb["n"], orb["l"], orb["Z"], orb["P"]) for orb in orbitals_info}
+
+
+def test_get_radial_arrays(generate_ion_data):
+    """
+    Test that the radial arrays are parsed once, cached by md5 and not stored in the repository.
+    """
+    import numpy as np
+    from aiida_siesta.data import ion as ion_module
+
+    ion = generate_ion_data('Si')
+    parsed = ion.get_radial_arrays()
+
+    assert len(parsed["paos"]) == 6
+    assert len(parsed["kbs"]) == 6
+    assert parsed["paos"][0]["l"] == 0
+    assert parsed["paos"][0]["r"].shape == (parsed["paos"][0]["npts"],)
+    assert "vna" in parsed and "chlocal" in parsed
+    assert not parsed["vna"]["f"].flags.writeable
+    assert ion.md5 in ion_module._RADIAL_ARRAYS_CACHE  # pylint: disable=protected-access
+
+    ion.store()
+    assert ion.list_object_names() == [ion.filename]
+    cached = ion.get_radial_arrays()
+
+    for section in ("paos", "kbs"):
+        for item_parsed, item_cached in zip(parsed[section], cached[section]):
+            assert item_parsed["l"] == item_cached["l"]
+            assert np.allclose(item_parsed["r"], item_cached["r"])
+            assert np.allclose(item_parsed["f"], item_cached["f"])
+    assert np.allclose(parsed["vna"]["f"], cached["vna"]["f"])
+
+
+def test_ion_caches_bounded(generate_ion_data, monkeypatch):
+    """
+    Test that the process-level caches of the ion files keep at most `maxsize` items.
+    """
+    from collections import OrderedDict
+    from aiida_siesta.data import ion as ion_module
+
+    monkeypatch.setattr(ion_module, "_RADIAL_ARRAYS_CACHE", OrderedDict())
+    monkeypatch.setattr(ion_module, "_RADIAL_ARRAYS_CACHE_MAXSIZE", 1)
+
+    ion = generate_ion_data('Si')
+    ion.get_radial_arrays()
+    assert list(ion_module._RADIAL_ARRAYS_CACHE) == [ion.md5]  # pylint: disable=protected-access
+
+    calls = []
+    assert ion_module._get_cached(ion_module._RADIAL_ARRAYS_CACHE, 1, "other", lambda: calls.append(1) or 1) == 1
+    assert list(ion_module._RADIAL_ARRAYS_CACHE) == ["other"]  # pylint: disable=protected-access
+    assert ion_module._get_cached(ion_module._RADIAL_ARRAYS_CACHE, 1, "other", lambda: calls.append(1) or 1) == 1
+    assert len(calls) == 1
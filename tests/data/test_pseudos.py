@@ -1,3 +1,6 @@
+import pytest
+
+
 def test_pseudos_classmethods(generate_psf_data, generate_psml_data):
 
     from aiida_siesta.data.psml import PsmlData
@@ -22,3 +25,134 @@ def test_pseudo(generate_psf_data, generate_psml_data):
 
     #set_file
     #assert 'md5' in psf.attributes
+
+
+def test_get_pseudos_from_structure(generate_psml_fam, generate_psf_data, generate_structure):
+    """
+    Test the lookup of the pseudos of a family and that the memo is updated when the family changes.
+    """
+    from aiida.common.exceptions import MultipleObjectsError
+    from aiida.orm import Group
+    from aiida_siesta.data.common import get_pseudos_from_structure, get_family_pseudos
+
+    generate_psml_fam('lookup_fam', 'Si')
+    structure = generate_structure()
+
+    pseudos = get_pseudos_from_structure(structure, 'lookup_fam')
+    assert list(pseudos.keys()) == ['Si']
+    assert pseudos['Si'].element == 'Si'
+    assert get_pseudos_from_structure(structure, 'lookup_fam') == pseudos
+
+    family = Group.get(label='lookup_fam')
+    assert list(get_family_pseudos(family, ['O']).keys()) == []
+
+    psf = generate_psf_data('Si')
+    psf.store()
+    family.add_nodes([psf])
+    with pytest.raises(MultipleObjectsError):
+        get_pseudos_from_structure(structure, 'lookup_fam')
+
+
+def test_family_pseudos_memo_swap(generate_psml_data, generate_psf_data, generate_structure):
+    """
+    Test that the memo is updated when a node of the family is replaced by another one with a lower pk,
+    leaving unchanged the number of nodes and the largest pk.
+    """
+    from aiida import orm
+    from aiida.common.exceptions import MultipleObjectsError
+    from aiida_siesta.data.common import get_pseudos_from_structure
+
+    psf = generate_psf_data('Si')
+    psf.store()
+    extra = orm.Int(1).store()
+    psml = generate_psml_data('Si')
+    psml.store()
+
+    family, _ = orm.Group.objects.get_or_create('swap_fam')
+    family.add_nodes([extra, psml])
+    structure = generate_structure()
+    assert get_pseudos_from_structure(structure, 'swap_fam')['Si'].uuid == psml.uuid
+
+    family.remove_nodes([extra])
+    family.add_nodes([psf])
+    with pytest.raises(MultipleObjectsError):
+        get_pseudos_from_structure(structure, 'swap_fam')
+
+
+def test_upload_psf_family(clear_database_before_test, tmp_path, monkeypatch):  # pylint: disable=unused-argument
+    """
+    Test the upload of a family: files with the same md5 are stored once,
+    the pseudos already in the database are reused and the new files are not read again when stored.
+    """
+    import os
+    import shutil
+    from aiida.common.files import md5_file
+    from aiida.orm import Group
+    from aiida_siesta.data.psf import PsfData, upload_psf_family
+
+    def _read_again(self):
+        raise AssertionError(f"{self.filename} read again in `store`")
+
+    monkeypatch.setattr(PsfData, '_get_md5_and_parsed_data', _read_again)
+
+    for element in ['C', 'O']:
+        shutil.copy(os.path.join('tests', 'pseudos', f'{element}.psf'), str(tmp_path))
+    shutil.copy(os.path.join('tests', 'pseudos', 'C.psf'), str(tmp_path / 'C_copy.psf'))
+
+    progress = []
+    nfiles, nuploaded = upload_psf_family(
+        str(tmp_path), 'upload_fam', 'desc', progress_callback=lambda done, total: progress.append((done, total))
+    )
+    assert (nfiles, nuploaded) == (3, 2)
+    assert progress[-1] == (3, 3)
+    assert Group.get(label='upload_fam').count() == 2
+    for node in Group.get(label='upload_fam').nodes:
+        assert node.element == node.filename[0]
+        assert node.md5sum == md5_file(os.path.join('tests', 'pseudos', f'{node.element}.psf'))
+
+    nfiles, nuploaded = upload_psf_family(str(tmp_path), 'upload_fam_bis', 'desc', stop_if_existing=False)
+    assert (nfiles, nuploaded) == (3, 0)
+
+
+def test_from_parsed_file(clear_database_before_test, monkeypatch):  # pylint: disable=unused-argument
+    """
+    Test that a pseudo created from the md5 and the parsed data of its file is stored without reading the file.
+    """
+    import os
+    from aiida.common.files import md5_file
+    from aiida_siesta.data.psml import PsmlData, parse_psml
+
+    def _read_again(self):
+        raise AssertionError(f"{self.filename} read again in `store`")
+
+    filepath = os.path.abspath(os.path.join('tests', 'pseudos', 'Si.psml'))
+    pseudo = PsmlData.from_parsed_file(filepath, md5_file(filepath), parse_psml(filepath))
+    monkeypatch.setattr(PsmlData, '_get_md5_and_parsed_data', _read_again)
+    pseudo.store()
+
+    assert pseudo.element == 'Si'
+    assert pseudo.md5sum == md5_file(filepath)
+
+
+@pytest.mark.parametrize('filename, reader_name, parse_function_path', [
+    ('Si.psf', 'PsfHeaderReader', 'aiida_siesta.data.psf.parse_psf'),
+    ('Si.psml', 'PsmlHeaderReader', 'aiida_siesta.data.psml.parse_psml'),
+])
+def test_header_readers(filename, reader_name, parse_function_path):
+    """
+    Test that the single-pass reading gives the md5 and the data of the full parsing.
+    """
+    import os
+    from importlib import import_module
+    from aiida.common.files import md5_file
+    from aiida_siesta.data import header_readers
+
+    filepath = os.path.abspath(os.path.join('tests', 'pseudos', filename))
+    module_name, function_name = parse_function_path.rsplit('.', 1)
+    parse_function = getattr(import_module(module_name), function_name)
+
+    with open(filepath, 'rb') as handle:
+        md5, reader = header_readers.read_md5_and_header(handle, getattr(header_readers, reader_name)(), chunk_size=64)
+
+    assert md5 == md5_file(filepath)
+    assert reader.get_parsed_data(filepath) == parse_function(filepath)
@@ -225,6 +225,47 @@ def test_siesta_no_scf_conv(aiida_profile, fixture_localhost, generate_calc_job_
 
 
 
+@pytest.mark.parametrize('non_scf_bands', [True, False])
+def test_siesta_bands_no_scf_conv(aiida_profile, fixture_localhost, generate_calc_job_node,
+    generate_parser, generate_structure, non_scf_bands):
+    """
+    Test a calculation of the bands whose single scf step did not converge (`scf-must-converge F`,
+    therefore Siesta only issues a warning). With the `NON_SCF_BANDS` setting the bands are parsed and
+    the calculation is successful, otherwise SCF_NOT_CONV is returned.
+    """
+
+    name = 'bands_no_scf_conv'
+    entry_point_calc_job = 'siesta.siesta'
+    entry_point_parser = 'siesta.parser'
+
+    structure=generate_structure()
+    bandskpoints = orm.KpointsData()
+    kpp = [(0.500,  0.250, 0.750), (0.500,  0.500, 0.500), (0., 0., 0.)]
+    bandskpoints.set_cell(structure.cell, structure.pbc)
+    bandskpoints.set_kpoints(kpp)
+
+    inputs = AttributeDict({
+        'structure': structure,
+        'bandskpoints': bandskpoints,
+        'settings': orm.Dict(dict={'non_scf_bands': non_scf_bands})
+    })
+
+    attributes=AttributeDict({'input_filename':'aiida.fdf', 'output_filename':'aiida.out', 'prefix':'aiida'})
+
+    node = generate_calc_job_node(entry_point_calc_job, fixture_localhost, name, inputs, attributes)
+    parser = generate_parser(entry_point_parser)
+    results, calcfunction = parser.parse_from_node(node, store_provenance=False)
+
+    assert calcfunction.is_finished
+    assert calcfunction.exception is None
+    if non_scf_bands:
+        assert calcfunction.is_finished_ok
+        assert 'bands' in results
+    else:
+        assert calcfunction.exit_message == 'Calculation did not reach scf convergence!'
+        assert 'bands' not in results
+
+
 def test_siesta_no_geom_conv(aiida_profile, fixture_localhost, generate_calc_job_node,
     generate_parser, generate_structure, data_regression):
     """
@@ -303,3 +344,130 @@ def test_siesta_bands_error(aiida_profile, fixture_localhost, generate_calc_job_
     assert calcfunction.exit_message == 'Failure while parsing the bands file'
     assert 'output_parameters' in results
     assert 'output_structure' in results
+
+
+def test_siesta_walltime(aiida_profile, fixture_localhost, generate_calc_job_node,
+    generate_parser, generate_structure):
+    """
+    Test a parser in the situation when siesta is stopped because the walltime is reached in the middle
+    of a relaxation. The xml file is truncated, the MESSAGES file signals the walltime problem and
+    the geometry for the restart is read from the .XV file, retrieved in the temporary folder.
+    """
+    import os
+
+    name = 'walltime'
+    entry_point_calc_job = 'siesta.siesta'
+    entry_point_parser = 'siesta.parser'
+
+    structure=generate_structure()
+
+    inputs = AttributeDict({
+        'structure': structure
+    })
+
+    attributes=AttributeDict({'input_filename':'aiida.fdf', 'output_filename':'aiida.out', 'prefix':'aiida'})
+
+    node = generate_calc_job_node(entry_point_calc_job, fixture_localhost, name, inputs, attributes)
+    parser = generate_parser(entry_point_parser)
+    temporary_folder = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'siesta', 'walltime_temporary'
+    )
+    results, calcfunction = parser.parse_from_node(
+        node, store_provenance=False, retrieved_temporary_folder=temporary_folder
+    )
+
+    assert calcfunction.is_finished
+    assert calcfunction.exception is None
+    assert not calcfunction.is_finished_ok
+    assert calcfunction.exit_status == 447
+    assert 'output_parameters' in results
+    assert results['output_parameters']['walltime_exceeded']
+    assert results['output_parameters']['last_md_step'] == 2
+    assert 'output_structure' in results
+    assert abs(results['output_structure'].sites[0].position[0] - 0.00529177210903) < 1e-8
+
+
+def test_siesta_monitor_killed(aiida_profile, fixture_localhost, generate_calc_job_node,
+    generate_parser, generate_structure):
+    """
+    Test a parser in the situation when the calculation was killed by the monitor because the scf
+    was diverging. No xml file is present, the reason is read from the file written by the monitor.
+    """
+
+    name = 'monitor_killed'
+    entry_point_calc_job = 'siesta.siesta'
+    entry_point_parser = 'siesta.parser'
+
+    inputs = AttributeDict({
+        'structure': generate_structure()
+    })
+
+    attributes=AttributeDict({'input_filename':'aiida.fdf', 'output_filename':'aiida.out', 'prefix':'aiida'})
+
+    node = generate_calc_job_node(entry_point_calc_job, fixture_localhost, name, inputs, attributes)
+    parser = generate_parser(entry_point_parser)
+    results, calcfunction = parser.parse_from_node(node, store_provenance=False)
+
+    assert calcfunction.is_finished
+    assert not calcfunction.is_finished_ok
+    assert calcfunction.exit_status == 446
+    assert results['output_parameters']['monitor_kill_reason'] == 'diverging'
+    assert len(results['output_parameters']['monitor_scf_history']) == 4
+
+
+def test_siesta_md_trajectory(aiida_profile, fixture_localhost, generate_calc_job_node,
+    generate_parser, generate_structure):
+    """
+    Test the parsing of the trajectory of an MD run stopped by the walltime. The .ANI and .MDE
+    files are in the temporary folder and their last (incomplete) frame and line are discarded.
+    """
+    import os
+
+    name = 'walltime'
+    entry_point_calc_job = 'siesta.siesta'
+    entry_point_parser = 'siesta.parser'
+
+    inputs = AttributeDict({
+        'structure': generate_structure()
+    })
+
+    attributes=AttributeDict({'input_filename':'aiida.fdf', 'output_filename':'aiida.out', 'prefix':'aiida'})
+
+    node = generate_calc_job_node(entry_point_calc_job, fixture_localhost, name, inputs, attributes)
+    parser = generate_parser(entry_point_parser)
+    temporary_folder = os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'siesta', 'walltime_md_temporary'
+    )
+    results, calcfunction = parser.parse_from_node(
+        node, store_provenance=False, retrieved_temporary_folder=temporary_folder
+    )
+
+    assert calcfunction.exit_status == 447
+    assert 'output_trajectory' in results
+    trajectory = results['output_trajectory']
+    assert list(trajectory.get_stepids()) == [1, 2]
+    assert trajectory.get_positions().shape == (2, 2, 3)
+    assert abs(trajectory.get_positions()[1][0][0] - 0.00264589) < 1e-8
+    assert list(trajectory.get_array('temperatures')) == [300.0, 295.512]
+
+
+def test_is_walltime_problem(tmp_path):
+    """
+    Test that only the message of Siesta at the beginning of a line signals the walltime problem,
+    not the keyword, comments or other text in the echo of the input.
+    """
+    from aiida_siesta.parsers.siesta import is_walltime_problem
+
+    out_file = tmp_path / 'aiida.out'
+    out_file.write_text(
+        "************************** Dump of input data file ****************************\n"
+        "# Stop before the wall-clock time is exceeded\n"
+        "Max walltime reached\n"
+        "************************** End of input data file *****************************\n"
+        "siesta: the wall time is up to the user\n"
+    )
+    assert not is_walltime_problem(str(out_file))
+
+    with open(str(out_file), 'a') as handle:
+        handle.write("INFO: Max. wall-clock time reached. Stopping gracefully\n")
+    assert is_walltime_problem(str(out_file))
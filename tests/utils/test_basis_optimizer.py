@@ -0,0 +1,45 @@
+import numpy as np
+
+
+def test_diagonal_evolution_strategy():
+    """
+    Test that the optimizer finds the minimum of a quadratic function, saving and restoring
+    its state at each generation like in the WorkChain.
+    """
+    from aiida_siesta.utils.basis_optimizer import DiagonalEvolutionStrategy
+
+    target = np.array([1.2, 0.9, 1.1])
+
+    def function(x):
+        return float(((x - target)**2).sum())
+
+    optimizer = DiagonalEvolutionStrategy(3, ftol=1e-5, seed=1)
+    optimizer.set_reference(function(np.ones(3)))
+    while not optimizer.converged and optimizer.generation < 50:
+        samples = optimizer.ask(8)
+        assert samples.shape == (8, 3)
+        assert np.all((samples >= 0.7) & (samples <= 1.5))
+        optimizer.tell(samples, [function(x) for x in samples])
+        optimizer = DiagonalEvolutionStrategy.from_dict(optimizer.to_dict())
+
+    assert optimizer.converged
+    assert np.allclose(optimizer.best_x, target, atol=0.02)
+    assert optimizer.history == sorted(optimizer.history, reverse=True)
+
+
+def test_failed_candidates():
+    """
+    Test that failed candidates are ignored, and an error is raised if all of them failed.
+    """
+    import pytest
+    from aiida_siesta.utils.basis_optimizer import DiagonalEvolutionStrategy
+
+    optimizer = DiagonalEvolutionStrategy(2)
+    optimizer.set_reference(1.0)
+    samples = optimizer.ask(3)
+    optimizer.tell(samples, [None, 0.5, float('nan')])
+    assert optimizer.best_value == 0.5
+    assert np.allclose(optimizer.best_x, samples[1])
+
+    with pytest.raises(ValueError):
+        optimizer.tell(optimizer.ask(2), [None, None])
@@ -0,0 +1,44 @@
+import pytest
+
+
+def test_analyse_benchmark():
+    """
+    Test the speedup and efficiency and the choice of the recommended configuration.
+    """
+    from aiida_siesta.utils.benchmark import analyse_benchmark
+
+    configurations = [
+        {"resources": {"num_machines": 1, "num_mpiprocs_per_machine": 8}, "parallel_options": {}, "global_time": 400.},
+        {"resources": {"num_machines": 2, "num_mpiprocs_per_machine": 8}, "parallel_options": {}, "global_time": 220.},
+        {"resources": {"num_machines": 4, "num_mpiprocs_per_machine": 8}, "parallel_options": {}, "global_time": 150.},
+        {"resources": {"num_machines": 8, "num_mpiprocs_per_machine": 8}, "parallel_options": {}, "global_time": None},
+        {
+            "resources": {"num_machines": 1, "num_mpiprocs_per_machine": 4, "num_cores_per_mpiproc": 2},
+            "parallel_options": {"diag-paralleloverk": True},
+            "global_time": 380.
+        },
+    ]
+
+    analysis = analyse_benchmark(configurations, min_efficiency=0.7)
+    table = analysis["table"]
+
+    # The reference is the fastest of the two configurations with 8 cores
+    assert [row["cores"] for row in table] == [8, 16, 32, 64, 8]
+    assert table[4]["speedup"] == 1.
+    assert table[1]["speedup"] == pytest.approx(380. / 220.)
+    assert table[2]["efficiency"] == pytest.approx(380. / 150. / 4.)
+    assert table[3]["efficiency"] is None
+    # 4 machines have efficiency 0.63, the recommended layout is on 2 machines
+    assert analysis["recommended"] == 1
+
+    assert analyse_benchmark(configurations, min_efficiency=0.5)["recommended"] == 2
+
+
+def test_analyse_benchmark_failed():
+    """
+    Test that an error is raised if no configuration finished.
+    """
+    from aiida_siesta.utils.benchmark import analyse_benchmark
+
+    with pytest.raises(ValueError):
+        analyse_benchmark([{"resources": {}, "parallel_options": {}, "global_time": None}])
@@ -0,0 +1,61 @@
+from aiida import orm
+from aiida.plugins import WorkflowFactory
+
+
+def test_campaign(aiida_profile, fixture_code, generate_structure, generate_psml_fam):
+    """
+    Test the `SubmissionCampaign`: the builders are created only for the free slots
+    and the structures already in the campaign group, or submitted by the campaign, are skipped.
+    """
+    from aiida_siesta.utils.campaign import SubmissionCampaign, CAMPAIGN_EXTRA_KEY
+
+    generate_psml_fam("nc-sr-04_pbe_standard_psml", "Si")
+
+    structures = orm.Group(label="campaign_structures").store()
+    for scale in [1.0, 1.01, 1.02]:
+        structures.add_nodes([generate_structure(scale).store()])
+
+    code = fixture_code("siesta.siesta")
+    code.store()
+    calc_engines = {
+        "siesta": {
+            'code': code.uuid,
+            'options': {
+                "resources": {
+                    "num_mpiprocs_per_machine": 1
+                },
+                "max_wallclock_seconds": 360
+            }
+        }
+    }
+
+    campaign = SubmissionCampaign(
+        WorkflowFactory("siesta.base"), "campaign_structures", "campaign", calc_engines, "standard_psml",
+        max_active=2, num_workers=1
+    )
+
+    builders = campaign.submit_new_batch(dry_run=True)
+    assert len(builders) == 2
+    assert "parameters" in list(builders.values())[0]
+
+    #Simulate a finished process for the first structure
+    done = orm.WorkflowNode()
+    done.set_extra(CAMPAIGN_EXTRA_KEY, structures.nodes[0].uuid)
+    done.store()
+    campaign._campaign_group.add_nodes([done])  #pylint: disable=protected-access
+
+    assert len(campaign.get_pending_structures()) == 2
+    assert campaign.get_status()["submitted"] == 1
+
+    #Simulate a process submitted but not added to the group, as after an interruption
+    from aiida.common.links import LinkType
+    from aiida_siesta.utils.campaign import CAMPAIGN_LABEL_PREFIX, get_campaign_status
+
+    pending = campaign.get_pending_structures()
+    orphan = orm.WorkflowNode(label=CAMPAIGN_LABEL_PREFIX + "campaign")
+    orphan.add_incoming(pending[0], link_type=LinkType.INPUT_WORK, link_label="structure")
+    orphan.store()
+
+    assert [structure.uuid for structure in campaign.get_pending_structures()] == [pending[1].uuid]
+    assert orm.load_node(orphan.pk).get_extra(CAMPAIGN_EXTRA_KEY) == pending[0].uuid
+    assert get_campaign_status(structures, orm.load_group("campaign"))["submitted"] == 2
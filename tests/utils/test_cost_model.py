@@ -0,0 +1,93 @@
+import numpy as np
+
+
+def _get_synthetic_data(num_points=30):
+    """
+    Walltime and memory following exact power laws of the features.
+    """
+    from aiida_siesta.utils.cost_model import FEATURES
+
+    rng = np.random.RandomState(42)
+    data = {feature: np.exp(rng.uniform(0., 6., num_points)) for feature in FEATURES}
+    data["ranks"] = 2.**rng.randint(0, 7, num_points)
+    data["walltime"] = 0.1 * data["no_u"]**1.5 * data["kpoints"] / data["ranks"]**0.8
+    data["memory"] = 2. * data["nnz"]**0.5 * data["mesh_points"]**0.2 / data["ranks"]**0.5
+
+    return data
+
+
+def test_cost_model_fit():
+    """
+    Test that the power laws are recovered by the fit and that the model is serializable.
+    """
+    from aiida_siesta.utils.cost_model import CostModel
+
+    data = _get_synthetic_data()
+    model = CostModel.fit(data, regularization=0.)
+
+    features = {"no_u": 100., "nnz": 1.e4, "mesh_points": 1.e3, "kpoints": 8., "ranks": 4.}
+    expected_walltime = 0.1 * 100.**1.5 * 8. / 4.**0.8
+    expected_memory = 2. * 1.e4**0.5 * 1.e3**0.2 / 4.**0.5
+    assert np.isclose(model.predict_walltime(features, confidence=0.), expected_walltime)
+    assert np.isclose(model.predict_memory(features, confidence=0.), expected_memory)
+
+    new_model = CostModel.from_dict(model.to_dict())
+    assert np.isclose(new_model.predict_walltime(features), model.predict_walltime(features))
+
+
+def test_cost_model_suggest_options():
+    """
+    Test the choice of the number of machines.
+    """
+    from aiida_siesta.utils.cost_model import CostModel
+
+    model = CostModel.fit(_get_synthetic_data(), regularization=0.)
+    features = {"no_u": 1000., "nnz": 1.e4, "mesh_points": 1.e3, "kpoints": 8., "ranks": 1.}
+    settings = {"num_mpiprocs_per_machine": 4, "max_num_machines": 10, "target_walltime": 2000}
+
+    options = model.suggest_options(features, settings)
+
+    # The walltime on 4 machines is 0.1 * 1000**1.5 * 8 / 16**0.8 = 2753 s, on 5 machines 2303 s
+    # and on 6 machines 1990 s
+    assert options["resources"] == {"num_machines": 6, "num_mpiprocs_per_machine": 4}
+    assert abs(options["max_wallclock_seconds"] - 1.5 * 1990) < 10
+
+
+def test_cost_model_not_enough_data():
+    """
+    Test that the fit fails with too few calculations.
+    """
+    import pytest
+    from aiida_siesta.utils.cost_model import CostModel
+
+    with pytest.raises(ValueError):
+        CostModel.fit(_get_synthetic_data(3))
+
+
+def test_get_cost_model_cache(monkeypatch):
+    """
+    Test that the cached model is fitted again only when the watermark of the data changes
+    and the cached model is older than the time to live.
+    """
+    from aiida_siesta.utils import cost_model
+
+    fits = []
+
+    def _collect(computer):
+        fits.append(computer)
+        return _get_synthetic_data()
+
+    watermark = [(30, 100)]
+    monkeypatch.setattr(cost_model, 'collect_cost_data', _collect)
+    monkeypatch.setattr(cost_model, 'get_cost_data_watermark', lambda computer: watermark[0])
+    cost_model.clear_cost_models_cache()
+
+    model = cost_model.get_cost_model()
+    assert cost_model.get_cost_model(ttl=0) is model
+    watermark[0] = (31, 101)
+    assert cost_model.get_cost_model(ttl=3600) is model
+    assert len(fits) == 1
+    assert cost_model.get_cost_model(ttl=0) is not model
+    assert len(fits) == 2
+
+    cost_model.clear_cost_models_cache()
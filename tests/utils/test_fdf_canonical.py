@@ -0,0 +1,35 @@
+def test_get_canonical_fdf_dict():
+    """
+    Test that equivalent dictionaries of fdf keywords have the same canonical form
+    and that different ones are distinguished.
+    """
+    from aiida_siesta.utils.fdf_canonical import get_canonical_fdf_dict
+
+    param1 = {
+        "MeshCutoff": "200 Ry",
+        "WriteForces": "T",
+        "MD.TypeOfRun": "CG",
+        "DM.Tolerance": "1.d-4",
+        "ElectronicTemperature": "300 K",
+        "%block PAO.Basis": "Si 2\n n=3  0 2\n"
+    }
+    param2 = {
+        "mesh-cutoff": "2721.1386245988 eV",
+        "write-forces": True,
+        "md-type-of-run": "CG",
+        "dm-tolerance": 0.0001,
+        "electronic-temperature": "0.025851999786 eV",
+        "%block pao-basis": "Si 2\n n=3 0 2"
+    }
+    assert get_canonical_fdf_dict(param1) == get_canonical_fdf_dict(param2)
+
+    param2["write-forces"] = ".false."
+    assert get_canonical_fdf_dict(param1) != get_canonical_fdf_dict(param2)
+
+    #The values of the enumeration keywords are case insensitive, the other strings are case sensitive
+    param2["write-forces"] = True
+    param2["md-type-of-run"] = "cg"
+    assert get_canonical_fdf_dict(param1) == get_canonical_fdf_dict(param2)
+    assert get_canonical_fdf_dict({"SolutionMethod": "diagon"}) == get_canonical_fdf_dict({"solution-method": "Diagon"})
+    assert get_canonical_fdf_dict({"dm-file": "Si.DM"}) != get_canonical_fdf_dict({"dm-file": "si.dm"})
+    assert get_canonical_fdf_dict({"SystemLabel": "Si"}) != get_canonical_fdf_dict({"SystemLabel": "si"})
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+
+def test_num_spin_components():
+    """
+    Test the number of spin components from the `spin` keyword and from the old flags.
+    """
+    from aiida_siesta.utils.footprint import get_num_spin_components
+
+    assert get_num_spin_components({}) == 1
+    assert get_num_spin_components({"spin": "polarized"}) == 2
+    assert get_num_spin_components({"Spin": "non-colinear"}) == 4
+    assert get_num_spin_components({"spin": "SO"}) == 8
+    assert get_num_spin_components({"spin-polarized": True}) == 2
+
+
+def test_get_footprint():
+    """
+    Test the memory of the arrays and their scaling with the ranks, the spin and the solver.
+    """
+    from aiida_siesta.utils.footprint import get_footprint
+
+    features = {"no_u": 1024, "nnz": 2**20, "mesh_points": 2**20, "kpoints": 1, "ranks": 1}
+    memory = get_footprint(features, mixing_history=0)
+
+    # H, DM, EDM, S in double precision plus the integer index, 8 single precision grid arrays,
+    # 3 dense real matrices
+    assert np.isclose(memory["sparse"], 36.)
+    assert np.isclose(memory["grid"], 32.)
+    assert np.isclose(memory["dense"], 24.)
+    assert np.isclose(memory["total"], 100. + 36. + 32. + 24.)
+
+    memory_ranks = get_footprint(dict(features, ranks=4), mixing_history=0)
+    assert np.isclose(memory_ranks["total"] - 100., (memory["total"] - 100.) / 4)
+
+    assert get_footprint(features, solver="ordern")["dense"] == 0.
+    # Non-collinear spin: complex matrices of double size
+    assert np.isclose(get_footprint(features, num_spin=4)["dense"], 8 * memory["dense"])
+
+
+def test_estimate_footprint(generate_structure, generate_kpoints_mesh):
+    """
+    Test the estimate from the inputs, the scratch and the calibration factor.
+    """
+    from aiida_siesta.utils.footprint import estimate_footprint
+
+    structure = generate_structure()
+    parameters = {"mesh-cutoff": "200 Ry"}
+    footprint = estimate_footprint(structure, parameters, kpoints=generate_kpoints_mesh(4), calibration=1.)
+
+    # Two Si atoms with a DZP basis
+    assert footprint["no_u"] == 26
+    assert footprint["memory"] == footprint["memory_per_rank"]
+
+    saving = estimate_footprint(structure, dict(parameters, **{"save-hs": True, "save-rho": True}), calibration=1.)
+    assert saving["scratch"] > footprint["scratch"]
+
+    calibrated = estimate_footprint(structure, parameters, kpoints=generate_kpoints_mesh(4), calibration=2.)
+    assert np.isclose(calibrated["memory_per_rank"] - 100., 2 * (footprint["memory_per_rank"] - 100.))
+
+
+def test_fit_memory_calibration():
+    """
+    Test that the calibration factor is recovered from data following the estimate.
+    """
+    from aiida_siesta.utils.footprint import fit_memory_calibration, get_footprint
+
+    rng = np.random.RandomState(42)
+    data = {
+        "no_u": rng.uniform(100, 5000, 10),
+        "nnz": rng.uniform(1.e5, 1.e8, 10),
+        "mesh_points": rng.uniform(1.e5, 1.e7, 10),
+        "kpoints": rng.randint(1, 10, 10).astype(float),
+        "ranks": 2.**rng.randint(0, 6, 10),
+    }
+    data["memory"] = np.array([
+        get_footprint({key: data[key][index] for key in data}, calibration=1.7)["total"] for index in range(10)
+    ])
+    data["memory"][0] = np.nan
+
+    assert np.isclose(fit_memory_calibration(data), 1.7)
+
+    with pytest.raises(ValueError):
+        fit_memory_calibration({key: value[:3] for key, value in data.items()})
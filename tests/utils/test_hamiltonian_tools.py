@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("orthogonal", [True, False])
+@pytest.mark.parametrize("spin", ["unpolarized", "polarized"])
+def test_get_eigenvalues(orthogonal, spin):
+    """
+    Test that the batched diagonalization of `get_eigenvalues` gives the
+    same eigenvalues of the sisl `eigh`.
+    """
+    import sisl
+    from aiida_siesta.utils.hamiltonian_tools import get_eigenvalues
+
+    geom = sisl.geom.graphene()
+    ham = sisl.Hamiltonian(geom, orthogonal=orthogonal, spin=spin)
+    nspin = 2 if spin == "polarized" else 1
+    for atom in geom:
+        onsite, first_neigh = geom.close(atom, R=(0.1, 1.44))
+        if orthogonal:
+            ham[atom, onsite] = [0.1 * ispin for ispin in range(nspin)]
+            ham[atom, first_neigh] = [-2.7 + 0.1 * ispin for ispin in range(nspin)]
+        else:
+            ham[atom, onsite] = [0.1 * ispin for ispin in range(nspin)] + [1.]
+            ham[atom, first_neigh] = [-2.7 + 0.1 * ispin for ispin in range(nspin)] + [0.2]
+
+    kpoints = np.array([[0., 0., 0.], [0.5, 0., 0.], [1. / 3., 2. / 3., 0.], [0.1, 0.2, 0.], [0.3, 0.1, 0.]])
+
+    eigenvalues = get_eigenvalues(ham, kpoints, batch_size=2)
+
+    if spin == "polarized":
+        reference = np.array([[ham.eigh(k=kpoint, spin=ispin) for kpoint in kpoints] for ispin in range(2)])
+    else:
+        reference = np.array([ham.eigh(k=kpoint) for kpoint in kpoints])
+
+    assert eigenvalues.shape == reference.shape
+    assert np.allclose(eigenvalues, reference)
+
+
+def test_memory_bounds():
+    """
+    Test that the batches of kpoints are limited by the memory and that the DOS
+    summed in chunks of eigenvalues is the same as the one summed at once.
+    """
+    from aiida_siesta.utils.hamiltonian_tools import get_batch_size, get_gaussian_dos
+
+    assert get_batch_size(10, nspin=1, max_memory=256.) == 64
+    assert get_batch_size(4000, nspin=2, max_memory=256.) == 1
+    assert get_batch_size(200, nspin=1, max_memory=10.) == 3
+
+    energies = np.linspace(-1., 1., 50)
+    eigenvalues = np.linspace(-0.8, 0.9, 21).reshape(3, 7)
+    smearing = 0.1
+    reference = np.exp(-((energies[:, np.newaxis] - eigenvalues.ravel()[np.newaxis, :]) / smearing)**2).sum(axis=1)
+    reference /= smearing * np.sqrt(np.pi) * 3
+
+    assert np.allclose(get_gaussian_dos(energies, eigenvalues, smearing, 3, max_elements=60), reference)
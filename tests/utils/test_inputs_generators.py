@@ -56,6 +56,26 @@ def test_eosworkchain_inpgen(aiida_profile, fixture_code, generate_structure):
 
     assert "parameters" in build
 
+def test_multifidelityrelax_inpgen(aiida_profile, fixture_code, generate_structure):
+    """Test the `MultiFidelityRelaxWorkChainInputGenerator`, the stages come from the protocol."""
+
+    import pytest
+    from aiida_siesta.utils.protocols_system.input_generators import MultiFidelityRelaxWorkChainInputGenerator
+
+    inp_gen = MultiFidelityRelaxWorkChainInputGenerator(WorkflowFactory("siesta.multi_fidelity_relax"))
+    structure = generate_structure()
+    protocol = inp_gen.get_default_protocol_name()
+    code = fixture_code("siesta.siesta")
+    code.store()
+    calc_engines = {"siesta": {'code': code.uuid, 'options': {"resources": {"num_mpiprocs_per_machine": 1}, "max_wallclock_seconds": 360}}}
+
+    with pytest.raises(RuntimeError):
+        inp_gen.get_filled_builder(structure, calc_engines, protocol)
+
+    build = inp_gen.get_filled_builder(structure, calc_engines, protocol, relaxation_type="atoms_only")
+
+    assert build.stages.get_list() == inp_gen.get_protocol(protocol)["relax_stages"]
+
 def test_stmworkchain_inpgen(aiida_profile, fixture_code, generate_structure):
     """Test the validation of subclasses of `InputsGenerator`."""
 
@@ -75,3 +95,67 @@ def test_stmworkchain_inpgen(aiida_profile, fixture_code, generate_structure):
     build = inp_gen.get_filled_builder(structure, calc_engines, protocol, stm_mode="constant-height", stm_value=2)
 
     assert "parameters" in build
+
+
+def test_get_filled_builders(aiida_profile, fixture_code, generate_structure):
+    """Test the generation of builders for many structures, with the seekpath results memoized."""
+
+    from aiida_siesta.utils.protocols_system import input_generators
+    from aiida_siesta.utils.protocols_system.input_generators import BaseWorkChainInputGenerator
+
+    inp_gen = BaseWorkChainInputGenerator(WorkflowFactory("siesta.base"))
+    structures = [generate_structure(), generate_structure(1.01), generate_structure()]
+    protocol = inp_gen.get_default_protocol_name()
+    code = fixture_code("siesta.siesta")
+    code.store()
+    calc_engines = {"siesta": {'code': code.uuid, 'options': {"resources": {"num_mpiprocs_per_machine": 1}, "max_wallclock_seconds": 360}}}
+
+    builders = list(inp_gen.get_filled_builders(structures, calc_engines, protocol, chunk_size=2, bands_path_generator="seekpath"))
+
+    assert len(builders) == 3
+    assert all("bandskpoints" in build for build in builders)
+    assert structures[0].get_hash() in input_generators._SEEKPATH_CACHE
+    assert builders[0].code.uuid == builders[2].code.uuid
+
+
+def test_get_inputs_dict_many_single_pool(aiida_profile, fixture_code, generate_structure, monkeypatch):
+    """Test that a single pool of processes is created for all the chunks and used only for seekpath."""
+
+    import concurrent.futures
+    from aiida_siesta.utils.protocols_system import input_generators
+    from aiida_siesta.utils.protocols_system.input_generators import BaseWorkChainInputGenerator
+
+    pools = []
+
+    class SerialPool:
+        """A pool running the tasks in this process, recording the mapped functions."""
+
+        def __init__(self, max_workers):
+            self.max_workers = max_workers
+            self.mapped = []
+            self.closed = False
+            pools.append(self)
+
+        def shutdown(self):
+            self.closed = True
+
+        def map(self, function, iterable):
+            self.mapped.append(function)
+            return map(function, iterable)
+
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", SerialPool)
+    input_generators._SEEKPATH_CACHE.clear()
+
+    inp_gen = BaseWorkChainInputGenerator(WorkflowFactory("siesta.base"))
+    structures = [generate_structure(scale) for scale in (1.0, 1.01, 1.02, 1.03)]
+    protocol = inp_gen.get_default_protocol_name()
+    code = fixture_code("siesta.siesta")
+    code.store()
+    calc_engines = {"siesta": {'code': code.uuid, 'options': {"resources": {"num_mpiprocs_per_machine": 1}, "max_wallclock_seconds": 360}}}
+
+    inputs = list(inp_gen.get_inputs_dict_many(structures, calc_engines, protocol, num_workers=2, chunk_size=2, bands_path_generator="seekpath"))
+
+    assert len(inputs) == 4
+    assert len(pools) == 1
+    assert pools[0].mapped == [input_generators._run_seekpath] * 2
+    assert pools[0].closed
@@ -0,0 +1,54 @@
+import pytest
+
+
+@pytest.mark.parametrize(
+    "history, expected", [
+        ([1., 0.5, 0.2, 0.1, 0.05, 0.02, 0.01, 0.005, 0.002, 0.001], None),
+        ([1., 0.5, 0.2, 0.1, 0.05, 0.02, 0.01, 0.005, 0.002, 0.5], "diverging"),
+        ([1., 0.5, 0.2, 0.1, 0.05, 5.], None),
+        ([0.1, 0.01] * 15, "oscillating"),
+    ]
+)
+def test_check_scf_history(history, expected):
+    """
+    Test the divergence and stagnation rules, and that no decision is taken on short histories.
+    """
+    from aiida_siesta.utils.monitor import check_scf_history
+
+    assert check_scf_history(history) == expected
+
+
+def test_scf_monitor_incremental(tmp_path):
+    """
+    Test that the monitor reads only the new part of the output at each poll, keeping
+    the incomplete lines for the next poll.
+    """
+    import subprocess
+    from aiida_siesta.utils.monitor import ScfMonitor
+
+    class Transport:
+        """Minimal local transport, recording the commands."""
+
+        def __init__(self):
+            self.commands = []
+
+        def exec_command_wait(self, command):
+            self.commands.append(command)
+            proc = subprocess.run(command, shell=True, capture_output=True, text=True, check=False)
+            return proc.returncode, proc.stdout, proc.stderr
+
+    transport = Transport()
+    output = tmp_path / 'aiida.out'
+    line = "   scf:    {}     -216.235421     -215.245073     -215.245073  {} -3.827264  0.171510\n"
+    output.write_text(line.format(1, 1.0) + line.format(2, 0.5)[:30])
+
+    monitor = ScfMonitor({"min_iterations": 2, "divergence_factor": 10.})
+    assert monitor.poll(transport, str(tmp_path), 'aiida.out') is None
+    assert monitor.history == [1.0]
+
+    with open(output, 'a') as handle:
+        handle.write(line.format(2, 0.5)[30:] + line.format(3, 20.0))
+    monitor = ScfMonitor(monitor.settings, monitor.to_dict())
+    assert monitor.poll(transport, str(tmp_path), 'aiida.out') == "diverging"
+    assert monitor.history == [1.0, 0.5, 20.0]
+    assert "tail -c +{}".format(len(line.format(1, 1.0)) + 31) in transport.commands[-1]
@@ -1,5 +1,5 @@
 import pytest
-from aiida_siesta.utils.pao_manager import PaoManager
+from aiida_siesta.utils.pao_manager import PaoManager, PaoBasisSet, PAO_DTYPE
 
 def test_set_from_ion(generate_ion_data):
 
@@ -11,7 +11,7 @@ def test_set_from_ion(generate_ion_data):
 
     assert pao_man.name == "Si"
     assert pao_man._gen_dict is not None
-    assert pao_man._pol_dict == {3: {1: {1: 4.0531999999999995, 2: 3.1566}}}
+    assert pao_man._pol_dict == {3: {1: {1: pytest.approx(4.053144153), 2: pytest.approx(3.156571116)}}}
 
 def test_validator_and_get_pao_block():
 
@@ -157,3 +157,52 @@ def test_remove_orbital():
     assert pao_man._pol_dict == {}
 
 
+
+def test_to_and_from_array():
+
+    pao_man = PaoManager()
+
+    pao_man.name = "Si"
+    pao_man._gen_dict = {3: {0: {1: 4.05, 2: 3.0}, 1: {1: 4.5}}}
+    pao_man._pol_dict = {3: {1: {1: 4.5}}}
+
+    array = pao_man.to_array()
+    assert array.dtype == PAO_DTYPE
+    assert len(array) == 4
+    assert array["pol"].tolist() == [False, False, False, True]
+
+    new_man = PaoManager()
+    new_man.set_from_array("Si", array)
+    assert new_man._gen_dict == pao_man._gen_dict
+    assert new_man._pol_dict == pao_man._pol_dict
+    assert new_man.get_pao_block() == pao_man.get_pao_block()
+
+
+def test_pao_basis_set():
+
+    si_man = PaoManager()
+    si_man.name = "Si"
+    si_man._gen_dict = {3: {0: {1: 4.05, 2: 3.0}, 1: {1: 4.5}}}
+    si_man._pol_dict = {3: {1: {1: 4.5, 2: 0.0}}}
+
+    o_man = PaoManager()
+    o_man.name = "O"
+    o_man._gen_dict = {2: {0: {1: 3.0}, 1: {1: 3.5}}}
+    o_man._pol_dict = {}
+
+    basis = PaoBasisSet.from_pao_managers([si_man, o_man])
+
+    assert basis.get_pao_block() == "\n" + si_man.get_pao_block() + "\n" + o_man.get_pao_block() + "\n%endblock pao-basis"
+
+    basis.change_all_radius(2)
+    basis.change_all_radius({"O": -10}, species=["O"])
+    si_radii = {0: {1: pytest.approx(4.131), 2: pytest.approx(3.06)}, 1: {1: pytest.approx(4.59)}}
+    assert basis.get_pao_manager("Si")._gen_dict == {3: si_radii}
+    assert basis.get_pao_manager("O")._gen_dict == {2: {0: {1: pytest.approx(2.754)}, 1: {1: pytest.approx(3.213)}}}
+
+    with pytest.raises(ValueError):
+        basis.reset_radius("Ang", 5.0, 3, 1, 1)
+
+    basis.reset_radius("Ang", {"Si": 5.0}, 3, 1, 1)
+    assert basis.get_pao_manager("Si")._pol_dict == {3: {1: {1: 5.0, 2: 0.0}}}
+    assert basis.get_pao_manager("O")._gen_dict[2][1] == {1: pytest.approx(3.213)}
@@ -36,6 +36,32 @@ def test_registries(aiida_profile):
     del os.environ['AIIDA_SIESTA_PROTOCOLS']
 
 
+def test_registry_cache(aiida_profile):
+    """
+    Test that the parsed registry is cached at process level and that the cache is
+    invalidated when the environment variable `AIIDA_SIESTA_PROTOCOLS` changes.
+    """
+    from aiida_siesta.utils.protocols_system import protocols
+
+    PsmlFamily.objects.get_or_create("nc-sr-04_pbe_standard_psml")
+
+    protocols.clear_protocols_cache()
+    pmanager=ProtocolManager()
+    cached_key = protocols._REGISTRY_CACHE["key"]
+    pmanager2=ProtocolManager()
+    assert protocols._REGISTRY_CACHE["key"] == cached_key
+    assert pmanager2._protocols == pmanager._protocols
+    assert pmanager2._protocols is not protocols._REGISTRY_CACHE["protocols"]
+
+    basepath = os.path.dirname(os.path.abspath(__file__))
+    os.environ["AIIDA_SIESTA_PROTOCOLS"] = os.path.join(basepath, 'fixtures/protocols/registries/custom_prot.yaml')
+    pmanager3=ProtocolManager()
+    assert 'standard_my' in pmanager3.get_protocol_names()
+    assert protocols._REGISTRY_CACHE["key"] != cached_key
+
+    del os.environ['AIIDA_SIESTA_PROTOCOLS']
+
+
 def test_methods(aiida_profile):
     """
     Test the 5 public methods of the class `ProtocolManager`
@@ -66,3 +92,31 @@ def test_methods(aiida_profile):
     with pytest.raises(ValueError):
         pmanager.get_protocol("yoyo")
     assert pmanager.get_protocol("standard_psml") == pmanager._protocols["standard_psml"]
+
+
+def test_size_heuristics(aiida_profile, generate_structure):
+    """
+    Test the selection of the solver according to the size of the system.
+    """
+    from aiida_siesta.utils.protocols_system.protocols import select_size_heuristic, is_likely_metallic
+
+    PsmlFamily.objects.get_or_create("nc-sr-04_pbe_standard_psml")
+
+    pmanager=ProtocolManager()
+    size_heuristics = pmanager.get_protocol("standard_psml")["size_heuristics"]
+
+    assert select_size_heuristic(size_heuristics, 1000) is None
+    assert select_size_heuristic(size_heuristics, 4000, num_kpoints=8) == "elsi"
+    assert select_size_heuristic(size_heuristics, 7000, metallic=False) == "omm"
+    assert select_size_heuristic(size_heuristics, 9000, metallic=True) == "pexsi"
+    assert select_size_heuristic(size_heuristics, 9000, metallic=True, spin="spin-orbit") == "elsi"
+    assert select_size_heuristic(size_heuristics, 30000) == "ordern"
+    assert select_size_heuristic(size_heuristics, 30000, spin="polarized") == "omm"
+
+    structure = generate_structure()
+    assert not is_likely_metallic(structure)
+
+    #Two Si atoms, the parameters of the protocol are unchanged
+    parameters = pmanager._get_param("standard_psml", structure)
+    new_parameters = pmanager._add_size_options("standard_psml", parameters, structure, {}, None)
+    assert new_parameters == parameters
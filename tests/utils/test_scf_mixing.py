@@ -0,0 +1,57 @@
+import pytest
+
+
+@pytest.mark.parametrize(
+    "history, expected", [
+        ([1., 0.5, 0.2, 0.1, 0.05, 0.02], "converging"),
+        ([1., 0.1, 1., 0.1, 1., 0.1], "oscillating"),
+        ([0.1, 0.1, 0.1, 0.1, 0.1], "stalled"),
+        ([1., 0.1], "undetermined"),
+    ]
+)
+def test_analyse_scf_history(history, expected):
+    """
+    Test the classification of the scf history.
+    """
+    from aiida_siesta.utils.scf_mixing import analyse_scf_history
+
+    assert analyse_scf_history(history) == expected
+
+
+def test_get_scf_history():
+    """
+    Test that only the dDmax of the last scf cycle is extracted.
+    """
+    from aiida_siesta.utils.scf_mixing import get_scf_history
+
+    content = (
+        "        iscf     Eharris(eV)        E_KS(eV)     FreeEng(eV)     dDmax    Ef(eV) dHmax(eV)\n"
+        "   scf:    1     -216.235421     -215.245073     -215.245073  1.812612 -3.827264  0.171510\n"
+        "   scf:    2     -215.248473     -215.246811     -215.246811  0.004372 -3.790776  0.107009\n"
+        "   scf:    1     -215.248867     -215.247951     -215.247951  0.007242 -3.727489  0.002638\n"
+    )
+    assert get_scf_history(content) == [0.007242]
+
+
+def test_escalate_scf_parameters():
+    """
+    Test that a rung of the ladder is applied, the mixing weight is never increased,
+    the electronic temperature is never decreased and the legacy keywords are removed.
+    """
+    from aiida_siesta.utils.scf_mixing import escalate_scf_parameters
+
+    param = {"DM.MixingWeight": 0.05, "electronic-temperature": "25 meV"}
+    new_param, changes = escalate_scf_parameters(param, {"scf-mixer-weight": 0.1, "scf-mixer-history": 6})
+
+    assert new_param["scf-mixer-weight"] == 0.05
+    assert new_param["scf-mixer-history"] == 6
+    assert "DM.MixingWeight" not in new_param
+    assert changes["scf-mixer-history"] == (None, 6)
+    assert changes["DM.MixingWeight"] == (0.05, None)
+
+    rung = {"electronic-temperature": "500 K"}
+    new_param, changes = escalate_scf_parameters({"electronic-temperature": "25 meV"}, rung)
+    assert new_param["electronic-temperature"] == "500 K"
+    new_param, changes = escalate_scf_parameters({"ElectronicTemperature": "0.01 Ry"}, rung)
+    assert new_param == {"ElectronicTemperature": "0.01 Ry"}
+    assert not changes
@@ -11,7 +11,8 @@ def generate_workchain_bandgap(generate_psml_data, fixture_code, fixture_localho
         generate_calc_job_node, generate_parser):
     """Generate an instance of a `BandgapWorkChain`."""
 
-    def _generate_workchain_bandgap(bands=False,relax=False):
+    def _generate_workchain_bandgap(bands=False,relax=False,restart_dm=False,var_cell=False,num_chunks=None,
+            structure=None):
 
         entry_point_wc = 'siesta.bandgap'
         entry_point_code = 'siesta.siesta'
@@ -20,7 +21,7 @@ def generate_workchain_bandgap(generate_psml_data, fixture_code, fixture_localho
 
         inputs = {
             'code': fixture_code(entry_point_code),
-            'structure': generate_structure(),
+            'structure': structure if structure is not None else generate_structure(),
             'kpoints': generate_kpoints_mesh(2),
             'basis': generate_basis(),
             'pseudos': {
@@ -36,6 +37,10 @@ def generate_workchain_bandgap(generate_psml_data, fixture_code, fixture_localho
 
         if relax:
             inputs["parameters"] = generate_param()
+            if var_cell:
+                param = generate_param().get_dict()
+                param["md-variable-cell"] = var_cell
+                inputs["parameters"] = orm.Dict(dict=param)
         else:
             param = generate_param().get_dict()
             for item in param.copy():
@@ -49,6 +54,11 @@ def generate_workchain_bandgap(generate_psml_data, fixture_code, fixture_localho
             bandskpoints.set_kpoints(kpp)
             inputs["bandskpoints"] = bandskpoints
 
+        if restart_dm:
+            inputs["restart_bands_from_dm"] = orm.Bool(True)
+
+        if num_chunks:
+            inputs["bands_num_chunks"] = orm.Int(num_chunks)
 
         process = generate_workchain(entry_point_wc, inputs)
 
@@ -150,3 +160,99 @@ def test_final_run(aiida_profile, fixture_localhost, generate_workchain_bandgap,
     assert isinstance(res,orm.Dict)
     assert res['is_insulator']
     assert res['band_gap'] == 3.0
+
+
+def test_restart_bands_from_dm(aiida_profile, fixture_localhost, fixture_code, generate_psml_data,
+        generate_structure, generate_wc_job_node, generate_workchain_bandgap):
+    """Test `BangapWorkChain` with the `restart_bands_from_dm` option."""
+
+    from aiida.tools import get_explicit_kpoints_path
+
+    #Fixed cell relaxation of a structure that seekpath would change: the structure to relax
+    #is not replaced and the bands are calculated in a final step
+    process = generate_workchain_bandgap(bands=False,relax=True,restart_dm=True)
+    process.preprocess()
+    assert not process.ctx.need_to_generate_bandskp
+    assert process.ctx.need_fin_step
+
+    res = process.run_siesta_wc()
+    assert "bandskpoints" not in res['workchain_base'].inputs
+    assert res['workchain_base'].inputs.structure.uuid == process.inputs.structure.uuid
+
+    #Fixed cell relaxation of a structure already standardized by seekpath, the bands are folded
+    #in the first run, that relaxes the input structure
+    primitive = get_explicit_kpoints_path(generate_structure())['primitive_structure']
+    process = generate_workchain_bandgap(bands=False,relax=True,restart_dm=True,structure=primitive)
+    process.preprocess()
+    assert process.ctx.need_to_generate_bandskp
+    assert not process.ctx.need_fin_step
+
+    res = process.run_siesta_wc()
+    assert "bandskpoints" in res['workchain_base'].inputs
+    assert res['workchain_base'].inputs.structure.uuid == process.inputs.structure.uuid
+
+    #Variable cell requested with an uppercase fortran boolean
+    process = generate_workchain_bandgap(bands=False,relax=True,restart_dm=True,var_cell=".TRUE.")
+    process.preprocess()
+    assert not process.ctx.need_to_generate_bandskp
+    assert process.ctx.need_fin_step
+
+    #Variable cell relaxation, the final step restarts from the DM
+    process = generate_workchain_bandgap(bands=False,relax=True,restart_dm=True,var_cell=True)
+    process.preprocess()
+    assert not process.ctx.need_to_generate_bandskp
+    assert process.ctx.need_fin_step
+
+    psml = generate_psml_data("Si")
+
+    inputs = AttributeDict({
+        'structure': generate_structure(),
+        'code': fixture_code("siesta.siesta"),
+        'parameters': orm.Dict(dict={"md": 3, "ee":4}),
+        'options': orm.Dict(dict={'resources': {'num_machines': 1  },'max_wallclock_seconds': 1800,'withmpi': False}),
+        'pseudos': {'Si': psml,'SiDiff': psml},
+    })
+    fin_basewc = generate_wc_job_node("siesta.base", fixture_localhost, inputs)
+    fin_basewc.set_process_state(ProcessState.FINISHED)
+    fin_basewc.set_exit_status(ExitCode(0).status)
+    out_struct = generate_structure()
+    out_struct.store()
+    out_struct.add_incoming(fin_basewc, link_type=LinkType.RETURN, link_label='output_structure')
+    remote_folder = orm.RemoteData(computer=fixture_localhost, remote_path='/tmp')
+    remote_folder.store()
+    remote_folder.add_incoming(fin_basewc, link_type=LinkType.RETURN, link_label='remote_folder')
+
+    process.ctx.workchain_base = fin_basewc
+
+    finwc = process.run_last()
+
+    assert "bandskpoints" in finwc['final_run'].inputs
+    assert finwc['final_run'].inputs.parent_calc_folder.uuid == remote_folder.uuid
+
+
+def test_bands_in_chunks(aiida_profile, fixture_localhost, generate_structure, generate_wc_job_node,
+        generate_workchain_bandgap):
+    """Test `BangapWorkChain` with the `bands_num_chunks` option."""
+
+    process = generate_workchain_bandgap(bands=False,relax=False,num_chunks=2)
+    process.preprocess()
+    assert process.ctx.need_to_generate_bandskp
+    assert process.ctx.need_fin_step
+
+    res = process.run_siesta_wc()
+    assert "bandskpoints" not in res['workchain_base'].inputs
+
+    fin_basewc = generate_wc_job_node("siesta.base", fixture_localhost, {'structure': generate_structure()})
+    fin_basewc.set_process_state(ProcessState.FINISHED)
+    fin_basewc.set_exit_status(ExitCode(0).status)
+    remote_folder = orm.RemoteData(computer=fixture_localhost, remote_path='/tmp')
+    remote_folder.store()
+    remote_folder.add_incoming(fin_basewc, link_type=LinkType.RETURN, link_label='remote_folder')
+
+    process.ctx.workchain_base = fin_basewc
+
+    finwc = process.run_last()
+
+    assert process.ctx.chunked_bands
+    assert finwc['final_run'].inputs.num_chunks.value == 2
+    assert finwc['final_run'].inputs.parent_calc_folder.uuid == remote_folder.uuid
@@ -178,6 +178,108 @@ def test_handle_error_scf_not_conv(aiida_profile, generate_workchain_base):
     #assert result == PwBaseWorkChain.exit_codes.ERROR_UNRECOVERABLE_FAILURE
 
 
+def test_handle_error_walltime(aiida_profile, generate_workchain_base):
+    """
+    Test `SiestaBaseWorkChain.handle_error_walltime`. The number of relaxation steps
+    must be reduced by the steps already performed.
+    """
+    from aiida_siesta.utils.tkdict import FDFDict
+
+    process = generate_workchain_base(exit_code=SiestaCalculation.exit_codes.WALLTIME_EXCEEDED)
+    process.setup()
+    process.prepare_inputs()
+    process.ctx.inputs['parameters'] = orm.Dict(dict={"md-type-of-run": "cg", "md-num-cg-steps": 10})
+
+    #Add another fake output to the SiestaCalculation node
+    calculation = process.ctx.children[-1]
+    out_par = orm.Dict(dict={"walltime_exceeded": True, "last_md_step": 4})
+    out_par.add_incoming(calculation, link_type=LinkType.CREATE, link_label='output_parameters')
+    out_par.store()
+
+    result = process.handle_error_walltime(calculation)
+    assert isinstance(result, ProcessHandlerReport)
+    assert result.do_break
+    assert process.ctx.inputs['parent_calc_folder'] == calculation.outputs.remote_folder
+    assert FDFDict(process.ctx.inputs['parameters'].get_dict())["mdsteps"] == 6
+
+
+def test_handle_error_walltime_md(aiida_profile, generate_workchain_base):
+    """
+    Test `SiestaBaseWorkChain.handle_error_walltime` for a molecular dynamics defined by its final
+    time step: the run continues from the step that was interrupted, with the velocities and the
+    state of the integrator of the parent (`MD_RESTART` setting).
+    """
+    from aiida_siesta.utils.tkdict import FDFDict
+
+    process = generate_workchain_base(exit_code=SiestaCalculation.exit_codes.WALLTIME_EXCEEDED)
+    process.setup()
+    process.prepare_inputs()
+    process.ctx.inputs['parameters'] = orm.Dict(dict={"md-type-of-run": "Nose", "md-final-time-step": 100})
+
+    calculation = process.ctx.children[-1]
+    out_par = orm.Dict(dict={"walltime_exceeded": True, "last_md_step": 40})
+    out_par.add_incoming(calculation, link_type=LinkType.CREATE, link_label='output_parameters')
+    out_par.store()
+
+    result = process.handle_error_walltime(calculation)
+    assert result.do_break
+    new_param = FDFDict(process.ctx.inputs['parameters'].get_dict())
+    assert new_param["mdinitialtimestep"] == 40
+    assert new_param["mdfinaltimestep"] == 100
+    assert process.ctx.inputs['settings']['MD_RESTART']
+
+
+def test_update_md_steps():
+    """
+    Test the update of the steps of relaxations and molecular dynamics restarted after the walltime.
+    """
+    from aiida_siesta.utils.tkdict import FDFDict
+    from aiida_siesta.workflows.base import update_md_steps
+
+    # The length of the MD is given by the final time step only
+    new_param = FDFDict(update_md_steps({"md-type-of-run": "verlet", "md-final-time-step": 50}, 20))
+    assert new_param["mdinitialtimestep"] == 20
+    assert new_param["mdfinaltimestep"] == 50
+
+    # The length of the MD is given by the number of steps
+    new_param = FDFDict(update_md_steps({"md-type-of-run": "verlet", "md-steps": 50}, 20))
+    assert new_param["mdinitialtimestep"] == 20
+    assert new_param["mdfinaltimestep"] == 50
+
+    assert FDFDict(update_md_steps({"md-type-of-run": "cg", "md-num-cg-steps": 50}, 20))["mdsteps"] == 30
+    assert update_md_steps({"md-type-of-run": "verlet"}, 20) is None
+    assert update_md_steps({"md-type-of-run": "cg", "md-final-time-step": 50}, 20) is None
+
+
+def test_handle_error_scf_diverged(aiida_profile, generate_workchain_base):
+    """
+    Test `SiestaBaseWorkChain.handle_error_scf_diverged`. The next rung of the mixing ladder is
+    applied and no density matrix is reused, also when a parent folder was set by a previous restart.
+    """
+    from aiida_siesta.utils.tkdict import FDFDict
+
+    process = generate_workchain_base(exit_code=SiestaCalculation.exit_codes.SCF_DIVERGED)
+    process.setup()
+    process.prepare_inputs()
+
+    calculation = process.ctx.children[-1]
+    #A parent folder, as set by a previous restart, must not be reused
+    process.ctx.inputs['parent_calc_folder'] = calculation.outputs.remote_folder
+    out_par = orm.Dict(dict={"monitor_kill_reason": "diverging", "monitor_scf_history": [0.1, 0.01, 10.]})
+    out_par.add_incoming(calculation, link_type=LinkType.CREATE, link_label='output_parameters')
+    out_par.store()
+
+    result = process.handle_error_scf_diverged(calculation)
+    assert isinstance(result, ProcessHandlerReport)
+    assert result.do_break
+    assert result.exit_code.status == 0
+    assert 'parent_calc_folder' not in process.ctx.inputs
+    assert FDFDict(process.ctx.inputs['parameters'].get_dict())["scfmixerweight"] == 0.1
+    assert "dmmixingweight" not in FDFDict(process.ctx.inputs['parameters'].get_dict())
+    assert process.ctx.scf_mixing_changes[0]["diagnosis"] == "diverging"
+    assert process.node.get_extra("scf_mixing_changes")[0]["diagnosis"] == "diverging"
+
+
 def test_handle_error_basis_pol(aiida_profile, generate_workchain_base):
     """
     Test `SiestaBaseWorkChain.handle_error_basis_pol`.
@@ -0,0 +1,79 @@
+#!/usr/bin/env runaiida
+import pytest
+from plumpy import ProcessState
+from aiida import orm
+from aiida.common import LinkType
+from aiida.engine import ExitCode
+
+
+@pytest.fixture
+def generate_workchain_basis_opt(generate_psml_data, fixture_code, generate_workchain, generate_structure,
+        generate_param, generate_basis, generate_kpoints_mesh):
+    """Generate an instance of a `BasisOptimizationWorkChain`."""
+
+    def _generate_workchain_basis_opt():
+
+        entry_point_wc = 'siesta.basis_optimization'
+        entry_point_code = 'siesta.siesta'
+
+        psml = generate_psml_data('Si')
+
+        inputs = {
+            'code': fixture_code(entry_point_code),
+            'structure': generate_structure(),
+            'kpoints': generate_kpoints_mesh(2),
+            'parameters': generate_param(),
+            'basis': generate_basis(),
+            'population_size': orm.Int(3),
+            'pseudos': {
+                'Si': psml,
+                'SiDiff': psml
+            },
+            'options': orm.Dict(dict={
+               'resources': {'num_machines': 1  },
+               'max_wallclock_seconds': 1800,
+               'withmpi': False,
+               })
+        }
+
+        process = generate_workchain(entry_point_wc, inputs)
+
+        return process
+
+    return _generate_workchain_basis_opt
+
+
+def test_reference_and_generation(aiida_profile, fixture_localhost, generate_wc_job_node, generate_ion_data,
+        generate_workchain_basis_opt):
+    """Test `BasisOptimizationWorkChain.inspect_reference` and `BasisOptimizationWorkChain.run_generation`."""
+
+    process = generate_workchain_basis_opt()
+
+    basewc = generate_wc_job_node("siesta.base", fixture_localhost)
+    basewc.set_process_state(ProcessState.FINISHED)
+    basewc.set_exit_status(ExitCode(0).status)
+    outputs = {
+        'output_parameters': orm.Dict(dict={"basis_enthalpy": -100.0, "basis_enthalpy_units": "eV"}),
+        'remote_folder': orm.RemoteData(computer=fixture_localhost, remote_path='/tmp'),
+        'ion_files__Si': generate_ion_data('Si'),
+        'ion_files__SiDiff': generate_ion_data('SiDiff'),
+    }
+    for label, node in outputs.items():
+        node.store()
+        node.add_incoming(basewc, link_type=LinkType.RETURN, link_label=label)
+    process.ctx.reference = basewc
+
+    process.inspect_reference()
+
+    assert process.ctx.optimizer["best_value"] == -100.0
+    assert process.should_run_generation()
+
+    res = process.run_generation()
+
+    assert sorted(res.keys()) == ["candidate_0", "candidate_1", "candidate_2"]
+    candidate = res["candidate_0"]
+    assert candidate.inputs.parent_calc_folder.uuid == outputs['remote_folder'].uuid
+    pao_block = candidate.inputs.basis["%block pao-basis"]
+    assert pao_block.startswith("\nSi ")
+    assert "SiDiff " in pao_block
+    assert pao_block.endswith("%endblock pao-basis")
@@ -0,0 +1,93 @@
+#!/usr/bin/env runaiida
+import pytest
+from plumpy import ProcessState
+from aiida import orm
+from aiida.common import LinkType
+from aiida.engine import ExitCode
+
+
+@pytest.fixture
+def generate_workchain_benchmark(generate_psml_data, fixture_code, generate_workchain, generate_structure,
+        generate_param, generate_basis, generate_kpoints_mesh):
+    """Generate an instance of a `ParallelBenchmarkWorkChain`."""
+
+    def _generate_workchain_benchmark():
+
+        entry_point_wc = 'siesta.benchmark'
+        entry_point_code = 'siesta.siesta'
+
+        psml = generate_psml_data('Si')
+
+        inputs = {
+            'code': fixture_code(entry_point_code),
+            'structure': generate_structure(),
+            'kpoints': generate_kpoints_mesh(2),
+            'parameters': generate_param(),
+            'basis': generate_basis(),
+            'resources_list': orm.List(list=[
+                {'num_machines': 1, 'num_mpiprocs_per_machine': 4},
+                {'num_machines': 1, 'num_mpiprocs_per_machine': 4, 'num_cores_per_mpiproc': 2},
+            ]),
+            'parallel_options': orm.List(list=[{}, {'diag-paralleloverk': True}]),
+            'pseudos': {
+                'Si': psml,
+                'SiDiff': psml
+            },
+            'options': orm.Dict(dict={
+               'resources': {'num_machines': 1  },
+               'max_wallclock_seconds': 1800,
+               'withmpi': True,
+               })
+        }
+
+        process = generate_workchain(entry_point_wc, inputs)
+
+        return process
+
+    return _generate_workchain_benchmark
+
+
+def test_run_benchmarks(aiida_profile, generate_workchain_benchmark):
+    """Test `ParallelBenchmarkWorkChain.run_benchmarks`."""
+
+    process = generate_workchain_benchmark()
+
+    res = process.run_benchmarks()
+
+    assert sorted(res.keys()) == ["config_0", "config_1", "config_2", "config_3"]
+    options = res["config_3"].inputs.options.get_dict()
+    assert options["resources"]["num_cores_per_mpiproc"] == 2
+    assert options["environment_variables"]["OMP_NUM_THREADS"] == "2"
+    assert res["config_3"].inputs.parameters["diag-paralleloverk"] is True
+    assert "diag-paralleloverk" not in res["config_0"].inputs.parameters.get_dict()
+
+
+def test_return_results(aiida_profile, fixture_localhost, generate_wc_job_node, generate_workchain_benchmark):
+    """Test `ParallelBenchmarkWorkChain.return_results`, failed configurations are ignored."""
+
+    process = generate_workchain_benchmark()
+    resources = {'num_machines': 1, 'num_mpiprocs_per_machine': 4}
+    process.ctx.configurations = [
+        {"resources": dict(resources, num_mpiprocs_per_machine=procs), "parallel_options": {}, "key": f"config_{i}"}
+        for i, procs in enumerate([1, 4, 8])
+    ]
+
+    for index, global_time in enumerate([100., 30., None]):
+        basewc = generate_wc_job_node("siesta.base", fixture_localhost)
+        basewc.set_process_state(ProcessState.FINISHED)
+        basewc.set_exit_status(ExitCode(0 if global_time else 400).status)
+        out_par = orm.Dict(dict={"global_time": global_time, "no_u": 26} if global_time else {})
+        out_par.store()
+        out_par.add_incoming(basewc, link_type=LinkType.RETURN, link_label="output_parameters")
+        process.ctx[f"config_{index}"] = basewc
+
+    result = process.return_results()
+
+    assert result is None
+    results = process.outputs["results_dict"].get_dict()
+    assert results["no_u"] == 26
+    assert results["table"][1]["speedup"] == pytest.approx(100. / 30.)
+    assert results["table"][1]["efficiency"] == pytest.approx(100. / 30. / 4.)
+    assert results["table"][2]["speedup"] is None
+    # The configuration with 4 ranks has efficiency 0.83, above the default 0.7
+    assert process.outputs["recommended_configuration"]["resources"]["num_mpiprocs_per_machine"] == 4
@@ -92,3 +92,38 @@ def test_results(aiida_profile, generate_workchain_eos,
     assert result == ExitCode(0)
     assert isinstance(process.outputs["results_dict"], orm.Dict)
     assert (process.outputs["results_dict"]["fit_res"]['Vo(ang^3/atom)'] > 20)
+
+
+def test_delta_project_BM_fit_many():
+    """
+    Test that the vectorized fit gives the same results of `delta_project_BM_fit`,
+    also in presence of padding and for a failing fit.
+    """
+    import numpy as np
+    from aiida_siesta.workflows.eos import delta_project_BM_fit, delta_project_BM_fit_many
+
+    scales = np.array([0.94, 0.96, 0.98, 1., 1.02, 1.04, 1.06])
+    volumes = []
+    energies = []
+    for vol0, bulk0, bulk1, ener0 in [(20., 0.5, 4., -5.), (22., 0.7, 4.4, -7.), (25., 1.0, 5., -10.)]:
+        vols = vol0 * scales
+        ratio = (vol0 / vols)**(2. / 3.)
+        volumes.append(vols)
+        energies.append(ener0 + 9. / 16. * bulk0 * vol0 * (ratio - 1.)**2 * (6. + bulk1 * (ratio - 1.) - 4. * ratio))
+    volumes = np.array(volumes)
+    energies = np.array(energies)
+    volumes[1, 5:] = np.nan
+    energies[1, 5:] = np.nan
+    #A linear E(V), the fit must fail
+    volumes = np.vstack([volumes, 20. * scales])
+    energies = np.vstack([energies, np.linspace(0, 1, 7)])
+
+    results = delta_project_BM_fit_many(volumes, energies)
+
+    for index in range(3):
+        mask = np.isfinite(volumes[index])
+        single = delta_project_BM_fit(volumes[index][mask], energies[index][mask])
+        for value, batch in zip(single, results):
+            assert np.isclose(value, batch[index])
+    assert np.all(np.isnan(results[1][3:]))
+    assert np.isclose(results[1][0], 20.)
@@ -0,0 +1,134 @@
+#!/usr/bin/env runaiida
+import numpy as np
+import pytest
+from plumpy import ProcessState
+from aiida import orm
+from aiida.common import LinkType
+from aiida.engine import ExitCode
+
+
+@pytest.fixture
+def generate_workchain_md(generate_psml_data, fixture_code, generate_workchain, generate_structure, generate_param):
+    """Generate an instance of a `ChunkedMDWorkChain`."""
+
+    def _generate_workchain_md(total_steps, steps_per_segment):
+
+        entry_point_wc = 'siesta.chunked_md'
+        entry_point_code = 'siesta.siesta'
+
+        psml = generate_psml_data('Si')
+        parameters = generate_param().get_dict()
+        parameters['md-typeofrun'] = 'Verlet'
+
+        inputs = {
+            'code': fixture_code(entry_point_code),
+            'structure': generate_structure(),
+            'parameters': orm.Dict(dict=parameters),
+            'pseudos': {
+                'Si': psml,
+                'SiDiff': psml
+            },
+            'total_steps': orm.Int(total_steps),
+            'steps_per_segment': orm.Int(steps_per_segment),
+            'options': orm.Dict(dict={
+               'resources': {'num_machines': 1  },
+               'max_wallclock_seconds': 1800,
+               'withmpi': False,
+               })
+        }
+
+        process = generate_workchain(entry_point_wc, inputs)
+
+        return process
+
+    return _generate_workchain_md
+
+
+def generate_trajectory(structure, steps):
+    """Return a `TrajectoryData` of the two Si atoms with the given steps."""
+    trajectory = orm.TrajectoryData()
+    positions = np.array([[site.position for site in structure.sites]] * len(steps))
+    positions[:, 0, 0] = steps
+    trajectory.set_trajectory(['Si', 'Si'], positions, stepids=np.array(steps))
+    trajectory.set_array('temperatures', np.array(steps, dtype=float))
+    return trajectory
+
+
+def test_segments(aiida_profile, fixture_localhost, fixture_sandbox, generate_calc_job, generate_calc_job_node,
+        generate_structure, generate_workchain_md):
+    """
+    Test the inputs of the segments, the resume from the last good step of a segment failing partway
+    and the retry of a segment completing no step.
+    """
+
+    process = generate_workchain_md(total_steps=10, steps_per_segment=4)
+    process.setup()
+
+    res = process.run_segment()
+    first = res['segment']
+    assert first.inputs.parameters['md-initial-time-step'] == 1
+    assert first.inputs.parameters['md-final-time-step'] == 4
+    assert not first.inputs.settings['MD_RESTART']
+    assert 'parent_calc_folder' not in first.inputs
+
+    #The first segment is stopped by the walltime after step 3
+    calc = generate_calc_job_node('siesta.siesta', fixture_localhost)
+    calc.set_process_state(ProcessState.FINISHED)
+    calc.set_exit_status(447)
+    outputs = {
+        'output_trajectory': generate_trajectory(generate_structure(), [1, 2, 3]),
+        'output_structure': generate_structure(scale=1.01),
+        'remote_folder': orm.RemoteData(computer=fixture_localhost, remote_path='/tmp'),
+    }
+    for label, node in outputs.items():
+        node.add_incoming(calc, link_type=LinkType.CREATE, link_label=label)
+        node.store()
+    process.ctx.segment = calc
+    process.inspect_segment()
+
+    res = process.run_segment()
+    second = res['segment']
+    assert second.inputs.parameters['md-initial-time-step'] == 4
+    assert second.inputs.parameters['md-final-time-step'] == 7
+    assert second.inputs.settings['MD_RESTART']
+    assert second.inputs.parent_calc_folder.uuid == outputs['remote_folder'].uuid
+    assert second.inputs.structure.uuid == outputs['output_structure'].uuid
+    assert 'PARENT_FOLDER_SYMLINK' not in second.inputs.settings.get_dict()
+
+    #The restart files of the parent, including the density matrix, are copied and never symlinked
+    inputs = second.get_incoming().nested()
+    inputs['metadata'] = {'options': {'resources': {'num_machines': 1}, 'max_wallclock_seconds': 1800}}
+    calc_info = generate_calc_job(fixture_sandbox, 'siesta.siesta', inputs)
+    assert calc_info.remote_symlink_list == []
+    assert (fixture_localhost.uuid, '/tmp/./*.DM', './') in calc_info.remote_copy_list
+    assert (fixture_localhost.uuid, '/tmp/./*.XV', './') in calc_info.remote_copy_list
+
+    #A segment completing no step is repeated, up to `max_segment_failures` times
+    failed = generate_calc_job_node('siesta.siesta', fixture_localhost)
+    failed.set_process_state(ProcessState.FINISHED)
+    failed.set_exit_status(ExitCode(350).status)
+    process.ctx.segment = failed
+    assert process.inspect_segment() is None
+    assert process.ctx.next_step == 4
+    assert process.should_run_segment()
+    process.inspect_segment()
+    assert process.inspect_segment() == process.exit_codes.ERROR_SEGMENT_FAILED
+
+
+def test_concatenate_trajectories(aiida_profile, generate_structure):
+    """Test that the steps repeated by a resumed segment are taken from the later segment."""
+    from aiida_siesta.workflows.md import concatenate_trajectories
+
+    structure = generate_structure()
+    first = generate_trajectory(structure, [1, 2, 3])
+    second = generate_trajectory(structure, [3, 4, 5])
+    second.set_array('temperatures', np.array([30., 40., 50.]))
+
+    outputs = concatenate_trajectories(segment_0=first, segment_1=second)
+    trajectory = outputs['output_trajectory']
+
+    assert list(trajectory.get_stepids()) == [1, 2, 3, 4, 5]
+    assert list(trajectory.get_array('temperatures')) == [1., 2., 30., 40., 50.]
+    assert trajectory.get_positions().shape == (5, 2, 3)
+    assert outputs['md_info']['num_repeated_steps'] == 1
+    assert outputs['md_info']['last_step'] == 5
@@ -0,0 +1,104 @@
+#!/usr/bin/env runaiida
+import pytest
+import numpy as np
+from plumpy import ProcessState
+from aiida import orm
+from aiida.common import LinkType
+from aiida.engine import ExitCode
+
+
+@pytest.fixture
+def generate_workchain_parallel_bands(generate_psml_data, fixture_code, fixture_localhost, generate_workchain,
+        generate_structure, generate_param, generate_basis, generate_kpoints_mesh):
+    """Generate an instance of a `ParallelBandsWorkChain`."""
+
+    def _generate_workchain_parallel_bands(num_chunks=2):
+
+        entry_point_wc = 'siesta.parallel_bands'
+        entry_point_code = 'siesta.siesta'
+
+        psml = generate_psml_data('Si')
+
+        structure = generate_structure()
+        bandskpoints = orm.KpointsData()
+        kpp = [(0.500,  0.250, 0.750), (0.500,  0.500, 0.500), (0., 0., 0.), (0.5, 0., 0.5), (0.25, 0., 0.25)]
+        bandskpoints.set_cell_from_structure(structure)
+        bandskpoints.set_kpoints(kpp)
+        bandskpoints.labels = [(0, "W"), (1, "L"), (2, "G"), (3, "X")]
+
+        remote_folder = orm.RemoteData(computer=fixture_localhost, remote_path='/tmp')
+
+        inputs = {
+            'code': fixture_code(entry_point_code),
+            'structure': structure,
+            'kpoints': generate_kpoints_mesh(2),
+            'parameters': generate_param(),
+            'basis': generate_basis(),
+            'bandskpoints': bandskpoints,
+            'parent_calc_folder': remote_folder,
+            'num_chunks': orm.Int(num_chunks),
+            'pseudos': {
+                'Si': psml,
+                'SiDiff': psml
+            },
+            'settings': orm.Dict(dict={'cmdline': ['-option1']}),
+            'options': orm.Dict(dict={
+               'resources': {'num_machines': 1  },
+               'max_wallclock_seconds': 1800,
+               'withmpi': False,
+               })
+        }
+
+        process = generate_workchain(entry_point_wc, inputs)
+
+        return process
+
+    return _generate_workchain_parallel_bands
+
+
+def test_split_and_run(aiida_profile, generate_workchain_parallel_bands):
+    """Test `ParallelBandsWorkChain.split_kpoints` and `ParallelBandsWorkChain.run_chunks`."""
+    from aiida_siesta.utils.tkdict import FDFDict
+
+    process = generate_workchain_parallel_bands(num_chunks=2)
+    process.split_kpoints()
+
+    assert sorted(process.ctx.chunks.keys()) == ["chunk_0", "chunk_1"]
+    assert len(process.ctx.chunks["chunk_0"].get_kpoints()) == 3
+    assert len(process.ctx.chunks["chunk_1"].get_kpoints()) == 2
+
+    res = process.run_chunks()
+
+    assert sorted(res.keys()) == ["chunk_0", "chunk_1"]
+    chunk_run = res["chunk_0"]
+    params = FDFDict(chunk_run.inputs.parameters.get_dict())
+    assert params["maxscfiterations"] == 1
+    assert "mdnumcgsteps" not in params
+    assert chunk_run.inputs.settings["PARENT_FOLDER_SYMLINK"]
+    assert chunk_run.inputs.settings["NON_SCF_BANDS"]
+    assert chunk_run.inputs.settings["CMDLINE"] == ['-option1']
+
+
+def test_merge(aiida_profile, fixture_localhost, generate_wc_job_node, generate_workchain_parallel_bands):
+    """Test `ParallelBandsWorkChain.run_results`, with spin polarized bands."""
+
+    process = generate_workchain_parallel_bands(num_chunks=2)
+    process.split_kpoints()
+
+    bands_values = np.arange(2 * 5 * 3).reshape(2, 5, 3)
+    for name, start, end in [("chunk_0", 0, 3), ("chunk_1", 3, 5)]:
+        basewc = generate_wc_job_node("siesta.base", fixture_localhost)
+        basewc.set_process_state(ProcessState.FINISHED)
+        basewc.set_exit_status(ExitCode(0).status)
+        bands = orm.BandsData()
+        bands.set_kpointsdata(process.ctx.chunks[name])
+        bands.set_bands(bands_values[:, start:end, :], units="eV")
+        bands.store()
+        bands.add_incoming(basewc, link_type=LinkType.RETURN, link_label='bands')
+        process.ctx[name] = basewc
+
+    process.run_results()
+
+    merged = process.outputs["bands"]
+    assert np.allclose(merged.get_bands(), bands_values)
+    assert merged.labels == [(0, "W"), (1, "L"), (2, "G"), (3, "X")]
@@ -0,0 +1,119 @@
+#!/usr/bin/env runaiida
+import pytest
+from plumpy import ProcessState
+from aiida import orm
+from aiida.common import LinkType
+from aiida.engine import ExitCode
+
+
+@pytest.fixture
+def generate_workchain_relax(generate_psml_data, fixture_code, generate_workchain, generate_structure,
+        generate_param, generate_basis, generate_kpoints_mesh):
+    """Generate an instance of a `MultiFidelityRelaxWorkChain`."""
+
+    def _generate_workchain_relax(stages):
+
+        entry_point_wc = 'siesta.multi_fidelity_relax'
+        entry_point_code = 'siesta.siesta'
+
+        psml = generate_psml_data('Si')
+
+        inputs = {
+            'code': fixture_code(entry_point_code),
+            'structure': generate_structure(),
+            'kpoints': generate_kpoints_mesh(4),
+            'parameters': generate_param(),
+            'basis': generate_basis(),
+            'stages': orm.List(list=stages),
+            'pseudos': {
+                'Si': psml,
+                'SiDiff': psml
+            },
+            'options': orm.Dict(dict={
+               'resources': {'num_machines': 1  },
+               'max_wallclock_seconds': 1800,
+               'withmpi': False,
+               })
+        }
+
+        process = generate_workchain(entry_point_wc, inputs)
+
+        return process
+
+    return _generate_workchain_relax
+
+
+def test_stages(aiida_profile, fixture_localhost, generate_wc_job_node, generate_structure, generate_workchain_relax):
+    """
+    Test the inputs of the stages, the restart from the density matrix only when the basis
+    is compatible and the failure of a preliminary stage.
+    """
+
+    stages = [
+        {'parameters': {'mesh-cutoff': '100 Ry'}, 'basis': {'pao-basis-size': 'SZ'}, 'kpoints': {'distance': 5.0}},
+        {'parameters': {'Mesh-Cutoff': '150 Ry'}},
+    ]
+    process = generate_workchain_relax(stages)
+    process.setup()
+
+    assert len(process.ctx.stages) == 3
+
+    res = process.run_stage()
+    first = res['stage_wc']
+    assert first.inputs.basis['pao-basis-size'] == 'SZ'
+    assert first.inputs.parameters['mesh-cutoff'] == '100 Ry'
+    assert first.inputs.kpoints.get_kpoints_mesh()[0] == [1, 1, 1]
+    assert 'parent_calc_folder' not in first.inputs
+
+    relaxed = generate_structure(scale=1.01)
+    basewc = generate_wc_job_node("siesta.base", fixture_localhost)
+    basewc.set_process_state(ProcessState.FINISHED)
+    basewc.set_exit_status(ExitCode(0).status)
+    outputs = {
+        'output_structure': relaxed,
+        'remote_folder': orm.RemoteData(computer=fixture_localhost, remote_path='/tmp'),
+    }
+    for label, node in outputs.items():
+        node.store()
+        node.add_incoming(basewc, link_type=LinkType.RETURN, link_label=label)
+    process.ctx.stage_wc = basewc
+    process.inspect_stage()
+
+    #The basis of the first stage (SZ) differs from the second one: no density matrix reuse
+    res = process.run_stage()
+    second = res['stage_wc']
+    assert second.inputs.structure.uuid == relaxed.uuid
+    assert second.inputs.parameters.get_dict()['Mesh-Cutoff'] == '150 Ry'
+    assert 'mesh-cutoff' not in second.inputs.parameters.get_dict()
+    assert 'parent_calc_folder' not in second.inputs
+
+    #The second stage has the production basis, so the production restarts from its density matrix
+    process.ctx.stage_wc = basewc
+    process.inspect_stage()
+    res = process.run_stage()
+    assert res['stage_wc'].inputs.parent_calc_folder.uuid == outputs['remote_folder'].uuid
+
+    #A failure of the production stage is fatal
+    failedwc = generate_wc_job_node("siesta.base", fixture_localhost)
+    failedwc.set_process_state(ProcessState.FINISHED)
+    failedwc.set_exit_status(ExitCode(400).status)
+    process.ctx.stage_wc = failedwc
+    assert process.inspect_stage() == process.exit_codes.ERROR_PRODUCTION_WC
+
+
+def test_is_basis_compatible(aiida_profile, generate_structure, generate_basis):
+    """Test the check of the compatibility of the basis of two stages."""
+    from aiida_siesta.workflows.relax import is_basis_compatible
+
+    inputs = {'structure': generate_structure(), 'basis': generate_basis()}
+    equivalent = {'structure': generate_structure(scale=1.1), 'basis': orm.Dict(dict={
+        'PAO.EnergyShift': '0.3 eV',
+        '%block pao-basis-sizes': """
+        Si DZP
+        SiDiff DZP
+        %endblock pao-basis-sizes""",
+    })}
+    assert is_basis_compatible(inputs, equivalent)
+
+    different = {'structure': generate_structure(), 'basis': orm.Dict(dict={'pao-energy-shift': '100 meV'})}
+    assert not is_basis_compatible(inputs, different)